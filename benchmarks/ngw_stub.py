@@ -0,0 +1,291 @@
+import base64
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import shapely
+from synthetic_layers import FIELDS, feature_name, random_geometries
+
+
+class StubLayer:
+    """
+    Versioned feature layer of the stand-in server.
+
+    The GPKG file is served as the export of the layer, changes are kept in memory by version.
+    Attributes of features depend only on their fids, so only geometries of changed features are kept.
+    """
+
+    # time of the first version, every next version is one second later
+    START_TIME = datetime(2024, 1, 1)
+
+    def __init__(self, layer_id: int, gpkg_path: str, geometry_type: str, feature_count: int, epoch: int = 1):
+        """
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        gpkg_path : str
+            path to the GPKG file of the first version of the layer
+
+        geometry_type : str
+            point or polygon, geometries of changes have the same type
+
+        feature_count : int
+            number of features in the GPKG file, their fids are from 1 to feature_count
+
+        epoch : int
+            epoch of the layer
+        """
+        self.layer_id = layer_id
+        self.gpkg_path = gpkg_path
+        self.geometry_type = geometry_type
+        self.epoch = epoch
+        self.version = 1
+        self.fids = list(range(1, feature_count+1))
+        self.next_fid = feature_count+1
+        self.changes = {}
+        self.geometries = {}
+
+    def etag(self) -> str:
+        return f'"{self.layer_id}-{self.epoch}-{self.version}"'
+
+    def tstamp(self, version: int) -> str:
+        return (self.START_TIME+timedelta(seconds=version)).isoformat()
+
+    def publish(self, rng: np.random.Generator, changes_per_version: int, create_ratio: float = 0.1) -> int:
+        """
+        This function adds one version with random changes: created features and updated geometries and attributes of existing features.
+        Created features have no attributes in the feed, like features created by clients which set attributes later.
+
+
+        Parameters
+        ---------
+        rng : np.random.Generator
+            source of random numbers
+
+        changes_per_version : int
+            number of changed features in the version
+
+        create_ratio : float
+            share of created features among changes
+
+        Returns
+        -------
+        int
+            the new version
+        """
+        version = self.version+1
+        geometries = shapely.to_wkb(random_geometries(rng, self.geometry_type, changes_per_version))
+        creates = int(changes_per_version*create_ratio)
+        updated_fids = rng.choice(self.fids, size=min(changes_per_version-creates, len(self.fids)), replace=False).tolist() if self.fids else []
+
+        items = []
+        for geometry in geometries[:creates]:
+            fid = self.next_fid
+            self.next_fid += 1
+            self.fids.append(fid)
+            items.append({'action': 'feature.create', 'fid': fid, 'vid': version, 'geom': base64.b64encode(geometry).decode('ascii')})
+        for fid, geometry in zip(updated_fids, geometries[creates:]):
+            items.append({
+                'action': 'feature.update', 'fid': fid, 'vid': version,
+                'geom': base64.b64encode(geometry).decode('ascii'),
+                'fields': [[FIELDS[0]['id'], feature_name(fid)]]
+            })
+        for item in items:
+            self.geometries[item['fid']] = item['geom']
+
+        self.changes[version] = items
+        self.version = version
+        return version
+
+    def iter_changes(self, initial: int, target: int):
+        for version in range(initial+1, target+1):
+            yield from self.changes.get(version, ())
+
+
+class StubNGWServer(ThreadingHTTPServer):
+    """
+    Local stand-in of NextGIS Web answering the requests of the geofencer, every request is counted by its route.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, layers: list, page_size: int = 1000, host: str = '127.0.0.1', port: int = 0):
+        """
+        Parameters
+        ---------
+        layers : list
+            StubLayer objects served by the server
+
+        page_size : int
+            number of changes in one page of the changes feed
+
+        host : str
+            address to listen
+
+        port : int
+            port to listen, a free port is chosen if it is 0
+        """
+        super().__init__((host, port), StubNGWHandler)
+        self.layers = {layer.layer_id: layer for layer in layers}
+        self.page_size = page_size
+        self.lock = threading.RLock()
+        self.requests = {}
+        self.bytes_sent = 0
+        self.__thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> None:
+        self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if (self.__thread is not None):
+            self.__thread.join()
+
+    def count(self, route: str, size: int) -> None:
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0)+1
+            self.bytes_sent += size
+
+    def stats(self) -> dict:
+        """
+        This function returns the number of requests by route and the number of bytes sent, counters are reset.
+        """
+        with self.lock:
+            stats = {'requests': self.requests, 'bytes_sent': self.bytes_sent}
+            self.requests = {}
+            self.bytes_sent = 0
+        return stats
+
+
+class StubNGWHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = [
+        ('resource', re.compile(r'^/api/resource/(\d+)/?$')),
+        ('export', re.compile(r'^/api/resource/(\d+)/export/?$')),
+        ('changes_check', re.compile(r'^/api/resource/(\d+)/feature/changes/check/?$')),
+        ('changes_fetch', re.compile(r'^/api/resource/(\d+)/feature/changes/fetch/?$')),
+        ('version', re.compile(r'^/api/resource/(\d+)/feature/version/(\d+)/?$')),
+        ('feature', re.compile(r'^/api/resource/(\d+)/feature/(\d+)/?$')),
+        ('features', re.compile(r'^/api/resource/(\d+)/feature/?$')),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        for route, pattern in self.ROUTES:
+            match = pattern.match(url.path)
+            if (match is None):
+                continue
+            layer = self.server.layers.get(int(match.group(1)))
+            if (layer is None):
+                return self.__send_json(route, {'message': 'Resource not found'}, 404)
+            handler = getattr(self, f'_StubNGWHandler__get_{route}')
+            if (route == 'export'):
+                # the file does not change, so downloads run in parallel
+                return handler(route, layer, query)
+            with self.server.lock:
+                return handler(route, layer, query, *match.groups()[1:])
+        self.__send_json('unknown', {'message': 'Not found'}, 404)
+
+    def __get_resource(self, route: str, layer: StubLayer, query: dict):
+        etag = layer.etag()
+        if (self.headers.get('If-None-Match') == etag):
+            return self.__send(route, b'', 304, {'ETag': etag})
+        body = {
+            'resource': {'id': layer.layer_id, 'cls': 'vector_layer'},
+            'feature_layer': {'fields': FIELDS, 'versioning': {'enabled': True, 'epoch': layer.epoch, 'latest': layer.version}}
+        }
+        self.__send_json(route, body, headers={'ETag': etag})
+
+    def __get_export(self, route: str, layer: StubLayer, query: dict):
+        size = os.path.getsize(layer.gpkg_path)
+        etag = f'"export-{layer.layer_id}-{layer.epoch}-{int(os.path.getmtime(layer.gpkg_path))}"'
+        start = 0
+        range_match = re.match(r'^bytes=(\d+)-$', self.headers.get('Range', ''))
+        if (range_match and self.headers.get('If-Range', etag) == etag):
+            start = int(range_match.group(1))
+            if (start >= size):
+                return self.__send(route, b'', 416, {'Content-Range': f'bytes */{size}'})
+
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Type', 'application/geopackage+sqlite3')
+        self.send_header('Content-Length', str(size-start))
+        self.send_header('ETag', etag)
+        if (start):
+            self.send_header('Content-Range', f'bytes {start}-{size-1}/{size}')
+        self.end_headers()
+        with open(layer.gpkg_path, 'rb') as gpkg_file:
+            gpkg_file.seek(start)
+            shutil.copyfileobj(gpkg_file, self.wfile)
+        self.server.count(route, size-start)
+
+    def __get_changes_check(self, route: str, layer: StubLayer, query: dict):
+        if (int(query.get('epoch', layer.epoch)) != layer.epoch):
+            return self.__send_json(route, {'message': 'Epoch mismatch'}, 422)
+        initial, target = int(query['initial']), int(query['target'])
+        fetch = f'{self.server.url}/api/resource/{layer.layer_id}/feature/changes/fetch?epoch={layer.epoch}&initial={initial}&target={target}&cursor=0'
+        self.__send_json(route, {'epoch': layer.epoch, 'initial': initial, 'target': target, 'fetch': fetch})
+
+    def __get_changes_fetch(self, route: str, layer: StubLayer, query: dict):
+        initial, target, cursor = int(query['initial']), int(query['target']), int(query.get('cursor', 0))
+        changes = layer.iter_changes(initial, target)
+        page = [item for index, item in zip(range(cursor+self.server.page_size+1), changes) if index >= cursor]
+        if (len(page) > self.server.page_size):
+            page = page[:self.server.page_size]
+            page.append({
+                'action': 'continue',
+                'url': f'{self.server.url}/api/resource/{layer.layer_id}/feature/changes/fetch?epoch={layer.epoch}&initial={initial}&target={target}&cursor={cursor+self.server.page_size}'
+            })
+        self.__send_json(route, page)
+
+    def __get_version(self, route: str, layer: StubLayer, query: dict, version: str):
+        version = int(version)
+        if (version < 1 or version > layer.version):
+            return self.__send_json(route, {'message': 'Version not found'}, 404)
+        self.__send_json(route, {'id': version, 'epoch': layer.epoch, 'tstamp': layer.tstamp(version)})
+
+    def __get_feature(self, route: str, layer: StubLayer, query: dict, fid: str):
+        fid = int(fid)
+        if (fid < 1 or fid >= layer.next_fid):
+            return self.__send_json(route, {'message': 'Feature not found'}, 404)
+        feature = {'id': fid, 'fields': {'name': feature_name(fid)}}
+        if (fid in layer.geometries):
+            feature['geom'] = layer.geometries[fid]
+        self.__send_json(route, feature)
+
+    def __get_features(self, route: str, layer: StubLayer, query: dict):
+        fids = [int(fid) for fid in query.get('id__in', '').split(',') if fid]
+        fids = [fid for fid in fids if 1 <= fid < layer.next_fid][:int(query.get('limit', len(fids)))]
+        self.__send_json(route, [{'id': fid, 'fields': {'name': feature_name(fid)}} for fid in fids])
+
+    def __send_json(self, route: str, body, status: int = 200, headers: dict = None):
+        self.__send(route, json.dumps(body).encode('utf-8'), status, dict(headers or {}, **{'Content-Type': 'application/json'}))
+
+    def __send(self, route: str, body: bytes, status: int, headers: dict):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if (body):
+            self.wfile.write(body)
+        self.server.count(route, len(body))
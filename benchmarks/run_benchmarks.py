@@ -0,0 +1,255 @@
+"""
+Benchmarks of the geofencer against a local stand-in of NextGIS Web with synthetic layers.
+
+Every scenario generates a top layer of points or polygons and a bottom layer of polygons, serves them
+from the stand-in server and measures:
+    cold_start - export of layers and preparation of the first cycle without saved state
+    idle_poll - cycles without new versions
+    catch_up - cycles until the geofencer reaches the latest version after versions were published
+    warm_start - preparation of the first cycle with the state saved by the previous run
+Results are written as JSON, so runs of different releases can be compared.
+
+Run with python -O, otherwise debug output of the geofencer is measured too:
+    python -O benchmarks/run_benchmarks.py --features 1000 100000 --geometry point polygon --versions 20 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+import shapely
+from osgeo import gdal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ngw_geofencer import NGWGeofencer
+from ngw_stub import StubLayer, StubNGWServer
+from synthetic_layers import write_layer
+
+TOP_LAYER_ID = 101
+BOTTOM_LAYER_ID = 102
+
+
+def log(message: str) -> None:
+    print(message, file=sys.stderr, flush=True)
+
+
+def environment() -> dict:
+    """
+    The function returns versions of the interpreter, libraries and the code, so results of different machines and releases are not mixed up.
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'gdal': gdal.__version__,
+        'shapely': shapely.__version__,
+        'numpy': np.__version__,
+        'debug': __debug__
+    }
+
+
+def write_config(file_name_and_path: str, host: str, tmp_files_path: str, args: argparse.Namespace, warm_start: bool) -> None:
+    config = {
+        'ngw': {'host': host, 'login': 'benchmark', 'password': 'benchmark'},
+        'top_layer': {'id': TOP_LAYER_ID, 'attribute_params_for_message': ['name'], 'buffer': args.buffer},
+        'bottom_layer': {'id': BOTTOM_LAYER_ID, 'attribute_params_for_message': ['name'], 'buffer': 0},
+        'script_parameters': {
+            'geofence_mode': args.mode,
+            'tmp_files_path': tmp_files_path,
+            'update_period_sec': 1,
+            'message_type': 'console_message',
+            'spatial_index': args.spatial_index,
+            'warm_start': warm_start
+        },
+        'optional_parameters': {'tg_user_id': 0}
+    }
+    with open(file_name_and_path, 'w', encoding='utf-8') as config_file:
+        json.dump(config, config_file, indent=4)
+
+
+def open_geofencer(config_path: str) -> NGWGeofencer:
+    geofencer = NGWGeofencer(config_path)
+    # events are counted instead of being printed
+    geofencer.events_file = open(os.devnull, 'w', encoding='utf-8')
+    return geofencer
+
+
+def close_geofencer(geofencer: NGWGeofencer) -> None:
+    geofencer.close()
+    geofencer.events_file.close()
+
+
+def stage_seconds(geofencer: NGWGeofencer) -> dict:
+    """
+    The function returns the total time in seconds of every stage measured by metrics of the geofencer, metrics are not reset.
+    """
+    stages = ('version_poll', 'diff_fetch', 'version_metadata', 'attributes_fetch', 'geometry_evaluation', 'gpkg_apply', 'commit')
+    return {stage: (geofencer.metrics.get('stage_duration_seconds', stage=stage) or {'sum': 0.0})['sum'] for stage in stages}
+
+
+def check(status: dict, stage: str) -> None:
+    if (status['status'] != 'ok'):
+        raise RuntimeError(f'{stage} failed: {status.get("message")}')
+
+
+def run_scenario(args: argparse.Namespace, geometry_type: str, feature_count: int, work_path: str) -> dict:
+    """
+    The function runs all measurements of one scenario.
+
+
+    Parameters
+    ---------
+    args : argparse.Namespace
+        parameters of the benchmark
+
+    geometry_type : str
+        point or polygon, the geometry type of the top layer
+
+    feature_count : int
+        number of features of the top layer
+
+    work_path : str
+        directory for layers, the configuration and the state of the geofencer
+
+    Returns
+    -------
+    dict
+        parameters of the scenario and the results of measurements in seconds
+    """
+    result = {'geometry': geometry_type, 'features': feature_count, 'bottom_features': args.bottom_features}
+
+    start = time.perf_counter()
+    layers_path = os.path.join(work_path, 'server')
+    write_layer(os.path.join(layers_path, 'top.gpkg'), geometry_type, feature_count, seed=args.seed)
+    write_layer(os.path.join(layers_path, 'bottom.gpkg'), 'polygon', args.bottom_features, seed=args.seed+1, size=args.bottom_size)
+    result['generate_seconds'] = time.perf_counter()-start
+
+    top_layer = StubLayer(TOP_LAYER_ID, os.path.join(layers_path, 'top.gpkg'), geometry_type, feature_count)
+    bottom_layer = StubLayer(BOTTOM_LAYER_ID, os.path.join(layers_path, 'bottom.gpkg'), 'polygon', args.bottom_features)
+    server = StubNGWServer([top_layer, bottom_layer], page_size=args.page_size)
+    server.start()
+    try:
+        tmp_files_path = os.path.join(work_path, 'tmp')
+        cold_config_path = os.path.join(work_path, 'cold.json')
+        warm_config_path = os.path.join(work_path, 'warm.json')
+        write_config(cold_config_path, server.url, tmp_files_path, args, False)
+        write_config(warm_config_path, server.url, tmp_files_path, args, True)
+
+        geofencer = open_geofencer(cold_config_path)
+        try:
+            start = time.perf_counter()
+            check(geofencer.prepare(), 'cold start')
+            result['cold_start'] = {'seconds': time.perf_counter()-start, 'server': server.stats()}
+
+            cycle = geofencer.scheduler.cycle_function
+            idle_times = []
+            for _ in range(args.idle_polls):
+                start = time.perf_counter()
+                check(cycle(), 'idle poll')
+                idle_times.append(time.perf_counter()-start)
+            result['idle_poll'] = {
+                'seconds': idle_times,
+                'median_seconds': statistics.median(idle_times) if idle_times else None,
+                'server': server.stats()
+            }
+
+            rng = np.random.default_rng(args.seed+2)
+            for _ in range(args.versions):
+                top_layer.publish(rng, args.changes_per_version)
+            changes = sum(len(top_layer.changes[version]) for version in top_layer.changes)
+
+            cycles = 0
+            complete = False
+            start = time.perf_counter()
+            while (not complete):
+                status = cycle()
+                check(status, 'catch-up')
+                cycles += 1
+                complete = status.get('complete', True)
+            seconds = time.perf_counter()-start
+            result['catch_up'] = {
+                'seconds': seconds,
+                'versions': args.versions,
+                'changes': changes,
+                'changes_per_second': changes/seconds if seconds else None,
+                'cycles': cycles,
+                'events': geofencer.events_written,
+                'stages': stage_seconds(geofencer),
+                'server': server.stats()
+            }
+        finally:
+            close_geofencer(geofencer)
+
+        geofencer = open_geofencer(warm_config_path)
+        try:
+            start = time.perf_counter()
+            check(geofencer.prepare(), 'warm start')
+            result['warm_start'] = {'seconds': time.perf_counter()-start, 'server': server.stats()}
+        finally:
+            close_geofencer(geofencer)
+    finally:
+        server.stop()
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of the geofencer with a local stand-in of NextGIS Web')
+    parser.add_argument('--features', type=int, nargs='+', default=[1000, 10000], help='numbers of features of the top layer, from 1000 to 1000000')
+    parser.add_argument('--geometry', choices=['point', 'polygon'], nargs='+', default=['point', 'polygon'], help='geometry types of the top layer')
+    parser.add_argument('--bottom-features', type=int, default=1000, help='number of polygons of the bottom layer')
+    parser.add_argument('--bottom-size', type=float, default=500, help='typical size of polygons of the bottom layer in metres')
+    parser.add_argument('--buffer', type=float, default=10, help='buffer of the top layer')
+    parser.add_argument('--mode', choices=['intersection', 'enter_exit', 'dwell', 'nearest'], default='intersection', help='geofence mode')
+    parser.add_argument('--spatial-index', choices=['ogr', 'memory'], default='ogr', help='spatial index of the geofencer')
+    parser.add_argument('--versions', type=int, default=10, help='number of versions published before the catch-up')
+    parser.add_argument('--changes-per-version', type=int, default=100, help='number of changed features in every version')
+    parser.add_argument('--idle-polls', type=int, default=5, help='number of measured cycles without changes')
+    parser.add_argument('--page-size', type=int, default=1000, help='number of changes in one page of the changes feed')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs of every scenario')
+    parser.add_argument('--seed', type=int, default=0, help='seed of synthetic data')
+    parser.add_argument('--work-dir', help='directory for temporary files, a temporary directory is used if it is not set')
+    parser.add_argument('--output', default='benchmark_results.json', help='file for JSON results')
+    args = parser.parse_args()
+
+    results = {
+        'benchmark': 'ngw_geofencer',
+        'created': datetime.now(timezone.utc).isoformat(),
+        'environment': environment(),
+        'parameters': vars(args),
+        'scenarios': []
+    }
+    with tempfile.TemporaryDirectory(prefix='ngw_geofencer_benchmark_', dir=args.work_dir) as work_path:
+        for geometry_type in args.geometry:
+            for feature_count in args.features:
+                for run in range(args.repeat):
+                    log(f'Scenario: {geometry_type} x {feature_count}, run {run+1} of {args.repeat}')
+                    scenario = run_scenario(args, geometry_type, feature_count, os.path.join(work_path, f'{geometry_type}_{feature_count}_{run}'))
+                    scenario['run'] = run
+                    results['scenarios'].append(scenario)
+                    log(f'cold start {scenario["cold_start"]["seconds"]:.2f} s, '
+                        f'idle poll {scenario["idle_poll"]["median_seconds"] or 0:.3f} s, '
+                        f'catch-up {scenario["catch_up"]["seconds"]:.2f} s, '
+                        f'warm start {scenario["warm_start"]["seconds"]:.2f} s')
+
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(results, output_file, indent=4)
+    log(f'Results were written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import os
+import numpy as np
+import shapely
+from osgeo import ogr, osr
+ogr.UseExceptions()
+
+
+# fields of synthetic layers as NGW describes them, ids are used by the changes feed
+FIELDS = [{'id': 1, 'keyname': 'name', 'datatype': 'STRING'}]
+
+# synthetic layers are in Web Mercator, so buffers and distances are in metres near the equator
+EPSG = 3857
+EXTENT = (0.0, 0.0, 100000.0, 100000.0)
+
+# features are written to GPKG in transactions of this size
+TRANSACTION_SIZE = 100000
+
+
+def feature_name(fid: int) -> str:
+    """
+    The function returns the value of the name field of the synthetic feature, it depends only on fid,
+    so the stand-in server answers requests for attributes without keeping them.
+    """
+    return f'feature {fid}'
+
+
+def random_geometries(rng: np.random.Generator, geometry_type: str, count: int, size: float = 50.0) -> np.ndarray:
+    """
+    The function returns random shapely geometries uniformly distributed over EXTENT.
+
+
+    Parameters
+    ---------
+    rng : np.random.Generator
+        source of random numbers, the same seed gives the same geometries
+
+    geometry_type : str
+        point or polygon, polygons are octagons with radius from size/2 to size*2
+
+    count : int
+        number of geometries
+
+    size : float
+        typical size of polygons in metres
+
+    Returns
+    -------
+    np.ndarray
+        array of shapely geometries
+    """
+    min_x, min_y, max_x, max_y = EXTENT
+    x = rng.uniform(min_x, max_x, count)
+    y = rng.uniform(min_y, max_y, count)
+    if (geometry_type == 'point'):
+        return shapely.points(x, y)
+    if (geometry_type != 'polygon'):
+        raise ValueError(f'unknown geometry type {geometry_type}')
+
+    radius = rng.uniform(size/2, size*2, count)
+    angles = np.linspace(0, 2*np.pi, 9)
+    # the last vertex closes the ring
+    angles[-1] = 0
+    rings = np.stack([
+        x[:, None]+radius[:, None]*np.cos(angles),
+        y[:, None]+radius[:, None]*np.sin(angles)
+    ], axis=-1)
+    return shapely.polygons(rings)
+
+
+def write_layer(file_name_and_path: str, geometry_type: str, feature_count: int, seed: int = 0, size: float = 50.0) -> None:
+    """
+    The function writes a synthetic layer in GPKG format as it is exported by NGW: fids start from 1 and every feature has the name field.
+
+
+    Parameters
+    ---------
+    file_name_and_path : str
+        path to the GPKG file, an existing file is replaced
+
+    geometry_type : str
+        point or polygon
+
+    feature_count : int
+        number of features
+
+    seed : int
+        seed of random geometries
+
+    size : float
+        typical size of polygons in metres
+    """
+    directory = os.path.dirname(file_name_and_path)
+    if (directory and not os.path.isdir(directory)): os.makedirs(directory)
+    if (os.path.isfile(file_name_and_path)): os.remove(file_name_and_path)
+
+    spatial_ref = osr.SpatialReference()
+    spatial_ref.ImportFromEPSG(EPSG)
+    ogr_type = ogr.wkbPoint if geometry_type == 'point' else ogr.wkbPolygon
+
+    dataset = ogr.GetDriverByName('GPKG').CreateDataSource(file_name_and_path)
+    try:
+        layer = dataset.CreateLayer('layer', spatial_ref, ogr_type, ['FID=fid'])
+        for field in FIELDS:
+            layer.CreateField(ogr.FieldDefn(field['keyname'], ogr.OFTString))
+        layer_defn = layer.GetLayerDefn()
+
+        rng = np.random.default_rng(seed)
+        for start in range(0, feature_count, TRANSACTION_SIZE):
+            count = min(TRANSACTION_SIZE, feature_count-start)
+            wkb_list = shapely.to_wkb(random_geometries(rng, geometry_type, count, size))
+            layer.StartTransaction()
+            for offset, wkb in enumerate(wkb_list):
+                fid = start+offset+1
+                feature = ogr.Feature(layer_defn)
+                feature.SetFID(fid)
+                feature.SetField('name', feature_name(fid))
+                feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+                layer.CreateFeature(feature)
+            layer.CommitTransaction()
+    finally:
+        dataset = None
@@ -5,7 +5,7 @@ from telegram.ext import (
     ContextTypes
 )
 import logging
-import requests
+import http_client
 from dotenv import load_dotenv
 import os
 
@@ -44,7 +44,7 @@ def send_telegram_message(user_id: int, message_text: str) -> bool:
         "chat_id": user_id,
         "text": message_text
     }
-    response = requests.post(api_url, json=data)
+    response = http_client.get_client().post(api_url, json=data)
     return response.status_code == 200
 
 def main():
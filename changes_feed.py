@@ -0,0 +1,118 @@
+import codecs
+import heapq
+import json
+import os
+import tempfile
+
+
+def iter_json_array(chunks):
+    """
+    The function parses a JSON array incrementally and yields its elements one by one.
+
+
+    Parameters
+    ---------
+    chunks : iterable
+        bytes of the JSON document, for example requests.Response.iter_content
+
+    Returns
+    -------
+    generator
+        elements of the array, ValueError is raised if the document is not a JSON array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    started = False
+    finished = False
+
+    for chunk in chunks:
+        buffer = buffer[position:]+text_decoder.decode(chunk)
+        position = 0
+
+        while (not finished):
+            while (position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ','))):
+                position += 1
+            if (position == len(buffer)):
+                break
+            if (not started):
+                if (buffer[position] != '['):
+                    raise ValueError('The changes feed is not a JSON array')
+                started = True
+                position += 1
+                continue
+            if (buffer[position] == ']'):
+                finished = True
+                break
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the element is not complete yet
+                break
+            if (not isinstance(element, (dict, list, str)) and (end == len(buffer) or not (buffer[end] in ',]' or buffer[end].isspace()))):
+                # a number or a literal is complete only when a delimiter follows it, otherwise it may continue in the next chunk
+                break
+            position = end
+            yield element
+
+    if (not finished):
+        raise ValueError('The changes feed ended before the end of the JSON array')
+
+
+def merge_sorted(items, key, chunk_size: int, tmp_path: str):
+    """
+    The function sorts items with bounded memory. Items are sorted in chunks of chunk_size, every chunk
+    except a single one is written to a temporary JSONL file and the sorted chunks are merged lazily.
+
+
+    Parameters
+    ---------
+    items : iterable
+        JSON serializable items
+
+    key : callable
+        sort key of an item
+
+    chunk_size : int
+        maximum number of items kept in memory while sorting
+
+    tmp_path : str
+        directory for temporary files
+
+    Returns
+    -------
+    tuple
+        the number of items and the iterator over items sorted by key, the sort is stable
+    """
+    runs = []
+    chunk = []
+    count = 0
+    for item in items:
+        chunk.append(item)
+        count += 1
+        if (len(chunk) >= chunk_size):
+            runs.append(_write_run(sorted(chunk, key=key), tmp_path))
+            chunk = []
+
+    if (not runs):
+        return count, iter(sorted(chunk, key=key))
+    if (chunk):
+        runs.append(_write_run(sorted(chunk, key=key), tmp_path))
+    return count, heapq.merge(*(_read_run(run) for run in runs), key=key)
+
+
+def _write_run(items: list, tmp_path: str):
+    if (not os.path.isdir(tmp_path)): os.makedirs(tmp_path)
+    run = tempfile.TemporaryFile(mode='w+', encoding='utf-8', dir=tmp_path, suffix='.jsonl')
+    for item in items:
+        run.write(json.dumps(item, ensure_ascii=False))
+        run.write('\n')
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    with run:
+        for line in run:
+            yield json.loads(line)
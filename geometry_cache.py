@@ -0,0 +1,212 @@
+from collections import OrderedDict
+import numpy as np
+import shapely
+
+
+class GeometryCache:
+    """
+    LRU cache of geometries derived from layer features (for example buffered geometries).
+
+    Keys are tuples which start with (layer_id, fid, version, ...), so all entries of one
+    feature can be invalidated when the feature is updated or deleted. The cache is limited
+    by the approximate memory size of the stored geometries.
+    """
+
+    def __init__(self, max_size_bytes: int, size_of):
+        """
+        Parameters
+        ---------
+        max_size_bytes : int
+            memory cap of the cache, 0 turns the cache off
+
+        size_of : callable
+            function returning the approximate size of a geometry in bytes
+        """
+        self.max_size_bytes = max_size_bytes
+        self.size_of = size_of
+
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__entries = OrderedDict()
+        self.__keys_by_feature = {}
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key: tuple, compute):
+        """
+        This function returns the cached geometry for the key or computes, caches and returns it.
+
+
+        Parameters
+        ---------
+        key : tuple
+            (layer_id, fid, version, ...) key of the geometry
+
+        compute : callable
+            function without arguments that builds the geometry on a cache miss
+
+        Returns
+        -------
+        object
+            the cached or the computed geometry
+        """
+        entry = self.__entries.get(key)
+        if (entry is not None):
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        geometry = compute()
+        if (self.max_size_bytes <= 0 or geometry is None):
+            return geometry
+
+        size = self.size_of(geometry)
+        if (size > self.max_size_bytes):
+            return geometry
+
+        self.__entries[key] = (geometry, size)
+        self.__keys_by_feature.setdefault(key[:2], set()).add(key)
+        self.size_bytes += size
+
+        while (self.size_bytes > self.max_size_bytes):
+            old_key, _ = next(iter(self.__entries.items()))
+            self.__remove(old_key)
+            self.evictions += 1
+        return geometry
+
+    def invalidate(self, layer_id: int, fid: int) -> None:
+        """
+        This function removes all cached geometries of the feature.
+        """
+        for key in list(self.__keys_by_feature.get((layer_id, fid), ())):
+            self.__remove(key)
+
+    def clear(self) -> None:
+        """
+        This function removes all cached geometries.
+        """
+        self.__entries.clear()
+        self.__keys_by_feature.clear()
+        self.size_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        This function returns a dict with hits, misses, evictions, number of entries and size of the cache in bytes.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.__entries),
+            'size_bytes': self.size_bytes
+        }
+
+    def __remove(self, key: tuple) -> None:
+        geometry, size = self.__entries.pop(key)
+        self.size_bytes -= size
+        feature_keys = self.__keys_by_feature.get(key[:2])
+        if (feature_keys is not None):
+            feature_keys.discard(key)
+            if (not feature_keys):
+                del self.__keys_by_feature[key[:2]]
+
+
+class PreparedGeometryCache:
+    """
+    Bounded LRU set of shapely geometries prepared with GEOS PreparedGeometry.
+
+    A geometry is prepared in place after it was tested several times, so shapely predicates
+    called with it use the prepared version. Evicted and invalidated geometries are unprepared.
+    """
+
+    def __init__(self, max_entries: int, min_hits: int = 2):
+        """
+        Parameters
+        ---------
+        max_entries : int
+            maximum number of prepared geometries, 0 turns the cache off
+
+        min_hits : int
+            number of tests of the feature after which its geometry is prepared
+        """
+        self.max_entries = max_entries
+        self.min_hits = min_hits
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__entries = OrderedDict()
+        self.__hit_counts = {}
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def prepare(self, layer_id: int, fids, geometries) -> None:
+        """
+        This function registers tests of the features and prepares geometries of the features which are tested often.
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        fids : array-like
+            fids of the tested features, may contain duplicates
+
+        geometries : array-like
+            shapely geometries of the features in the same order as fids
+        """
+        if (self.max_entries <= 0):
+            return
+
+        for fid, geometry in dict(zip(np.asarray(fids).tolist(), geometries)).items():
+            key = (layer_id, fid)
+            if (key in self.__entries):
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                continue
+
+            self.misses += 1
+            if (geometry is None):
+                continue
+            hit_count = self.__hit_counts.get(key, 0)+1
+            if (hit_count < self.min_hits):
+                if (len(self.__hit_counts) >= 10*self.max_entries):
+                    self.__hit_counts.clear()
+                self.__hit_counts[key] = hit_count
+                continue
+
+            self.__hit_counts.pop(key, None)
+            shapely.prepare(geometry)
+            self.__entries[key] = geometry
+            if (len(self.__entries) > self.max_entries):
+                _, old_geometry = self.__entries.popitem(last=False)
+                shapely.destroy_prepared(old_geometry)
+                self.evictions += 1
+
+    def invalidate(self, layer_id: int, fid: int) -> None:
+        """
+        This function forgets the feature and unprepares its geometry.
+        """
+        self.__hit_counts.pop((layer_id, fid), None)
+        geometry = self.__entries.pop((layer_id, fid), None)
+        if (geometry is not None):
+            shapely.destroy_prepared(geometry)
+
+    def stats(self) -> dict:
+        """
+        This function returns a dict with hits, misses, evictions and number of prepared geometries.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.__entries)
+        }
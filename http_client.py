@@ -0,0 +1,159 @@
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpClient:
+    """
+    HTTP client shared by all NGW and Telegram calls.
+
+    It keeps one requests session with a pool of keep-alive connections, sets default timeouts,
+    retries idempotent requests with exponential backoff on connection errors and 5xx responses and collects
+    latency and retry counters for every endpoint.
+    """
+
+    # other methods are sent once, a retry could repeat an action the server already did (for example send a message twice)
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 10, read_timeout: float = 120, retries: int = 3, backoff: float = 0.5):
+        """
+        Parameters
+        ---------
+        pool_size : int
+            maximum number of kept connections to one host
+
+        connect_timeout : float
+            timeout in seconds to establish a connection
+
+        read_timeout : float
+            timeout in seconds to wait for data from the server
+
+        retries : int
+            number of retries after the first failed attempt
+
+        backoff : float
+            delay in seconds before the first retry, it is doubled for every next one
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        This function sends the request through the pooled session and retries it on connection errors and 5xx responses if the method is idempotent.
+
+
+        Parameters
+        ---------
+        method : str
+            HTTP method
+
+        url : str
+            full URL of the request
+
+        kwargs
+            other parameters of requests.Session.request
+
+        Returns
+        -------
+        requests.Response
+            the response of the last attempt, the exception of the last attempt is raised if no response was received
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = self.__get_endpoint(method, url)
+        retries = self.retries if method.upper() in self.IDEMPOTENT_METHODS else 0
+
+        for attempt in range(retries+1):
+            start = time.perf_counter()
+            response, error = None, None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            self.__record(endpoint, time.perf_counter()-start, attempt > 0, response is None or response.status_code >= 500, self.__get_size(response))
+
+            if (response is not None and response.status_code < 500):
+                return response
+            if (attempt == retries):
+                if (response is not None):
+                    return response
+                raise error
+
+            if (response is not None):
+                response.close()
+            time.sleep(self.backoff*2**attempt)
+
+    def stats(self) -> dict:
+        """
+        This function returns a dict with endpoint as key and dict with number of calls, retries, errors, received bytes, total and maximum latency in seconds as value.
+        """
+        with self.__lock:
+            return {endpoint: dict(values) for endpoint, values in self.__stats.items()}
+
+    def __record(self, endpoint: str, latency: float, is_retry: bool, is_error: bool, size: int) -> None:
+        with self.__lock:
+            values = self.__stats.setdefault(endpoint, {'calls': 0, 'retries': 0, 'errors': 0, 'bytes': 0, 'total_time': 0.0, 'max_time': 0.0})
+            values['calls'] += 1
+            values['retries'] += int(is_retry)
+            values['errors'] += int(is_error)
+            values['bytes'] += size
+            values['total_time'] += latency
+            values['max_time'] = max(values['max_time'], latency)
+
+    @staticmethod
+    def __get_size(response: requests.Response) -> int:
+        # streamed bodies are not read yet, so the size is taken from the headers, it is 0 for chunked responses
+        if (response is None):
+            return 0
+        try:
+            return int(response.headers.get('Content-Length', 0))
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def __get_endpoint(method: str, url: str) -> str:
+        # ids and the bot token are removed from the path, so requests to the same API are counted together
+        path = re.sub(r'^[a-z]+://[^/]+', '', url).split('?')[0]
+        path = re.sub(r'/bot[^/]+/', '/bot{token}/', path)
+        path = re.sub(r'/\d+(?=/|$)', '/{id}', path)
+        return f'{method} {path}'
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def configure(**params) -> HttpClient:
+    """
+    The function replaces the shared client with a new one created with the given parameters of HttpClient.
+    """
+    global _client
+    with _client_lock:
+        _client = HttpClient(**params)
+        return _client
+
+def get_client() -> HttpClient:
+    """
+    The function returns the shared client, it is created with default parameters on the first call.
+    """
+    global _client
+    with _client_lock:
+        if (_client is None):
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+
+
+class MembershipStore:
+    """
+    Persistent set of memberships of top layer features in bottom layer features.
+
+    Memberships are kept in a SQLite table without rowid keyed by (top_layer_id, bottom_layer_id, top_fid, bottom_fid),
+    so millions of them take little memory and the memberships of one feature are read by an index lookup.
+    Every membership keeps the time when it started and whether the dwell event was sent for it.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Parameters
+        ---------
+        db_path : str
+            path to the SQLite file, its directory is created if it does not exist
+        """
+        directory = os.path.dirname(db_path)
+        if (directory and not os.path.isdir(directory)): os.makedirs(directory)
+
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS membership ('
+            'top_layer_id INTEGER NOT NULL, bottom_layer_id INTEGER NOT NULL, '
+            'top_fid INTEGER NOT NULL, bottom_fid INTEGER NOT NULL, '
+            'since REAL NOT NULL, dwell_reported INTEGER NOT NULL DEFAULT 0, '
+            'PRIMARY KEY (top_layer_id, bottom_layer_id, top_fid, bottom_fid)) WITHOUT ROWID'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS membership_bottom ON membership (top_layer_id, bottom_layer_id, bottom_fid)'
+        )
+        # dwell checks of every cycle read only memberships without the dwell event, so they do not scan the pair
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS membership_dwelling ON membership (top_layer_id, bottom_layer_id, since) WHERE dwell_reported=0'
+        )
+
+    def begin(self) -> None:
+        if (not self.connection.in_transaction):
+            self.connection.execute('BEGIN')
+
+    def commit(self) -> None:
+        if (self.connection.in_transaction):
+            self.connection.execute('COMMIT')
+
+    def rollback(self) -> None:
+        if (self.connection.in_transaction):
+            self.connection.execute('ROLLBACK')
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get(self, top_layer_id: int, bottom_layer_id: int, role: str, fid: int) -> dict:
+        """
+        This function returns memberships of the feature of the pair.
+
+
+        Parameters
+        ---------
+        top_layer_id : int
+            unique ID of the top layer of the pair
+
+        bottom_layer_id : int
+            unique ID of the bottom layer of the pair
+
+        role : str
+            top or bottom, the layer of the feature in the pair
+
+        fid : int
+            fid of the feature
+
+        Returns
+        -------
+        dict
+            fids of the features of the opposite layer as keys and tuples (since, dwell_reported) as values
+        """
+        if (role == 'top'):
+            query = 'SELECT bottom_fid, since, dwell_reported FROM membership WHERE top_layer_id=? AND bottom_layer_id=? AND top_fid=?'
+        else:
+            query = 'SELECT top_fid, since, dwell_reported FROM membership WHERE top_layer_id=? AND bottom_layer_id=? AND bottom_fid=?'
+        return {
+            opposite_fid: (since, bool(dwell_reported))
+            for opposite_fid, since, dwell_reported in self.connection.execute(query, (top_layer_id, bottom_layer_id, fid))
+        }
+
+    def add(self, top_layer_id: int, bottom_layer_id: int, memberships, dwell_reported: bool = False) -> None:
+        """
+        This function adds memberships, memberships are tuples (top_fid, bottom_fid, since).
+        If dwell_reported is true, the memberships do not produce dwell events.
+        """
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO membership (top_layer_id, bottom_layer_id, top_fid, bottom_fid, since, dwell_reported) VALUES (?, ?, ?, ?, ?, ?)',
+            ((top_layer_id, bottom_layer_id, top_fid, bottom_fid, since, int(dwell_reported)) for top_fid, bottom_fid, since in memberships)
+        )
+
+    def remove(self, top_layer_id: int, bottom_layer_id: int, memberships) -> None:
+        """
+        This function removes memberships, memberships are tuples (top_fid, bottom_fid).
+        """
+        self.connection.executemany(
+            'DELETE FROM membership WHERE top_layer_id=? AND bottom_layer_id=? AND top_fid=? AND bottom_fid=?',
+            ((top_layer_id, bottom_layer_id, top_fid, bottom_fid) for top_fid, bottom_fid in memberships)
+        )
+
+    def clear(self, top_layer_id: int, bottom_layer_id: int) -> None:
+        """
+        This function removes all memberships of the pair.
+        """
+        self.connection.execute('DELETE FROM membership WHERE top_layer_id=? AND bottom_layer_id=?', (top_layer_id, bottom_layer_id))
+
+    def get_dwelling(self, top_layer_id: int, bottom_layer_id: int, started_before: float) -> list:
+        """
+        This function returns tuples (top_fid, bottom_fid, since) of memberships of the pair which started before the time and have no dwell event yet.
+        """
+        return self.connection.execute(
+            'SELECT top_fid, bottom_fid, since FROM membership WHERE top_layer_id=? AND bottom_layer_id=? AND dwell_reported=0 AND since<=?',
+            (top_layer_id, bottom_layer_id, started_before)
+        ).fetchall()
+
+    def set_dwell_reported(self, top_layer_id: int, bottom_layer_id: int, memberships) -> None:
+        """
+        This function marks memberships as reported by the dwell event, memberships are tuples (top_fid, bottom_fid).
+        """
+        self.connection.executemany(
+            'UPDATE membership SET dwell_reported=1 WHERE top_layer_id=? AND bottom_layer_id=? AND top_fid=? AND bottom_fid=?',
+            ((top_layer_id, bottom_layer_id, top_fid, bottom_fid) for top_fid, bottom_fid in memberships)
+        )
+
+    def count(self, top_layer_id: int, bottom_layer_id: int) -> int:
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM membership WHERE top_layer_id=? AND bottom_layer_id=?', (top_layer_id, bottom_layer_id)
+        ).fetchone()[0]
@@ -0,0 +1,204 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsRegistry:
+    """
+    Registry of counters, gauges and histograms rendered in the Prometheus text format.
+
+    Metrics are declared once by name and updated with labels given as keyword arguments.
+    Collectors are functions called before rendering, they copy statistics of other components
+    (HTTP client, caches, notification queue) into metrics, so those components do not depend on the registry.
+    """
+
+    # upper bounds of histogram buckets in seconds
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, prefix: str = 'ngw_geofencer'):
+        """
+        Parameters
+        ---------
+        prefix : str
+            prefix of names of all metrics
+        """
+        self.prefix = prefix
+        self.__metrics = {}
+        self.__collectors = []
+        self.__lock = threading.Lock()
+
+    def counter(self, name: str, help: str) -> None:
+        self.__declare(name, 'counter', help)
+
+    def gauge(self, name: str, help: str) -> None:
+        self.__declare(name, 'gauge', help)
+
+    def histogram(self, name: str, help: str, buckets: tuple = None) -> None:
+        self.__declare(name, 'histogram', help, tuple(sorted(buckets or self.DEFAULT_BUCKETS)))
+
+    def add_collector(self, collector) -> None:
+        """
+        This function adds the function without arguments which is called before every rendering to update metrics.
+        """
+        self.__collectors.append(collector)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        This function increases the counter or the gauge.
+        """
+        key = self.__get_key(labels)
+        with self.__lock:
+            values = self.__metrics[name]['values']
+            values[key] = values.get(key, 0)+value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """
+        This function sets the value of the gauge, collectors also set counters copied from statistics of other components.
+        """
+        key = self.__get_key(labels)
+        with self.__lock:
+            self.__metrics[name]['values'][key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        This function adds the value to the histogram.
+        """
+        key = self.__get_key(labels)
+        with self.__lock:
+            metric = self.__metrics[name]
+            values = metric['values'].get(key)
+            if (values is None):
+                values = metric['values'][key] = {'buckets': [0]*len(metric['buckets']), 'sum': 0.0, 'count': 0}
+            for position, bound in enumerate(metric['buckets']):
+                if (value <= bound):
+                    values['buckets'][position] += 1
+                    break
+            values['sum'] += value
+            values['count'] += 1
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """
+        This function adds the time in seconds spent in the with block to the histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter()-start, **labels)
+
+    def get(self, name: str, **labels):
+        """
+        This function returns the value of the counter or the gauge or the dict with buckets, sum and count of the histogram, None if there is no value.
+        """
+        key = self.__get_key(labels)
+        with self.__lock:
+            value = self.__metrics[name]['values'].get(key)
+            return dict(value, buckets=list(value['buckets'])) if isinstance(value, dict) else value
+
+    def render(self) -> str:
+        """
+        This function calls collectors and returns all metrics in the Prometheus text format.
+        """
+        for collector in self.__collectors:
+            try:
+                collector()
+            except Exception as e:
+                if __debug__:
+                    print(f"Error in the metrics collector: {e}\n")
+
+        lines = []
+        with self.__lock:
+            for name, metric in self.__metrics.items():
+                full_name = f'{self.prefix}_{name}'
+                lines.append(f'# HELP {full_name} {metric["help"]}')
+                lines.append(f'# TYPE {full_name} {metric["type"]}')
+                for key, value in sorted(metric['values'].items()):
+                    if (metric['type'] != 'histogram'):
+                        lines.append(f'{full_name}{self.__format_labels(key)} {self.__format_value(value)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(metric['buckets'], value['buckets']):
+                        cumulative += count
+                        lines.append(f'{full_name}_bucket{self.__format_labels(key+(("le", self.__format_value(bound)),))} {cumulative}')
+                    lines.append(f'{full_name}_bucket{self.__format_labels(key+(("le", "+Inf"),))} {value["count"]}')
+                    lines.append(f'{full_name}_sum{self.__format_labels(key)} {self.__format_value(value["sum"])}')
+                    lines.append(f'{full_name}_count{self.__format_labels(key)} {value["count"]}')
+        return '\n'.join(lines)+'\n'
+
+    def __declare(self, name: str, metric_type: str, help: str, buckets: tuple = None) -> None:
+        with self.__lock:
+            if (name not in self.__metrics):
+                self.__metrics[name] = {'type': metric_type, 'help': help, 'buckets': buckets, 'values': {}}
+
+    @staticmethod
+    def __get_key(labels: dict) -> tuple:
+        return tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    @staticmethod
+    def __format_labels(key: tuple) -> str:
+        if (not key):
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+        return '{'+','.join(f'{label}="{value}"' for (label, _), value in zip(key, escaped))+'}'
+
+    @staticmethod
+    def __format_value(value: float) -> str:
+        if (isinstance(value, float) and math.isinf(value)):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    HTTP server answering GET /metrics with metrics of the registry, it runs in a background thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = '127.0.0.1'):
+        """
+        Parameters
+        ---------
+        registry : MetricsRegistry
+            the registry to render
+
+        port : int
+            port to listen
+
+        host : str
+            address to listen, only local clients can connect by default
+        """
+        super().__init__((host, port), MetricsHandler)
+        self.registry = registry
+        self.__thread = None
+
+    def start(self) -> None:
+        self.__thread = threading.Thread(target=self.serve_forever, name='metrics-server', daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if (self.__thread is not None):
+            self.__thread.join()
+            self.__thread = None
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if (self.path.split('?')[0] != '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -1,12 +1,17 @@
-import requests
 import json
+import sqlite3
 import jsonschema
 from jsonschema import validate
 import os
-import schedule
+import shutil
+import tempfile
 import time
 import base64
-from datetime import datetime
+import heapq
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import shapely
@@ -15,13 +20,57 @@ from shapely.wkt import loads
 from osgeo import gdal, ogr, osr
 ogr.UseExceptions()
 import bot_for_message
+import http_client
+from notification_dispatcher import NotificationDispatcher
+from spatial_index import LayerSpatialIndex
+from geometry_cache import GeometryCache, PreparedGeometryCache
+from version_cache import VersionCache
+from scheduler import PollScheduler
+from membership_store import MembershipStore
+from reprojection import MetricReprojector
+from changes_feed import iter_json_array, merge_sorted
+from state_store import StateStore
+from metrics import MetricsRegistry, MetricsServer
+from profiler import CycleProfiler
 
 class ErrorConnection(Exception):
     pass
 
 class NGWGeofencer:
 
+    # data file of previous versions of the program, it is imported to the state store once
     DATA_FILE_NAME = 'data.json'
+    STATE_FILE_NAME = 'state.sqlite'
+
+    # number of features in one request for attributes and the filter by feature ids of NGW feature collection API
+    ATTRIBUTES_PAGE_SIZE = 500
+    FEATURE_ID_FILTER = 'id__in'
+
+    # roles of layers in a pair and the opposite role for each of them
+    ROLES = ('top', 'bottom')
+    OPPOSITE_ROLE = {'top': 'bottom', 'bottom': 'top'}
+
+    # geofence modes which keep memberships of top layer features in bottom layer features and report only their changes
+    STATEFUL_MODES = ('enter_exit', 'dwell')
+
+    # metadata items of local GPKG files with the version and the epoch of the layer applied to the file
+    MIRROR_VERSION_ITEM = 'GEOFENCER_MIRROR_VERSION'
+    MIRROR_EPOCH_ITEM = 'GEOFENCER_MIRROR_EPOCH'
+
+    # The schema of layer parameters in config.json
+    LAYER_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "id": {"type": "number"},
+            "attribute_params_for_message": {
+                "type": "array",
+                "items": {"type": "string"},
+                "minItems": 1
+            },
+            "buffer": {"type": "number"},
+        },
+        "required": ["id", "attribute_params_for_message", "buffer"],
+    }
 
     # The schema to check the correctness of config.json
     CONFIG_SCHEMA = {
@@ -36,45 +85,94 @@ class NGWGeofencer:
                 },
                 "required": ["host", "login", "password"],
             },
-            "top_layer": {
-                "type": "object",
-                "properties": {
-                    "id": {"type": "number"},
-                    "attribute_params_for_message": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "minItems": 1
-                    },
-                    "buffer": {"type": "number"},
-                },
-                "required": ["id", "attribute_params_for_message", "buffer"],
-            },
-            "bottom_layer": {
-                "type": "object",
-                "properties": {
-                    "id": {"type": "number"},
-                    "attribute_params_for_message": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "minItems": 1
+            "top_layer": LAYER_SCHEMA,
+            "bottom_layer": LAYER_SCHEMA,
+            "pairs": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "top_layer": LAYER_SCHEMA,
+                        "bottom_layer": LAYER_SCHEMA,
                     },
-                    "buffer": {"type": "number"},
+                    "required": ["top_layer", "bottom_layer"],
                 },
-                "required": ["id", "attribute_params_for_message", "buffer"],
+                "minItems": 1
             },
             "script_parameters": {
                 "type": "object",
                 "properties": {
                     "geofence_mode": {
                         "type": "string",
-                        "enum": ["intersection"]
+                        "enum": ["intersection", "enter_exit", "dwell", "nearest"]
                     },
+                    "dwell_time_sec": {"type": "number", "minimum": 0},
+                    "nearest_max_distance": {"type": "number", "exclusiveMinimum": 0},
+                    "metric_crs": {"type": "string"},
                     "tmp_files_path": {"type": "string"},
                     "update_period_sec": {"type": "number", "minimum": 1},
                     "message_type": {
                         "type": "string",
                         "enum": ["console_message", "telegram_message"]
                     },
+                    "spatial_index": {
+                        "type": "string",
+                        "enum": ["ogr", "memory"]
+                    },
+                    "buffer_cache_mb": {"type": "number", "minimum": 0},
+                    "prepared_cache_size": {"type": "integer", "minimum": 0},
+                    "max_concurrent_requests": {"type": "integer", "minimum": 1},
+                    "download_chunk_mb": {"type": "number", "exclusiveMinimum": 0},
+                    "changes_chunk_size": {"type": "integer", "minimum": 1},
+                    "catch_up_window_versions": {"type": "integer", "minimum": 1},
+                    "warm_start": {"type": "boolean"},
+                    "metrics_port": {"type": "integer", "minimum": 1, "maximum": 65535},
+                    "notifications": {
+                        "type": "object",
+                        "properties": {
+                            "workers": {"type": "integer", "minimum": 1},
+                            "queue_size": {"type": "integer", "minimum": 1},
+                            "rate_per_chat_per_sec": {"type": "number", "exclusiveMinimum": 0},
+                            "burst": {"type": "integer", "minimum": 1},
+                            "retries": {"type": "integer", "minimum": 0},
+                            "backoff_sec": {"type": "number", "minimum": 0},
+                            "coalesce": {"type": "boolean"},
+                        },
+                    },
+                    "sqlite_pragmas": {
+                        "type": "object",
+                        "additionalProperties": {"type": ["string", "number"]}
+                    },
+                    "profiling": {
+                        "type": "object",
+                        "properties": {
+                            "cycles": {"type": "integer", "minimum": 0},
+                            "cycles_per_trigger": {"type": "integer", "minimum": 1},
+                            "slow_cycle_sec": {"type": "number", "exclusiveMinimum": 0},
+                        },
+                    },
+                    "scheduler": {
+                        "type": "object",
+                        "properties": {
+                            "min_interval_sec": {"type": "number", "minimum": 0},
+                            "max_interval_sec": {"type": "number", "minimum": 1},
+                            "idle_factor": {"type": "number", "minimum": 1},
+                            "error_factor": {"type": "number", "minimum": 1},
+                            "jitter": {"type": "number", "minimum": 0, "maximum": 1},
+                            "cycle_time_budget_sec": {"type": "number", "exclusiveMinimum": 0},
+                            "max_versions_per_cycle": {"type": "integer", "minimum": 1},
+                        },
+                    },
+                    "http": {
+                        "type": "object",
+                        "properties": {
+                            "pool_size": {"type": "integer", "minimum": 1},
+                            "connect_timeout_sec": {"type": "number", "exclusiveMinimum": 0},
+                            "read_timeout_sec": {"type": "number", "exclusiveMinimum": 0},
+                            "retries": {"type": "integer", "minimum": 0},
+                            "backoff_sec": {"type": "number", "minimum": 0},
+                        },
+                    },
                 },
                 "required": ["geofence_mode", "tmp_files_path", "update_period_sec", "message_type"],
             },
@@ -85,7 +183,12 @@ class NGWGeofencer:
                 },
             },
         },
-        "required": ["ngw", "top_layer", "bottom_layer", "script_parameters"],
+        "required": ["ngw", "script_parameters"],
+        # either the list of layer pairs or one pair of top and bottom layers
+        "anyOf": [
+            {"required": ["pairs"]},
+            {"required": ["top_layer", "bottom_layer"]},
+        ],
     }
 
     def __init__(self, config_path='config.json'):
@@ -100,33 +203,93 @@ class NGWGeofencer:
                 self.ngw_login = config['ngw']['login']
                 self.ngw_password = config['ngw']['password']
                 
-                # top layer parameters
-                self.top_layer_id = config['top_layer']['id']
-                self.top_layer_attr_params = config['top_layer']['attribute_params_for_message']
-                self.top_layer_buffer = config['top_layer']['buffer']
-                
-                # bottom layer parameters
-                self.bottom_layer_id = config['bottom_layer']['id']
-                self.bottom_layer_attr_params = config['bottom_layer']['attribute_params_for_message']
-                self.bottom_layer_buffer = config['bottom_layer']['buffer']
+                # pairs of top and bottom layer parameters, attr_dict of a layer is filled when fields of the layer are received
+                pairs_config = config['pairs'] if 'pairs' in config else [{'top_layer': config['top_layer'], 'bottom_layer': config['bottom_layer']}]
+                self.pairs = []
+                for pair_config in pairs_config:
+                    pair = {
+                        role: {
+                            'id': pair_config[f'{role}_layer']['id'],
+                            'attr_params': pair_config[f'{role}_layer']['attribute_params_for_message'],
+                            'buffer': pair_config[f'{role}_layer']['buffer'],
+                            'attr_dict': {}
+                        }
+                        for role in self.ROLES
+                    }
+                    if (pair['top']['id'] == pair['bottom']['id']):
+                        raise ValueError(f"the layer with id {pair['top']['id']} can not be the top and the bottom layer of one pair")
+                    self.pairs.append(pair)
+
+                # every distinct layer is polled and stored once, whatever the number of pairs using it
+                self.layer_ids = list(dict.fromkeys(pair[role]['id'] for pair in self.pairs for role in self.ROLES))
+                self.layer_roles = {layer_id: [] for layer_id in self.layer_ids}
+                self.layer_attr_params = {layer_id: [] for layer_id in self.layer_ids}
+                for pair in self.pairs:
+                    for role in self.ROLES:
+                        self.layer_roles[pair[role]['id']].append((pair, role))
+                        self.layer_attr_params[pair[role]['id']].extend(pair[role]['attr_params'])
                 
                 # script working parameters
                 self.geofence_mode = config['script_parameters']['geofence_mode']
+                self.dwell_time_sec = config['script_parameters'].get('dwell_time_sec', 300)
+                self.nearest_max_distance = config['script_parameters'].get('nearest_max_distance', 1000)
+                self.metric_crs = config['script_parameters'].get('metric_crs')
                 self.tmp_files_path = config['script_parameters']['tmp_files_path']
                 self.update_period_sec = config['script_parameters']['update_period_sec']
                 self.message_type = config['script_parameters']['message_type']
+                self.spatial_index = config['script_parameters'].get('spatial_index', 'ogr')
+                self.buffer_cache_mb = config['script_parameters'].get('buffer_cache_mb', 256)
+                self.prepared_cache_size = config['script_parameters'].get('prepared_cache_size', 10000)
+                self.max_concurrent_requests = config['script_parameters'].get('max_concurrent_requests', 8)
+                self.warm_start = config['script_parameters'].get('warm_start', True)
+                self.metrics_port = config['script_parameters'].get('metrics_port')
+                self.sqlite_pragmas = config['script_parameters'].get('sqlite_pragmas', {"synchronous": "NORMAL", "cache_size": -65536, "temp_store": "MEMORY"})
+                self.download_chunk_size = int(config['script_parameters'].get('download_chunk_mb', 1)*1024*1024)
+                self.changes_chunk_size = config['script_parameters'].get('changes_chunk_size', 10000)
+                self.catch_up_window_versions = config['script_parameters'].get('catch_up_window_versions', 1000)
+                self.http_params = config['script_parameters'].get('http', {})
+                self.notification_params = config['script_parameters'].get('notifications', {})
+                self.scheduler_params = config['script_parameters'].get('scheduler', {})
+                self.profiling_params = config['script_parameters'].get('profiling', {})
                 self.tg_user_id = config['optional_parameters']['tg_user_id']
 
+                if (self.geofence_mode == 'nearest' and self.spatial_index != 'memory'):
+                    raise ValueError('geofence mode nearest needs spatial_index memory')
+
+                # transformations of layers into the metric CRS, buffers and distances are in the units of layers if it is not set,
+                # it is built here so a wrong CRS is reported as an error of the configuration
+                self.reprojector = MetricReprojector(self.metric_crs) if self.metric_crs else None
+
             if __debug__:
                 print(  f"hostname: {self.ngw_host}\n"
                         f"login: {self.ngw_login}\n"
                         f"password: {self.ngw_password}\n"
-                        f"top layer info: id - {self.top_layer_id}; fields to display - {self.top_layer_attr_params}; buffer size - {self.top_layer_buffer}\n"
-                        f"bottom layer info: id - {self.bottom_layer_id}; fields to display - {self.bottom_layer_attr_params}; buffer size - {self.bottom_layer_buffer}\n"
+                        + ''.join(
+                            f"top layer info: id - {pair['top']['id']}; fields to display - {pair['top']['attr_params']}; buffer size - {pair['top']['buffer']}\n"
+                            f"bottom layer info: id - {pair['bottom']['id']}; fields to display - {pair['bottom']['attr_params']}; buffer size - {pair['bottom']['buffer']}\n"
+                            for pair in self.pairs
+                        ) +
                         f"geofence mode: {self.geofence_mode}\n"
+                        f"dwell time in secs: {self.dwell_time_sec}\n"
+                        f"nearest max distance: {self.nearest_max_distance}\n"
+                        f"metric CRS: {self.metric_crs}\n"
                         f"tmp files path: {self.tmp_files_path}\n"
                         f"update period in secs: {self.update_period_sec}\n"
                         f"message type: {self.message_type}\n"
+                        f"spatial index: {self.spatial_index}\n"
+                        f"buffer cache size in MB: {self.buffer_cache_mb}\n"
+                        f"prepared geometries cache size: {self.prepared_cache_size}\n"
+                        f"max concurrent requests: {self.max_concurrent_requests}\n"
+                        f"warm start: {self.warm_start}\n"
+                        f"metrics port: {self.metrics_port}\n"
+                        f"sqlite pragmas: {self.sqlite_pragmas}\n"
+                        f"download chunk size in bytes: {self.download_chunk_size}\n"
+                        f"changes chunk size: {self.changes_chunk_size}\n"
+                        f"catch-up window in versions: {self.catch_up_window_versions}\n"
+                        f"http parameters: {self.http_params}\n"
+                        f"notification parameters: {self.notification_params}\n"
+                        f"scheduler parameters: {self.scheduler_params}\n"
+                        f"profiling parameters: {self.profiling_params}\n"
                         )
         except FileNotFoundError:
             raise ErrorConnection(f"Error: File '{config_path}' not found.")
@@ -137,6 +300,146 @@ class NGWGeofencer:
         except Exception as e:
             raise ErrorConnection(f"Error when opening the file '{config_path}': {e}")
 
+        # pooled HTTP client shared with the Telegram bot
+        self.http = http_client.configure(
+            pool_size=self.http_params.get('pool_size', max(10, self.max_concurrent_requests)),
+            connect_timeout=self.http_params.get('connect_timeout_sec', 10),
+            read_timeout=self.http_params.get('read_timeout_sec', 120),
+            retries=self.http_params.get('retries', 3),
+            backoff=self.http_params.get('backoff_sec', 0.5)
+        )
+
+        # local GPKG files are kept opened between checks, SQLite works in WAL mode with the configured pragmas
+        gdal.SetConfigOption('OGR_SQLITE_JOURNAL', 'WAL')
+        gdal.SetConfigOption('OGR_SQLITE_PRAGMA', ','.join(f'{key}={value}' for key, value in self.sqlite_pragmas.items()))
+        self.layer_datasets = {}
+
+        # last results of __get_latest_version_and_epoch with validators for conditional requests by layer id
+        self.layer_info_cache = {}
+
+        # metadata of layer versions stored between runs
+        self.version_cache = VersionCache(os.path.join(self.tmp_files_path, 'versions'))
+
+        # timings of stages, counters and gauges, served on localhost if metrics_port is set
+        self.metrics = MetricsRegistry()
+        self.metrics_server = None
+        self.__declare_metrics()
+        # time spent applying changes to local GPKG files, it is excluded from the time of geometry evaluation
+        self.apply_seconds = 0.0
+
+        # telegram messages are sent in background threads
+        self.notifier = NotificationDispatcher(
+            self.__send_telegram_message,
+            workers=self.notification_params.get('workers', 1),
+            queue_size=self.notification_params.get('queue_size', 10000),
+            rate=self.notification_params.get('rate_per_chat_per_sec', 1.0),
+            burst=self.notification_params.get('burst', 3),
+            retries=self.notification_params.get('retries', 3),
+            backoff=self.notification_params.get('backoff_sec', 1.0),
+            coalesce=self.notification_params.get('coalesce', False)
+        )
+
+        # poll cycles with the interval adapted to changes and errors
+        self.scheduler = PollScheduler(
+            self.__run_cycle,
+            self.update_period_sec,
+            min_interval=self.scheduler_params.get('min_interval_sec'),
+            max_interval=self.scheduler_params.get('max_interval_sec'),
+            idle_factor=self.scheduler_params.get('idle_factor', 1.5),
+            error_factor=self.scheduler_params.get('error_factor', 2.0),
+            jitter=self.scheduler_params.get('jitter', 0.1)
+        )
+        # large catch-ups are split across cycles, the number of versions per cycle is adapted to the time budget of a cycle
+        self.cycle_time_budget = self.scheduler_params.get('cycle_time_budget_sec')
+        self.max_versions_per_cycle = self.scheduler_params.get('max_versions_per_cycle')
+        self.versions_per_cycle = self.max_versions_per_cycle
+        if (self.versions_per_cycle is None and self.cycle_time_budget is not None):
+            # the first catch-up after a restart is limited too, the limit is adapted after it
+            self.versions_per_cycle = self.catch_up_window_versions
+
+        # profiles of cycles requested by SIGUSR1, the flag file or the configuration are written to tmp_files_path/profiles
+        self.profiler = CycleProfiler(
+            self.tmp_files_path,
+            cycles=self.profiling_params.get('cycles', 0),
+            cycles_per_trigger=self.profiling_params.get('cycles_per_trigger', 1),
+            slow_cycle_sec=self.profiling_params.get('slow_cycle_sec')
+        )
+
+        # replay works without the server and writes events to the file instead of notifications
+        self.offline = False
+        self.events_file = None
+        self.events_written = 0
+
+        # versions, epochs and fields of layers and the history of processed versions
+        self.state_store = StateStore(os.path.join(self.tmp_files_path, self.STATE_FILE_NAME))
+        if (self.state_store.import_data_file(os.path.join(self.tmp_files_path, self.DATA_FILE_NAME)) and __debug__):
+            print(f'Versions of layers were imported from {self.DATA_FILE_NAME} to the state store\n')
+
+        # memberships of top layer features in bottom layer features (only for enter_exit and dwell modes)
+        self.membership_store = None
+        if (self.geofence_mode in self.STATEFUL_MODES):
+            self.membership_store = MembershipStore(os.path.join(self.tmp_files_path, 'membership.sqlite'))
+
+        # in-memory spatial indexes of the layers by layer id (only for spatial_index = memory)
+        self.spatial_indexes = {}
+
+        # fields of layers by layer id, a dict with keynames of all fields by their ids for every layer
+        self.layer_fields = {}
+
+        # buffered geometries of bottom layer features by (layer_id, fid, version, buffer) and geometries in the metric CRS by (layer_id, fid, version, 'metric')
+        self.buffer_cache = GeometryCache(int(self.buffer_cache_mb*1024*1024), lambda geometry: geometry.WkbSize())
+        # prepared geometries of bottom layer features which are often tested (only for spatial_index = memory)
+        self.prepared_cache = PreparedGeometryCache(self.prepared_cache_size)
+        # versions of features changed since the layers were downloaded by (layer_id, fid)
+        self.feature_versions = {}
+
+    def __declare_metrics(self) -> None:
+        """
+        This function declares metrics of the geofencer and adds the collector of statistics of the HTTP client, caches and notifications.
+        """
+        self.metrics.histogram('stage_duration_seconds', 'Duration of stages: version_poll, diff_fetch, version_metadata, attributes_fetch, geometry_evaluation, gpkg_apply, commit, notification_send')
+        self.metrics.histogram('cycle_duration_seconds', 'Duration of poll cycles')
+        self.metrics.counter('cycles_total', 'Poll cycles by status')
+        self.metrics.counter('candidate_pairs_total', 'Pairs of features tested by geometry predicates')
+        self.metrics.counter('intersections_total', 'Intersections found by geometry predicates')
+        self.metrics.counter('events_total', 'Geofencing events by type')
+        self.metrics.counter('cache_hits_total', 'Cache hits by cache')
+        self.metrics.counter('cache_misses_total', 'Cache misses by cache')
+        self.metrics.counter('http_requests_total', 'HTTP requests by endpoint including retries')
+        self.metrics.counter('http_errors_total', 'HTTP requests failed with connection errors or 5xx responses by endpoint')
+        self.metrics.counter('http_downloaded_bytes_total', 'Bytes downloaded by endpoint as declared by Content-Length')
+        self.metrics.counter('notifications_total', 'Notifications by result: sent, failed, dropped')
+        self.metrics.gauge('notification_queue_depth', 'Notifications waiting for delivery')
+        self.metrics.gauge('version_lag', 'Versions of the layer on the server which are not processed yet')
+        self.metrics.add_collector(self.__collect_metrics)
+
+    def __collect_metrics(self) -> None:
+        """
+        This function copies statistics of the HTTP client, caches and notifications into metrics, it is called before metrics are rendered.
+        """
+        for endpoint, values in self.http.stats().items():
+            self.metrics.set('http_requests_total', values['calls'], endpoint=endpoint)
+            self.metrics.set('http_errors_total', values['errors'], endpoint=endpoint)
+            self.metrics.set('http_downloaded_bytes_total', values['bytes'], endpoint=endpoint)
+        for cache, cache_stats in (('buffer', self.buffer_cache.stats()), ('prepared', self.prepared_cache.stats())):
+            self.metrics.set('cache_hits_total', cache_stats['hits'], cache=cache)
+            self.metrics.set('cache_misses_total', cache_stats['misses'], cache=cache)
+        notifier_stats = self.notifier.stats()
+        for result in ('sent', 'failed', 'dropped'):
+            self.metrics.set('notifications_total', notifier_stats[result], result=result)
+        self.metrics.set('notification_queue_depth', notifier_stats['queue_depth'])
+
+    def __get_stage_seconds(self, stage: str) -> float:
+        """
+        This function returns the total time in seconds spent in the stage.
+        """
+        stage_metric = self.metrics.get('stage_duration_seconds', stage=stage)
+        return stage_metric['sum'] if stage_metric is not None else 0.0
+
+    def __send_telegram_message(self, chat_id: int, message: str) -> bool:
+        with self.metrics.time('stage_duration_seconds', stage='notification_send'):
+            return bot_for_message.send_telegram_message(chat_id, message)
+
     def __send_message(self, message: str) -> None:
         """
         This function contains methods to make notifications for user.
@@ -150,25 +453,41 @@ class NGWGeofencer:
         if (self.message_type == "console_message"):
             print(message)
         elif (self.message_type == "telegram_message"):
-            bot_for_message.send_telegram_message(self.tg_user_id, message)
+            if (not self.notifier.put(self.tg_user_id, message) and __debug__):
+                print(f"Notification queue is full, the message was dropped: {message}\n")
 
     def run_script(self) -> None:
         """
         The main function called to start the program.
         """
-        status = self.__get_layers_gpkg()
+        if (self.metrics_port is not None):
+            try:
+                self.metrics_server = MetricsServer(self.metrics, self.metrics_port)
+                self.metrics_server.start()
+            except OSError as e:
+                self.metrics_server = None
+                if __debug__:
+                    print(f"Metrics server was not started on port {self.metrics_port}: {e}\n")
+
+        status = self.prepare()
         if (status['status'] == 'ok'):
-            status = self.__save_file_with_cur_versions()
-            if (status['status'] == 'ok'):
-                schedule.every(self.update_period_sec).seconds.do(lambda: self.__check_update())
+            if (self.message_type == "telegram_message"):
+                self.notifier.start()
+            self.scheduler.install_signal_handlers()
+            self.profiler.install_signal_handler()
 
-                while True:
-                    schedule.run_pending()
-                    time.sleep(1)
+            try:
+                self.scheduler.run()
+            finally:
+                self.close()
+        elif (self.metrics_server is not None):
+            self.metrics_server.stop()
+            self.metrics_server = None
 
-    def __get_layers_gpkg(self) -> dict:
+    def prepare(self) -> dict:
         """
-        This function downloads both layers in GPKG format from your webgis following the settings from config file.
+        This function prepares local layers before the first cycle: layers saved by the previous run are reused or exported again,
+        then spatial indexes and memberships are built.
 
 
         Returns
@@ -176,146 +495,244 @@ class NGWGeofencer:
         dict
             status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
         """
-        req_top_layer = f'{self.ngw_host}/api/resource/{self.top_layer_id}/export?context=IFeatureLayer&format=GPKG&zipped=false'
-        req_bottom_layer = f'{self.ngw_host}/api/resource/{self.bottom_layer_id}/export?context=IFeatureLayer&format=GPKG&zipped=false'
-        
-        top_layer_info = requests.get(req_top_layer, stream = True, auth = (self.ngw_login, self.ngw_password))
-        bottom_layer_info = requests.get(req_bottom_layer, stream = True, auth = (self.ngw_login, self.ngw_password))
+        status = self.__warm_start() if self.warm_start else {'status':'error'}
+        full_export = status['status'] != 'ok'
+        if (full_export):
+            status = self.__get_layers_gpkg()
+            if (status['status'] == 'ok'):
+                status = self.__save_cur_versions()
+        if (status['status'] == 'ok' and self.spatial_index == 'memory'):
+            status = self.__build_spatial_indexes()
+        if (status['status'] == 'ok' and self.membership_store is not None):
+            status = self.__build_memberships(full_export)
+        return status
+
+    def close(self) -> None:
+        """
+        This function stops notifications and the metrics server and closes local layers and stores.
+        """
+        self.notifier.stop()
+        if (self.metrics_server is not None):
+            self.metrics_server.stop()
+            self.metrics_server = None
+        self.__close_layer_datasets()
+        if (self.membership_store is not None):
+            self.membership_store.close()
+        self.state_store.close()
+
+    def replay(self, feed_path: str, events_path: str) -> dict:
+        """
+        This function runs geofencing over recorded changes without the server and the scheduler.
+        Local GPKG files and fields of layers saved by a previous run are copied to a working directory, so the local state is not changed.
+        Every line of the feed is a JSON object, one of:
+            {"layer_id": 1, "changes": [...]} - a page of the changes feed of the layer as returned by the server
+            {"layer_id": 1, "version": {"id": 12, "tstamp": "..."}} - metadata of the version as returned by the server
+        Changes of all layers are sorted by time of their versions and checked as one list, events are written to the file as JSON lines.
 
-        if (top_layer_info.status_code == 200 and bottom_layer_info.status_code == 200):            
-            layers_path = os.path.join(self.tmp_files_path, 'layers')
-            if (not os.path.isdir(layers_path)): os.makedirs(layers_path)
-            
-            file_name_and_path_top_layer = os.path.join(layers_path, f'layer_{self.top_layer_id}.gpkg')
-            file_name_and_path_bottom_layer = os.path.join(layers_path, f'layer_{self.bottom_layer_id}.gpkg')
-            
-            try:
-                with open(file_name_and_path_top_layer, 'wb') as file:
-                    for chunk in top_layer_info.iter_content(chunk_size=8192): 
-                        file.write(chunk)
 
-                with open(file_name_and_path_bottom_layer, 'wb') as file:
-                    for chunk in bottom_layer_info.iter_content(chunk_size=8192): 
-                        file.write(chunk)
+        Parameters
+        ---------
+        feed_path : str
+            path to the recorded feed in JSONL format
 
-                if __debug__:
-                    print(f'GPKG files was successfully saved in {file_name_and_path_top_layer} and {file_name_and_path_bottom_layer}\n')
-                return {'status':'ok'}
-            except PermissionError:
-                message = f'Error: No rights to write GPKG files to the directory {layers_path}.'
-            except FileNotFoundError:
-                message = f'Error: Directory to save GPKG files - {layers_path} not exists.'
-            except IOError as e:
-                message = f'Input/output error when writing GPKG files: {e}'
-            except Exception as e:
-                message = f'Unexpected error when saving files: {e}'
-            finally:
-                # close the connection anyway (due to stream = True)
-                top_layer_info.close()
-                bottom_layer_info.close()
-        else: message = f'Request errors when getting GPKG files! Top layer status: {top_layer_info.status_code}; Bottom layer status: {bottom_layer_info.status_code}'
+        events_path : str
+            path to the file for events
 
-        top_layer_info.close()
-        bottom_layer_info.close()
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations,
+            if ok then changes, events and seconds keys contain the number of changes, the number of events and the time of the check
+        """
+        layers_info = {}
+        for layer_id in self.layer_ids:
+            layer_info = self.state_store.get(layer_id)
+            if (layer_info is None or not layer_info['fields']):
+                return self.__handle_error(f'Fields of the layer with id {layer_id} are unknown, run the geofencer once to export layers before replay')
+            layers_info[layer_id] = layer_info
+
+        tmp_files_path = self.tmp_files_path
+        membership_store = self.membership_store
+        spatial_indexes = self.spatial_indexes
+        # opened datasets are closed first, so commits kept in WAL files are checkpointed into the files being copied
+        self.__close_layer_datasets()
+        work_path = tempfile.mkdtemp(prefix='replay_', dir=tmp_files_path)
+        try:
+            os.makedirs(os.path.join(work_path, 'layers'))
+            for layer_id in self.layer_ids:
+                shutil.copyfile(
+                    os.path.join(tmp_files_path, 'layers', f'layer_{layer_id}.gpkg'),
+                    os.path.join(work_path, 'layers', f'layer_{layer_id}.gpkg')
+                )
+
+            self.tmp_files_path = work_path
+            self.spatial_indexes = {}
+            self.offline = True
+            self.__set_layer_fields(layers_info)
+
+            status = {'status':'ok'}
+            if (self.spatial_index == 'memory'):
+                status = self.__build_spatial_indexes()
+            if (status['status'] == 'ok' and membership_store is not None):
+                self.membership_store = MembershipStore(os.path.join(work_path, 'membership.sqlite'))
+                status = self.__build_memberships(True)
+            if (status['status'] != 'ok'):
+                return status
+
+            # timestamps of versions are read first, so changes can be sorted in chunks while they are read
+            timestamps = {}
+            for record in self.__iter_feed(feed_path):
+                if ('version' in record and 'tstamp' in record['version']):
+                    timestamps[(record['layer_id'], record['version']['id'])] = record['version']['tstamp']
+
+            def iter_changes():
+                for record in self.__iter_feed(feed_path):
+                    for item in record.get('changes', ()):
+                        if ('vid' not in item):
+                            continue
+                        item['layer_id'] = record['layer_id']
+                        if ((record['layer_id'], item['vid']) in timestamps):
+                            item['time'] = timestamps[(record['layer_id'], item['vid'])]
+                        yield item
+
+            count, changes = merge_sorted(iter_changes(), self.__get_time, self.changes_chunk_size, os.path.join(work_path, 'changes'))
+
+            self.events_written = 0
+            with open(events_path, 'w', encoding='utf-8') as self.events_file:
+                start = time.perf_counter()
+                status = self.__check_geometry(changes)
+                elapsed = time.perf_counter()-start
+            if (status['status'] != 'ok'):
+                return status
 
-        return self.__handle_error(message)
+            if __debug__:
+                print(f'Replay: {count} changes, {self.events_written} events in {elapsed:.2f} s, {self.events_written/elapsed if elapsed else 0:.1f} events/s, {count/elapsed if elapsed else 0:.1f} changes/s\n')
+            return {'status':'ok', 'changes': count, 'events': self.events_written, 'seconds': elapsed}
+        except (OSError, ValueError, KeyError) as e:
+            return self.__handle_error(f'Error when replaying the feed {feed_path}: {e}')
+        finally:
+            self.events_file = None
+            self.offline = False
+            self.__close_layer_datasets()
+            if (self.membership_store is not membership_store):
+                self.membership_store.close()
+                self.membership_store = membership_store
+            self.tmp_files_path = tmp_files_path
+            # in-memory data of the copies is dropped, the local state stays as it was before replay
+            self.spatial_indexes = spatial_indexes
+            self.buffer_cache.clear()
+            self.prepared_cache = PreparedGeometryCache(self.prepared_cache_size)
+            self.feature_versions.clear()
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    @staticmethod
+    def __iter_feed(feed_path: str):
+        """
+        This function yields records of the recorded feed, empty lines are skipped.
+        """
+        with open(feed_path, 'r', encoding='utf-8') as feed_file:
+            for line in feed_file:
+                if (line.strip()):
+                    yield json.loads(line)
 
-    def __save_file_with_cur_versions(self) -> dict:
+    def __warm_start(self) -> dict:
         """
-        This function saves json file with latest versions and epochs of selected layers in local directiory.
+        This function prepares the work with local GPKG files and versions saved by the previous run.
+        The saved versions are kept, so changes made while the program was stopped are processed by the next check of updates.
 
 
         Returns
         -------
         dict
-            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
+            status key contains error or ok, if error then message key contains the reason why full export of layers is needed, if ok then it contains nothing else
         """
-        try:
-            top_layer_version_info = self.__get_latest_version_and_epoch(self.top_layer_id)
-            bottom_layer_version_info = self.__get_latest_version_and_epoch(self.bottom_layer_id)
-
-            if (top_layer_version_info['status'] == 'ok' and bottom_layer_version_info['status'] == 'ok'):
-                if (not all(key in top_layer_version_info for key in ['version', 'epoch', 'fields_to_display'])):
-                    raise KeyError("Missing 'version' or 'epoch' in top_layer_version_info")
-                if (not all(key in bottom_layer_version_info for key in ['version', 'epoch', 'fields_to_display'])):
-                    raise KeyError("Missing 'version' or 'epoch' in bottom_layer_version_info")
-
-                self.top_layer_attr_dict = top_layer_version_info['fields_to_display']
-                self.bottom_layer_attr_dict = bottom_layer_version_info['fields_to_display']
-
-                data = {
-                    "top_layer": {
-                        "id":self.top_layer_id,
-                        "version":top_layer_version_info['version'],
-                        "epoch":top_layer_version_info['epoch'],
-                        "fields_to_display":top_layer_version_info['fields_to_display']
-                    },
-                    "bottom_layer": {
-                        "id":self.bottom_layer_id,
-                        "version":bottom_layer_version_info['version'],
-                        "epoch":bottom_layer_version_info['epoch'],
-                        "fields_to_display":bottom_layer_version_info['fields_to_display']
-                    }
-                }
-                file_name_and_path = os.path.join(self.tmp_files_path, self.DATA_FILE_NAME)
-
-                with open(file_name_and_path, "w", encoding="utf-8") as json_file:
-                    json.dump(data, json_file, ensure_ascii=False, indent=4)
+        layers_path = os.path.join(self.tmp_files_path, 'layers')
+        gpkg_driver = ogr.GetDriverByName("GPKG")
 
-                if __debug__:
-                    print(f'Data file was successfully saved in {file_name_and_path}\n')
-                return {'status':'ok'}
-            else: message = f'Error when reading data from the server to save data file. Top layer status: {top_layer_version_info['message']}; Bottom layer status: {bottom_layer_version_info['message']}'
+        layers_version_info = self.__get_latest_versions_and_epochs()
+        for layer_id in self.layer_ids:
+            saved_layer_info = self.__get_last_saved_version_and_epoch_by_id(layer_id)
+            if (saved_layer_info['status'] != 'ok'):
+                return saved_layer_info
 
-        except KeyError as e:
-            message = f"Error when saving data file: {e}"
-        except FileNotFoundError:
-            message = f"Error when saving data file: Directory {self.tmp_files_path} not exists."
-        except PermissionError:
-            message = f"Error when saving data file: No rights to write to the directory {self.tmp_files_path}."
-        except (TypeError, ValueError) as e:
-            message = f"Error when serializing data in JSON: {e}"
-        except Exception as e:
-            message = f"Unexpected error when saving data file: {e}"
+            latest_layer_info = layers_version_info[layer_id]
+            if (latest_layer_info['status'] != 'ok'):
+                return latest_layer_info
+            if (latest_layer_info['epoch'] != saved_layer_info['epoch'] or latest_layer_info['version'] < saved_layer_info['version']):
+                return self.__handle_error(f'Saved epoch or version of the layer with id {layer_id} does not match the server, full export is needed')
 
-        return self.__handle_error(message)
+            file_name_and_path = os.path.join(layers_path, f'layer_{layer_id}.gpkg')
+            try:
+                dataset = gpkg_driver.Open(file_name_and_path, 0)
+                if (dataset is None or dataset.GetLayer() is None):
+                    return self.__handle_error(f'GPKG file {file_name_and_path} is corrupted, full export is needed')
+                mirror_version = self.__get_mirror_version(dataset)
+                dataset = None
+                if (mirror_version is not None and mirror_version != (saved_layer_info['version'], saved_layer_info['epoch'])):
+                    return self.__handle_error(f'GPKG file {file_name_and_path} contains version {mirror_version[0]} instead of saved {saved_layer_info['version']}, full export is needed')
+            except RuntimeError as e:
+                return self.__handle_error(f'GPKG file {file_name_and_path} can not be opened, full export is needed: {e}')
+
+        self.__set_layer_fields(layers_version_info)
+        if __debug__:
+            print('Warm start: local GPKG files and saved versions are used\n')
+        return {'status':'ok'}
 
-    def __get_latest_version_and_epoch(self, layer_id: int) -> dict:
+    def __run_cycle(self) -> dict:
         """
-        This function returns a dict with the last version, epoch and attributes of the layer
+        This function runs one scheduled check of updates.
 
 
-        Parameters
-        ---------
-        layer_id : int
-            unique ID of layer resource
-
         Returns
         -------
         dict
-            status key contains error or ok, if error then message key contains explanations, if ok then version key contains the version, epoch key contains the epoch and fields_to_display key contains the dict with attributes of current layer
+            the result of __check_update
         """
-        req = f'{self.ngw_host}/api/resource/{layer_id}'
-        layer_info = requests.get(req, auth = (self.ngw_login, self.ngw_password))
+        start = time.monotonic()
+        status = None
+        self.profiler.start_cycle()
+        try:
+            status = self.__check_update()
+            if (self.geofence_mode == 'dwell'):
+                dwell_status = self.__check_dwell()
+                if (dwell_status['status'] != 'ok' and status['status'] == 'ok'):
+                    status = dwell_status
+        finally:
+            self.profiler.end_cycle(status)
+        self.notifier.flush_cycle()
+        self.metrics.observe('cycle_duration_seconds', time.monotonic()-start)
+        self.metrics.inc('cycles_total', status=status['status'])
+        self.__adapt_versions_per_cycle(status, time.monotonic()-start)
+        if __debug__:
+            print(f"HTTP statistics: {self.http.stats()}\n")
+            print(f"Notifications: {self.notifier.stats()}\n")
+        return status
 
-        if (layer_info.status_code == 200):
-            versioning_info = layer_info.json()['feature_layer']['versioning']
-            versioning_status = versioning_info['enabled']
-            if (not versioning_status): message = f'Versioning for layer with id {layer_id} is turned off'
-            else: 
-                fields = layer_info.json()['feature_layer']['fields']
-                fields_to_display = {
-                    field['id']: field['keyname']
-                    for field in fields
-                    if field['keyname'] in (self.top_layer_attr_params if layer_id == self.top_layer_id else self.bottom_layer_attr_params)
-                }
-                return {'status':'ok', 'version': versioning_info['latest'], 'epoch': versioning_info['epoch'], 'fields_to_display': fields_to_display}
-        else: message = f'Request error when getting version and epoch for the layer with id {layer_id} from the server: {layer_info.status_code}'
-        return self.__handle_error(message)
+    def __adapt_versions_per_cycle(self, status: dict, cycle_time: float) -> None:
+        """
+        This function scales the number of versions processed by one cycle, so a catch-up cycle takes about the time budget.
 
-    def __check_update(self):
+
+        Parameters
+        ---------
+        status : dict
+            the result of __check_update
+
+        cycle_time : float
+            duration of the cycle in seconds
         """
-        This function checks new data in cloud and sends signals to update local data
+        if (self.cycle_time_budget is None or status['status'] != 'ok' or not status.get('changed') or cycle_time <= 0):
+            return
+        # versions_per_cycle limits every layer separately, so it is scaled by the versions of the layer which processed the most
+        versions_per_cycle = max(1, int(status['layer_versions']*self.cycle_time_budget/cycle_time))
+        if (self.max_versions_per_cycle is not None):
+            versions_per_cycle = min(versions_per_cycle, self.max_versions_per_cycle)
+        self.versions_per_cycle = versions_per_cycle
+
+    def __get_layers_gpkg(self) -> dict:
+        """
+        This function downloads all layers of the pairs in GPKG format from your webgis following the settings from config file.
+        Layers are downloaded in parallel, every file is written to a temporary file and renamed into place only when it is complete.
 
 
         Returns
@@ -323,240 +740,163 @@ class NGWGeofencer:
         dict
             status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
         """
-        latest_version_top_layer = self.__get_latest_version_and_epoch(self.top_layer_id)
-        latest_version_bottom_layer = self.__get_latest_version_and_epoch(self.bottom_layer_id)
+        self.__close_layer_datasets()
 
-        if (latest_version_top_layer['status'] == 'ok' and latest_version_bottom_layer['status'] == 'ok'):
-            top_layer_info = self.__get_last_saved_version_and_epoch_by_id(self.top_layer_id)
-            bottom_layer_info = self.__get_last_saved_version_and_epoch_by_id(self.bottom_layer_id)
+        layers_path = os.path.join(self.tmp_files_path, 'layers')
+        try:
+            if (not os.path.isdir(layers_path)): os.makedirs(layers_path)
+        except PermissionError:
+            return self.__handle_error(f'Error: No rights to create the directory {layers_path} for GPKG files.')
 
-            if (top_layer_info['status'] == 'ok' and bottom_layer_info['status'] == 'ok'):
-                last_saved_version_top_layer, last_saved_epoch_top_layer = top_layer_info['version'], top_layer_info['epoch']
-                last_saved_version_bottom_layer, last_saved_epoch_bottom_layer = bottom_layer_info['version'], bottom_layer_info['epoch']
-                
-                if (last_saved_version_top_layer < latest_version_top_layer['version'] and last_saved_version_bottom_layer < latest_version_bottom_layer['version']):
-                    top_layer_dif_info = self.__get_difference_between_versions(self.top_layer_id, last_saved_version_top_layer, latest_version_top_layer['version'], last_saved_epoch_top_layer)
-                    bottom_layer_dif_info = self.__get_difference_between_versions(self.bottom_layer_id, last_saved_version_bottom_layer, latest_version_bottom_layer['version'], last_saved_epoch_bottom_layer)
-                    
-                    if (top_layer_dif_info['status'] == 'ok' and bottom_layer_dif_info['status'] == 'ok'):
-                        save_file_info = self.__save_file_with_cur_versions()
-                        if (save_file_info['status'] == 'ok'):
-                            both_layers_differences = sorted(top_layer_dif_info['dif_list']+bottom_layer_dif_info['dif_list'], key=self.__get_time)
-                            self.__check_geometry(both_layers_differences)
-                            return {'status':'ok'}
-                        else: message = save_file_info['message']
-                    else: message = f'Error when getting difference list of features. For top layer: {top_layer_dif_info['message']}; For bottom layer: {bottom_layer_dif_info['message']}'
-                
-                elif last_saved_version_top_layer < latest_version_top_layer['version']:
-                    top_layer_dif_info = self.__get_difference_between_versions(self.top_layer_id, last_saved_version_top_layer, latest_version_top_layer['version'], last_saved_epoch_top_layer)
-                    
-                    if (top_layer_dif_info['status'] == 'ok'):
-                        save_file_info = self.__save_file_with_cur_versions()
-                        if (save_file_info['status'] == 'ok'):
-                            layer_differences = sorted(top_layer_dif_info['dif_list'], key=self.__get_time)
-                            self.__check_geometry(layer_differences)
-                            return {'status':'ok'}
-                        else: message = save_file_info['message']
-                    else: message = f'Error when getting difference list of features. For top layer: {top_layer_dif_info['message']}'
-                
-                elif last_saved_version_bottom_layer < latest_version_bottom_layer['version']:
-                    bottom_layer_dif_info = self.__get_difference_between_versions(self.bottom_layer_id, last_saved_version_bottom_layer, latest_version_bottom_layer['version'], last_saved_epoch_bottom_layer)
-                    
-                    if (bottom_layer_dif_info['status'] == 'ok'):
-                        save_file_info = self.__save_file_with_cur_versions()
-                        if (save_file_info['status'] == 'ok'):
-                            layer_differences = sorted(bottom_layer_dif_info['dif_list'], key=self.__get_time)
-                            self.__check_geometry(layer_differences)
-                            return {'status':'ok'}
-                        else: message = save_file_info['message']
-                    else: message = f'Error when getting difference list of features. For bottom layer: {bottom_layer_dif_info['message']}'
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(len(self.layer_ids), self.max_concurrent_requests)) as executor:
+            layers_info = dict(zip(self.layer_ids, executor.map(
+                lambda layer_id: self.__download_layer_gpkg(layer_id, layers_path),
+                self.layer_ids
+            )))
 
-                else:
-                    if __debug__:
-                        self.__send_message(datetime.now().strftime("%H:%M:%S")+' From last upd nothing was changed')
-                    return {'status':'ok'}    
-            else: message = f'Error when getting last saved version of layers. For top layer: {top_layer_info['message']}; For bottom layer: {bottom_layer_info['message']}'
-        else: message = f'Error when getting version of layers. For top layer: {latest_version_top_layer['message']}; For bottom layer: {latest_version_bottom_layer['message']}'
+        errors = [f'Layer {layer_id}: {layer_info['message']}' for layer_id, layer_info in layers_info.items() if layer_info['status'] != 'ok']
+        if (not errors):
+            if __debug__:
+                print(f'GPKG files was successfully saved in {layers_path}, time to ready: {time.perf_counter()-start:.1f} s\n')
+            return {'status':'ok'}
+        message = f'Errors when getting GPKG files! {'; '.join(errors)}'
         return self.__handle_error(message)
 
-    def __check_geometry(self, both_layers_differences: list):
+    def __download_layer_gpkg(self, layer_id: int, layers_path: str) -> dict:
         """
-        This function checks the geometry of shapes for a geofencing event
+        This function downloads the layer in GPKG format to the temporary file and atomically renames it to layer_<id>.gpkg.
+        An interrupted download is resumed with an HTTP range request if the server supports it and the export was not changed.
+
 
         Parameters
-        ----------
-        both_layers_differences: list
-            the list of layer supdated information
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        layers_path : str
+            directory for GPKG files
 
         Returns
         -------
         dict
             status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
         """
-        layers_path = os.path.join(self.tmp_files_path, 'layers')
-        gpkg_driver = ogr.GetDriverByName("GPKG")
-
-        file_name_and_path_top_layer = os.path.join(layers_path, f'layer_{self.top_layer_id}.gpkg')
-        top_layer = gpkg_driver.Open(file_name_and_path_top_layer, 1)
-        top_layer_geometry = top_layer.GetLayer()
-
-        file_name_and_path_bottom_layer = os.path.join(layers_path, f'layer_{self.bottom_layer_id}.gpkg')
-        bottom_layer = gpkg_driver.Open(file_name_and_path_bottom_layer, 1)
-        bottom_layer_geometry = bottom_layer.GetLayer()
+        req = f'{self.ngw_host}/api/resource/{layer_id}/export?context=IFeatureLayer&format=GPKG&zipped=false'
+        file_name_and_path = os.path.join(layers_path, f'layer_{layer_id}.gpkg')
+        part_file_name_and_path = file_name_and_path+'.part'
+        validator_file_name_and_path = part_file_name_and_path+'.json'
+
+        start = time.perf_counter()
+        downloaded_bytes = 0
+        expected_size = None
+        # HttpClient retries requests which got no response, attempts here only continue downloads broken in the middle
+        for attempt in range(self.http.retries+1):
+            # the range of a compressed response counts compressed bytes, so the export is requested without compression
+            headers = {'Accept-Encoding': 'identity'}
+            part_size = os.path.getsize(part_file_name_and_path) if os.path.isfile(part_file_name_and_path) else 0
+            part_info = {}
+            if (part_size > 0 and os.path.isfile(validator_file_name_and_path)):
+                with open(validator_file_name_and_path, 'r') as validator_file:
+                    part_info = json.load(validator_file)
+                if (part_info.get('validator')):
+                    # the server sends the whole file again if the export was changed
+                    headers.update({'Range': f'bytes={part_size}-', 'If-Range': part_info['validator']})
 
-        if (top_layer is None or bottom_layer is None):
-            return self.__handle_error("ERROR: open GPKG file failed")
+            try:
+                response = self.http.get(req, stream = True, headers = headers, auth = (self.ngw_login, self.ngw_password))
+            except OSError as e:
+                return {'status':'error', 'message':f'Connection error when downloading GPKG file for the layer with id {layer_id}: {e}'}
 
-        if (self.geofence_mode == 'intersection'):
-            for item in both_layers_differences:
-                if (item['layer_id'] == self.top_layer_id):
-                    fid = item['fid']
-                    if (item['action'] != 'feature.create'): 
-                        feature = top_layer_geometry.GetFeature(fid)
-
-                    if ('geom' in item):
-                        wkb_data = base64.b64decode(item['geom'])
-                        top_object = ogr.CreateGeometryFromWkb(wkb_data)
-                    else:
-                        top_object = feature.GetGeometryRef()
-                    
-                    min_x, max_x, min_y, max_y = top_object.GetEnvelope()
-                    
-                    buffer = self.bottom_layer_buffer+self.top_layer_buffer
-                    if (bottom_layer_geometry not in (ogr.wkbPolygon, ogr.wkbMultiPolygon) and buffer < 0): buffer = 0
-                    bottom_layer_geometry.SetSpatialFilterRect(min_x-1-buffer, min_y-1-buffer, max_x+1+buffer, max_y+1+buffer)
-
-                    bottom_layer_geometry.ResetReading()
-                    for bottom_feature in bottom_layer_geometry:
-                        bottom_geom = bottom_feature.GetGeometryRef()
-                        
-                        if (self.bottom_layer_buffer > 0):
-                            bottom_geom = bottom_geom.Buffer(self.bottom_layer_buffer)
-                        if (self.top_layer_buffer > 0):
-                            top_object_check = top_object.Buffer(self.top_layer_buffer)
-                        else:
-                            top_object_check = top_object
-                        
-                        if (bottom_geom.Intersects(top_object_check)):
-                            top_layer_attributes = []
-
-                            if (item['action'] == "feature.create"):
-                                for field in item['fields']:
-                                    if (field[0] in self.top_layer_attr_dict):
-                                        top_layer_attributes.append({self.top_layer_attr_dict[field[0]]: field[1]})
-                            else:
-                                for field in self.top_layer_attr_dict:
-                                    top_layer_attributes.append({self.top_layer_attr_dict[field]: feature.GetField(str(self.top_layer_attr_dict[field]))})
-                            # top_layer_attributes = [{self.top_layer_attr_dict[field[0]][0]: field[1]} for field in item['fields'] if (field[0] in self.top_layer_attr_dict)] if item['action'] == "feature.create" else [{self.top_layer_attr_dict[field][0]: feature.GetField(str(self.top_layer_attr_dict[field][1]))} for field in self.top_layer_attr_dict]
-                            bottom_layer_attributes = [{self.bottom_layer_attr_dict[field]: bottom_feature.GetField(self.bottom_layer_attr_dict[field])} for field in self.bottom_layer_attr_dict]
-                            message =  (f"Top layer object with id {item['fid']} intersects with the bottom layer object with id {bottom_feature.GetFID()} by action {item['action']}.\n"
-                                        f"Attributes of top layer object: {top_layer_attributes}\n"
-                                        f"Attributes of bottom layer object: {bottom_layer_attributes}\n")
-                            self.__send_message(message)
-
-                    self.__do_action_with_layer(self.top_layer_id, item, top_layer_geometry, top_object)
-                elif (item['layer_id'] == self.bottom_layer_id):
-                    fid = item['fid']
-                    if (item['action'] != 'feature.create'): 
-                        feature = bottom_layer_geometry.GetFeature(fid)
-                    
-                    if ('geom' in item):
-                        wkb_data = base64.b64decode(item['geom'])
-                        polygon = ogr.CreateGeometryFromWkb(wkb_data)
+            try:
+                with response:
+                    if (response.status_code == 416):
+                        # the part file already contains the whole export
+                        expected_size = part_info.get('size') or self.__get_range_total(response.headers.get('Content-Range'))
+                        break
+                    if (response.status_code not in (200, 206)):
+                        return {'status':'error', 'message':f'request error {response.status_code} for the layer with id {layer_id}'}
+
+                    if (response.status_code == 206):
+                        expected_size = self.__get_range_total(response.headers.get('Content-Range'))
                     else:
-                        polygon = feature.GetGeometryRef()
-
-                    min_x, max_x, min_y, max_y = polygon.GetEnvelope()
-
-                    buffer = self.bottom_layer_buffer+self.top_layer_buffer
-                    if (top_layer_geometry not in (ogr.wkbPolygon, ogr.wkbMultiPolygon) and buffer < 0): buffer = 0
-                    top_layer_geometry.SetSpatialFilterRect(min_x-1-buffer, min_y-1-buffer, max_x+1+buffer, max_y+1+buffer)
-
-
-                    top_layer_geometry.ResetReading()
-                    for top_layer_object in top_layer_geometry:
-                        point_geom = top_layer_object.GetGeometryRef()
-                        if (point_geom is not None and polygon.Intersects(point_geom)):
-                            bottom_layer_attributes = []
-                            
-                            if (item['action'] == "feature.create"):
-                                for field in item['fields']:
-                                    if (field[0] in self.bottom_layer_attr_dict):
-                                        bottom_layer_attributes.append({self.bottom_layer_attr_dict[field[0]]: field[1]})
-                            else:
-                                for field in self.bottom_layer_attr_dict:
-                                    bottom_layer_attributes.append({self.bottom_layer_attr_dict[field]: feature.GetField(str(self.bottom_layer_attr_dict[field]))})
-                            
-                            # bottom_layer_attributes = [{self.bottom_layer_attr_dict[field[0]][0]: field[1]} for field in item['fields'] if (field[0] in self.bottom_layer_attr_dict)] if item['action'] == "feature.create" else [{self.bottom_layer_attr_dict[field][0]: feature.GetField(str(self.bottom_layer_attr_dict[field][1]))} for field in self.bottom_layer_attr_dict]
-                            top_layer_attributes = [{self.top_layer_attr_dict[field]: top_layer_object.GetField(self.top_layer_attr_dict[field])} for field in self.top_layer_attr_dict]
-                            
-                            message =  (f"Top layer object with id {top_layer_object.GetFID()} intersects with the bottom layer object with id {item['fid']} by action {item['action']}.\n"
-                                        f"Attributes of top layer object: {top_layer_attributes}\n"
-                                        f"Attributes of bottom layer object: {bottom_layer_attributes}\n")
-                            self.__send_message(message) 
-
-                    self.__do_action_with_layer(self.bottom_layer_id, item, bottom_layer_geometry, polygon)
-                else:
-                    return self.__handle_error(f"Wrong layer id {item['layer_id']} in the list of updates")
-    
-    def __do_action_with_layer(self, layer_id: int, item: dict, layer_geometry: ogr.Layer, object: ogr.Feature):
-        """
-        This function change local geometry and attributes table following cloud data
+                        expected_size = int(response.headers['Content-Length']) if response.headers.get('Content-Length', '').isdigit() else None
+                    validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                    if (response.headers.get('Content-Encoding', 'identity') != 'identity'):
+                        # the server compressed the export anyway, it can not be resumed by ranges of decoded bytes
+                        validator, expected_size = None, None
+                    with open(validator_file_name_and_path, 'w') as validator_file:
+                        json.dump({'validator': validator, 'size': expected_size}, validator_file)
+
+                    with open(part_file_name_and_path, 'ab' if response.status_code == 206 else 'wb') as file:
+                        for chunk in response.iter_content(chunk_size=self.download_chunk_size):
+                            file.write(chunk)
+                            downloaded_bytes += len(chunk)
+                break
+            except PermissionError:
+                return {'status':'error', 'message':f'No rights to write GPKG file to the directory {layers_path}.'}
+            except OSError as e:
+                # connection was broken, the next attempt continues from the end of the part file
+                if (attempt == self.http.retries):
+                    return {'status':'error', 'message':f'Input/output error when downloading GPKG file for the layer with id {layer_id}: {e}'}
+                time.sleep(self.http.backoff*2**attempt)
 
+        try:
+            part_size = os.path.getsize(part_file_name_and_path)
+            with open(part_file_name_and_path, 'rb') as file:
+                header = file.read(16)
+            if (header != b'SQLite format 3\x00' or (expected_size is not None and part_size != expected_size)):
+                os.remove(part_file_name_and_path)
+                if (os.path.isfile(validator_file_name_and_path)): os.remove(validator_file_name_and_path)
+                if (header != b'SQLite format 3\x00'):
+                    return {'status':'error', 'message':f'Downloaded file for the layer with id {layer_id} is not a GPKG file'}
+                return {'status':'error', 'message':f'Downloaded file for the layer with id {layer_id} has {part_size} bytes instead of {expected_size}'}
+            os.replace(part_file_name_and_path, file_name_and_path)
+            if (os.path.isfile(validator_file_name_and_path)): os.remove(validator_file_name_and_path)
+        except OSError as e:
+            return {'status':'error', 'message':f'Input/output error when saving GPKG file for the layer with id {layer_id}: {e}'}
 
-        Parameters
-        ---------
-        layer_id : int
-            unique ID of layer resource
+        if __debug__:
+            elapsed = time.perf_counter()-start
+            print(f'GPKG file for the layer with id {layer_id} was saved in {file_name_and_path}: '
+                  f'{downloaded_bytes/1024/1024:.1f} MB in {elapsed:.1f} s ({downloaded_bytes/1024/1024/max(elapsed, 1e-6):.1f} MB/s)\n')
+        return {'status':'ok'}
 
-        item : dict
-            item with info about cloud action this the feature
+    @staticmethod
+    def __get_range_total(content_range: str) -> int:
+        """
+        This function returns the total size of the file from the Content-Range header, for example bytes 100-199/200, or None if it is unknown.
+        """
+        total = (content_range or '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
 
-        layer_geometry : ogr.Layer
-            the layer of the object
+    def __build_spatial_indexes(self) -> dict:
+        """
+        This function loads geometries of all layers from the local GPKG files into in-memory spatial indexes.
 
-        object : ogr.Feature
-            object that should be changed in the layer
 
         Returns
         -------
         dict
             status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
         """
-        action = item['action']
-        fid = item['fid']
-        if (action == 'feature.create'):
-            out_feature = ogr.Feature(layer_geometry.GetLayerDefn())
-            out_feature.SetGeometry(object)
-            out_feature.SetFID(fid)
+        for layer_id in self.layer_ids:
+            try:
+                fids, geometries = self.__read_layer_geometries(layer_id)
+            except RuntimeError as e:
+                return self.__handle_error(f"Error when opening GPKG file of the layer with id {layer_id} to build spatial index: {e}")
 
-            req_attributes = f'{self.ngw_host}/api/resource/{layer_id}/feature/{fid}?label=false&geom=false&dt_format=obj'
-            req_info = requests.get(req_attributes, auth = (self.ngw_login, self.ngw_password))
-            if (req_info.status_code == 200):
-                attributes = req_info.json()['fields']
-                for key, value in attributes.items():
-                    out_feature.SetField(key, value)
-            
-            layer_geometry.CreateFeature(out_feature)
-            out_feature = None
-        elif (action == 'feature.delete'):
-            layer_geometry.DeleteFeature(fid)
-        elif (action == 'feature.update'):
-            feature = layer_geometry.GetFeature(fid)
-            feature.SetGeometry(object)
-            
-            for i in item['fields']:
-                feature.SetField(self.top_layer_attr_dict[i[0]][1], i[1])
-            layer_geometry.SetFeature(feature)
-        else:
-            return self.__handle_error(f"Wrong action: {action} - for the object with fid {fid}")
+            spatial_index = LayerSpatialIndex()
+            spatial_index.load(fids, geometries)
+            self.spatial_indexes[layer_id] = spatial_index
+
+            if __debug__:
+                print(f'Spatial index for the layer with id {layer_id} was built: {len(spatial_index)} features\n')
         return {'status':'ok'}
 
-    
-    
-    def __get_difference_between_versions(self, layer_id: int, previous_version: int, latest_version: int, epoch: int) -> dict:
+    def __read_layer_geometries(self, layer_id: int) -> tuple:
         """
-        This function gets and writes in the console info about difference between the last saved and uploaded version to the cloud
+        This function reads geometries of the layer from the local GPKG file, RuntimeError is raised if the file can not be opened.
 
 
         Parameters
@@ -564,154 +904,1598 @@ class NGWGeofencer:
         layer_id : int
             unique ID of layer resource
 
-        previous_version : int
-            the last local stored version of the layer
+        Returns
+        -------
+        tuple
+            the list of fids and the numpy array of shapely geometries of features with geometry, in the metric CRS if it is set
+        """
+        file_name_and_path = os.path.join(self.tmp_files_path, 'layers', f'layer_{layer_id}.gpkg')
+        dataset = ogr.GetDriverByName("GPKG").Open(file_name_and_path, 0)
+        if (dataset is None):
+            raise RuntimeError(f'{file_name_and_path} can not be opened')
+
+        if (self.reprojector is not None):
+            self.reprojector.add_layer(layer_id, dataset.GetLayer().GetSpatialRef())
+
+        fids, wkb_list = [], []
+        for feature in dataset.GetLayer():
+            geometry = feature.GetGeometryRef()
+            if (geometry is not None):
+                fids.append(feature.GetFID())
+                wkb_list.append(bytes(geometry.ExportToWkb()))
+        dataset = None
+        return fids, self.__to_metric(layer_id, shapely.from_wkb(np.array(wkb_list, dtype=object)))
+
+    def __build_memberships(self, rebuild: bool) -> dict:
+        """
+        This function fills the membership store with current intersections of the pairs, so features which are already inside zones do not produce enter events.
+        The time when such features entered is unknown, so they are stored as already reported by dwell events: they do not dwell and their exits are reported.
 
-        latest_version : int
-            the last uploaded version of the layer to the cloud
 
-        epoch : int
-            current epoch of the layer
+        Parameters
+        ---------
+        rebuild : bool
+            if true, memberships of all pairs are built again, else only pairs without memberships are built
 
         Returns
         -------
         dict
-            status key contains error or ok, if error then message key contains explanations, if ok then dif_list key contains the list of updated features
-        """
-        req = f'{self.ngw_host}/api/resource/{layer_id}/feature/changes/check?epoch={epoch}&initial={previous_version}&target={latest_version}&geom_format=geojson'
-        difference_versions_info = requests.get(req, auth = (self.ngw_login, self.ngw_password))
-        
-        if (difference_versions_info.status_code == 200):
-            fetch = difference_versions_info.json()['fetch']
-            if __debug__:
-                print(f'Request link for layer with id {layer_id} between versions {previous_version} and {latest_version}: {req}')
-                print(f'Link for more information: {fetch}')
-            result = requests.get(fetch, auth = (self.ngw_login, self.ngw_password))
-            if (result.status_code == 200):
-                json_result = [item for item in result.json() if "vid" in item] 
-
-                requests_for_versions = self.__get_versions_information(layer_id, previous_version, latest_version)
-                if (requests_for_versions['status'] == 'ok'):
-                    time_for_versions = requests_for_versions['versions_information']
-                    for item in json_result:
-                        if ('vid' in item):
-                            for time in time_for_versions:
-                                if ('id' in time):
-                                    if (time['id'] == item['vid']):
-                                        item['time'] = time['tstamp']
-                                        item['layer_id'] = layer_id
-
-                    sorted_by_time_json = sorted(json_result, key=self.__get_time)
-                    if __debug__:
-                        print("UPDATED AND SORTED JSON BY TIMESTAMPS:", sorted_by_time_json, "\n")
-                                    
-                    return {'status':'ok', 'dif_list':sorted_by_time_json}
-                else: message = requests_for_versions['message']
-            else: message = f"Error when getting details about changes for the layer {layer_id} between versions {previous_version} and {latest_version} for epoch {epoch}"
-        else: message = f"Error when getting the list of features for the layer {layer_id} between versions {previous_version} and {latest_version} for epoch {epoch}"
-        return self.__handle_error(message)
-
-    def __get_versions_information(self, layer_id: int, last_version: int, latest_version: int) -> dict:
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
         """
-        This function returns the list of dicts, which contain information about versions in the specified range.
+        now = time.time()
+        self.membership_store.begin()
+        try:
+            for pair in self.pairs:
+                top_layer_id, bottom_layer_id = pair['top']['id'], pair['bottom']['id']
+                if (not rebuild and self.membership_store.count(top_layer_id, bottom_layer_id) > 0):
+                    continue
+
+                top_fids, top_geometries = self.__read_layer_geometries(top_layer_id)
+                bottom_index = self.spatial_indexes.get(bottom_layer_id)
+                if (bottom_index is None):
+                    bottom_index = LayerSpatialIndex()
+                    bottom_index.load(*self.__read_layer_geometries(bottom_layer_id))
+
+                # buffers of both layers are replaced with the distance between the original geometries
+                distance = max(pair['top']['buffer'], 0)+max(pair['bottom']['buffer'], 0)
+                if (distance > 0):
+                    input_indexes, bottom_fids = bottom_index.query(top_geometries, predicate='dwithin', distance=distance)
+                else:
+                    input_indexes, bottom_fids = bottom_index.query(top_geometries, predicate='intersects')
 
+                top_fids = np.asarray(top_fids, dtype=np.int64)[input_indexes]
+                self.membership_store.clear(top_layer_id, bottom_layer_id)
+                self.membership_store.add(top_layer_id, bottom_layer_id, zip(top_fids.tolist(), bottom_fids.tolist(), [now]*len(top_fids)), dwell_reported=True)
 
-        Parameters
-        ---------
-        layer_id : int
-            unique ID of layer resource
+                if __debug__:
+                    print(f'Memberships of layers {top_layer_id} and {bottom_layer_id} were built: {len(top_fids)} pairs of features\n')
+        except RuntimeError as e:
+            self.membership_store.rollback()
+            return self.__handle_error(f"Error when building memberships: {e}")
+        self.membership_store.commit()
+        return {'status':'ok'}
 
-        last_version : int
-            the last local stored version of the layer
+    def __check_dwell(self) -> dict:
+        """
+        This function sends dwell events for memberships which last longer than dwell_time_sec.
 
-        latest_version : int
-            the last uploaded version of the layer to the cloud
 
         Returns
         -------
         dict
-            status key contains error or ok, if error then message key contains explanations, if ok then versions_information key contains a list with info about layer, including needed time
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
         """
-        versions_information = []
-        for version in range(last_version, latest_version+1):
-            req = f'{self.ngw_host}/api/resource/{layer_id}/feature/version/{version}'
-            current_version_info = requests.get(req, auth = (self.ngw_login, self.ngw_password))
-            if (current_version_info.status_code == 200):
-                versions_information.append(current_version_info.json())
-            elif __debug__:
-                    print(f"Error while getting feature of version {version} for the layer with id {layer_id}\n")
-        if (versions_information == []): self.__handle_error("Error during receiving versions data")
-        else: return {'status':'ok', 'versions_information':versions_information}
+        status = self.__open_layer_datasets()
+        if (status['status'] != 'ok'):
+            return status
 
-    def __get_last_saved_version_and_epoch_by_id(self, layer_id: int) -> dict:
+        started_before = time.time()-self.dwell_time_sec
+        self.membership_store.begin()
+        try:
+            for pair in self.pairs:
+                top_layer_id, bottom_layer_id = pair['top']['id'], pair['bottom']['id']
+                dwelling = self.membership_store.get_dwelling(top_layer_id, bottom_layer_id, started_before)
+                if (not dwelling):
+                    continue
+
+                top_layer_geometry = self.layer_datasets[top_layer_id].GetLayer()
+                bottom_layer_geometry = self.layer_datasets[bottom_layer_id].GetLayer()
+                for top_fid, bottom_fid, since in dwelling:
+                    top_feature = top_layer_geometry.GetFeature(top_fid)
+                    bottom_feature = bottom_layer_geometry.GetFeature(bottom_fid)
+                    if (top_feature is not None and bottom_feature is not None):
+                        item = {'layer_id': top_layer_id, 'fid': top_fid, 'action': 'dwell', 'time': datetime.fromtimestamp(since, timezone.utc).isoformat()}
+                        self.__send_event(self.__make_event(pair, 'top', item, top_feature, bottom_feature, 'dwell'))
+                self.membership_store.set_dwell_reported(top_layer_id, bottom_layer_id, [(top_fid, bottom_fid) for top_fid, bottom_fid, _ in dwelling])
+        except Exception as e:
+            self.membership_store.rollback()
+            return self.__handle_error(f"Error when checking dwell time: {e}")
+        self.membership_store.commit()
+        return {'status':'ok'}
+
+    def __save_cur_versions(self, layers_version_info: dict = None) -> dict:
         """
-        This function returns last local saved version and epoch of the layer.
+        This function saves latest versions, epochs and fields of selected layers in the state store.
 
 
         Parameters
         ---------
-        layer_id : int
-            unique ID of layer resource
+        layers_version_info : dict
+            version info of every layer to save by layer id as returned by __get_latest_version_and_epoch, it is requested from the server if not set
 
         Returns
         -------
         dict
-            status key contains error or ok, if error then message key contains explanations, if ok then version key contains the last saved version and epoch key contains the last saved epoch of current layer
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
         """
+        if (layers_version_info is None):
+            layers_version_info = self.__get_latest_versions_and_epochs()
+
+        self.state_store.begin()
+        status = self.__write_cur_versions(layers_version_info)
+        if (status['status'] != 'ok'):
+            self.state_store.rollback()
+            return status
         try:
-            data_file_name_and_path = os.path.join(self.tmp_files_path, self.DATA_FILE_NAME)
-            with open(data_file_name_and_path, 'r') as data_file:
-                data = json.load(data_file)
-
-            for layer in data.values():
-                if layer['id'] == layer_id:
-                    return {'status':'ok', 'version':layer['version'], 'epoch':layer['epoch']}
+            self.state_store.commit()
+        except sqlite3.Error as e:
+            self.state_store.rollback()
+            return self.__handle_error(f"Error when saving the state store: {e}")
 
-            message = f'Error when finding local info for the layer with id: {layer_id}'
-        except FileNotFoundError:
-            message = f"Error: File '{data_file_name_and_path}' not found."
-        except json.JSONDecodeError:
-            message = f"Error: File '{data_file_name_and_path}' contains invalid JSON."
-        except Exception as e:
-            message = f"Error when opening the file '{data_file_name_and_path}': {e}"
-        
-        return self.__handle_error(message)
+        self.__set_layer_fields(layers_version_info)
+        if __debug__:
+            print(f'Versions of layers were successfully saved in {self.state_store.db_path}\n')
+        return {'status':'ok'}
 
-    def __handle_error(self, message: str) -> dict:
+    def __write_cur_versions(self, layers_version_info: dict, from_layers_info: dict = None) -> dict:
         """
-        This function returns a dict with status code and message with more information about error.
+        This function writes versions, epochs and fields of the layers in the current transaction of the state store.
 
 
         Parameters
         ---------
-        message : str
-            info about error
+        layers_version_info : dict
+            version info of every layer by layer id as returned by __get_latest_version_and_epoch
+
+        from_layers_info : dict
+            version info of every layer by layer id before the processed changes, it is recorded in the history
 
         Returns
         -------
         dict
-            status key contains error and message key contains explanations
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
         """
-        if __debug__:
-            print(message, '\n')
-        return {'status':'error', 'message':message}
+        errors = [f'Layer {layer_id} status: {layer_info['message']}' for layer_id, layer_info in layers_version_info.items() if layer_info['status'] != 'ok']
+        if (errors):
+            return self.__handle_error(f'Error when reading data from the server to save versions of layers. {'; '.join(errors)}')
 
-    def __get_time(self, item):
-        if 'time' in item:
-            return datetime.fromisoformat(item['time'])
-        else: return datetime.min
+        try:
+            for layer_id, layer_info in layers_version_info.items():
+                if (not all(key in layer_info for key in ['version', 'epoch', 'fields_to_display'])):
+                    raise KeyError(f"Missing 'version' or 'epoch' in version info of the layer with id {layer_id}")
+                from_version = from_layers_info[layer_id]['version'] if from_layers_info is not None else None
+                self.state_store.set_layer(layer_id, layer_info['version'], layer_info['epoch'], layer_info['fields_to_display'], layer_info.get('fields'), from_version)
+        except KeyError as e:
+            return self.__handle_error(f"Error when saving versions of layers: {e}")
+        except sqlite3.Error as e:
+            return self.__handle_error(f"Error when writing the state store: {e}")
+        return {'status':'ok'}
 
-def main(config_path):
-    new_lph = NGWGeofencer(config_path)
+    def __set_mirror_version(self, layer_id: int, layer_info: dict) -> None:
+        """
+        This function records the version of the layer applied to the local GPKG file in the current transaction of the file.
+        The version is kept in metadata of the dataset, so the file contains no other layers than the mirrored one.
+        """
+        dataset = self.layer_datasets[layer_id]
+        dataset.SetMetadataItem(self.MIRROR_VERSION_ITEM, str(int(layer_info['version'])))
+        dataset.SetMetadataItem(self.MIRROR_EPOCH_ITEM, '' if layer_info['epoch'] is None else str(int(layer_info['epoch'])))
+        # metadata is written on flush, so it is flushed inside the transaction to be committed or rolled back with the changes
+        dataset.FlushCache()
+
+    @classmethod
+    def __get_mirror_version(cls, dataset) -> tuple:
+        """
+        This function returns the version and the epoch recorded in the local GPKG file or None if it was not recorded yet.
+        """
+        version = dataset.GetMetadataItem(cls.MIRROR_VERSION_ITEM)
+        if (not version):
+            return None
+        epoch = dataset.GetMetadataItem(cls.MIRROR_EPOCH_ITEM)
+        try:
+            return (int(version), int(epoch) if epoch else None)
+        except ValueError:
+            return None
+
+    def __get_latest_version_and_epoch(self, layer_id: int) -> dict:
+        """
+        This function returns a dict with the last version, epoch and attributes of the layer
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then version key contains the version, epoch key contains the epoch, fields_to_display key contains the dict with attributes of current layer and fields key contains the dict with keynames of all fields by their ids
+        """
+        req = f'{self.ngw_host}/api/resource/{layer_id}'
+        cached_info = self.layer_info_cache.get(layer_id)
+        headers = {}
+        if (cached_info is not None):
+            # the server answers 304 without the body if the resource was not changed
+            if (cached_info['etag']): headers['If-None-Match'] = cached_info['etag']
+            if (cached_info['last_modified']): headers['If-Modified-Since'] = cached_info['last_modified']
+        layer_info = self.http.get(req, headers = headers, auth = (self.ngw_login, self.ngw_password))
+
+        if (layer_info.status_code == 304 and cached_info is not None):
+            return cached_info['result']
+        elif (layer_info.status_code == 200):
+            feature_layer_info = layer_info.json()['feature_layer']
+            versioning_info = feature_layer_info['versioning']
+            versioning_status = versioning_info['enabled']
+            if (not versioning_status): message = f'Versioning for layer with id {layer_id} is turned off'
+            else: 
+                # dicts of fields are built again only when the schema of the layer was changed
+                schema = [(field['id'], field['keyname']) for field in feature_layer_info['fields']]
+                if (cached_info is not None and cached_info['schema'] == schema):
+                    fields_to_display, fields = cached_info['result']['fields_to_display'], cached_info['result']['fields']
+                else:
+                    fields_to_display = {
+                        field_id: keyname
+                        for field_id, keyname in schema
+                        if keyname in self.layer_attr_params[layer_id]
+                    }
+                    fields = dict(schema)
+
+                result = {'status':'ok', 'version': versioning_info['latest'], 'epoch': versioning_info['epoch'], 'fields_to_display': fields_to_display, 'fields': fields}
+                self.layer_info_cache[layer_id] = {
+                    'etag': layer_info.headers.get('ETag'),
+                    'last_modified': layer_info.headers.get('Last-Modified'),
+                    'schema': schema,
+                    'result': result
+                }
+                return result
+        else: message = f'Request error when getting version and epoch for the layer with id {layer_id} from the server: {layer_info.status_code}'
+        return self.__handle_error(message)
+
+    def __get_latest_versions_and_epochs(self) -> dict:
+        """
+        This function requests the last versions, epochs and attributes of all layers concurrently, every layer is requested once even if it is used by several pairs.
+
+
+        Returns
+        -------
+        dict
+            results of __get_latest_version_and_epoch by layer id
+        """
+        with self.metrics.time('stage_duration_seconds', stage='version_poll'):
+            with ThreadPoolExecutor(max_workers=min(len(self.layer_ids), self.max_concurrent_requests)) as executor:
+                return dict(zip(self.layer_ids, executor.map(self.__get_latest_version_and_epoch, self.layer_ids)))
+
+    def __set_layer_fields(self, layers_version_info: dict) -> None:
+        """
+        This function keeps fields of the layers and builds dicts of attributes to display for every layer of the pairs.
+
+
+        Parameters
+        ---------
+        layers_version_info : dict
+            version info of every layer by layer id as returned by __get_latest_version_and_epoch
+        """
+        self.layer_fields = {layer_id: layer_info['fields'] for layer_id, layer_info in layers_version_info.items()}
+        for pair in self.pairs:
+            for role in self.ROLES:
+                pair[role]['attr_dict'] = {
+                    field_id: keyname
+                    for field_id, keyname in self.layer_fields[pair[role]['id']].items()
+                    if keyname in pair[role]['attr_params']
+                }
+
+    def __check_update(self):
+        """
+        This function checks new data in cloud and sends signals to update local data
+
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations,
+            if ok then changed key is True if changes were processed, versions key contains the number of processed versions of all layers,
+            layer_versions key contains the largest number of processed versions of one layer
+            and complete key is False if some layers were not updated to the latest version because of versions_per_cycle
+        """
+        latest_layers_info = self.__get_latest_versions_and_epochs()
+
+        errors = [f'For layer {layer_id}: {layer_info['message']}' for layer_id, layer_info in latest_layers_info.items() if layer_info['status'] != 'ok']
+        if (not errors):
+            saved_layers_info = {layer_id: self.__get_last_saved_version_and_epoch_by_id(layer_id) for layer_id in self.layer_ids}
+
+            errors = [f'For layer {layer_id}: {layer_info['message']}' for layer_id, layer_info in saved_layers_info.items() if layer_info['status'] != 'ok']
+            if (not errors):
+                for layer_id in self.layer_ids:
+                    self.metrics.set('version_lag', latest_layers_info[layer_id]['version']-saved_layers_info[layer_id]['version'], layer_id=layer_id)
+                changed_layer_ids = [
+                    layer_id
+                    for layer_id in self.layer_ids
+                    if saved_layers_info[layer_id]['version'] < latest_layers_info[layer_id]['version']
+                ]
+
+                if (changed_layer_ids):
+                    epochs = {layer_id: saved_layers_info[layer_id]['epoch'] for layer_id in changed_layer_ids}
+
+                    # a large catch-up is limited to versions_per_cycle versions of every layer, the rest is processed by next cycles,
+                    # all layers are cut at the same time, so changes of the next cycles are later than the processed ones
+                    target_layers_info = dict(latest_layers_info)
+                    if (self.versions_per_cycle is not None):
+                        target_info = self.__cut_versions_by_time(
+                            changed_layer_ids,
+                            {layer_id: saved_layers_info[layer_id]['version'] for layer_id in changed_layer_ids},
+                            {layer_id: min(latest_layers_info[layer_id]['version'], saved_layers_info[layer_id]['version']+self.versions_per_cycle) for layer_id in changed_layer_ids},
+                            {layer_id: latest_layers_info[layer_id]['version'] for layer_id in changed_layer_ids},
+                            epochs
+                        )
+                        if (target_info['status'] != 'ok'):
+                            return target_info
+                        for layer_id in changed_layer_ids:
+                            target_layers_info[layer_id] = dict(latest_layers_info[layer_id], version=target_info['versions'][layer_id])
+                    complete = all(target_layers_info[layer_id]['version'] == latest_layers_info[layer_id]['version'] for layer_id in changed_layer_ids)
+                    layer_versions = {layer_id: target_layers_info[layer_id]['version']-saved_layers_info[layer_id]['version'] for layer_id in changed_layer_ids}
+                    versions = sum(layer_versions.values())
+
+                    # the catch-up is processed in windows of up to catch_up_window_versions versions of every layer cut at the same time,
+                    # the saved versions are moved to the end of the window only after its events are emitted
+                    checkpoint_layers_info = dict(target_layers_info)
+                    for layer_id in changed_layer_ids:
+                        checkpoint_layers_info[layer_id] = dict(target_layers_info[layer_id], version=saved_layers_info[layer_id]['version'])
+
+                    while True:
+                        window_layer_ids = [
+                            layer_id
+                            for layer_id in changed_layer_ids
+                            if checkpoint_layers_info[layer_id]['version'] < target_layers_info[layer_id]['version']
+                        ]
+                        if (not window_layer_ids):
+                            return {'status':'ok', 'changed': True, 'versions': versions, 'layer_versions': max(layer_versions.values()), 'complete': complete}
+
+                        window_info = self.__cut_versions_by_time(
+                            window_layer_ids,
+                            {layer_id: checkpoint_layers_info[layer_id]['version'] for layer_id in window_layer_ids},
+                            {layer_id: min(target_layers_info[layer_id]['version'], checkpoint_layers_info[layer_id]['version']+self.catch_up_window_versions) for layer_id in window_layer_ids},
+                            {layer_id: target_layers_info[layer_id]['version'] for layer_id in window_layer_ids},
+                            epochs
+                        )
+                        if (window_info['status'] != 'ok'):
+                            message = window_info['message']
+                            break
+                        window_layers_info = dict(checkpoint_layers_info)
+                        for layer_id in window_layer_ids:
+                            window_layers_info[layer_id] = dict(target_layers_info[layer_id], version=window_info['versions'][layer_id])
+                        window_layer_ids = [layer_id for layer_id in window_layer_ids if window_layers_info[layer_id]['version'] > checkpoint_layers_info[layer_id]['version']]
+
+                        window_info = self.__process_window(
+                            window_layer_ids,
+                            checkpoint_layers_info,
+                            window_layers_info,
+                            {layer_id: epochs[layer_id] for layer_id in window_layer_ids}
+                        )
+                        if (window_info['status'] != 'ok'):
+                            message = window_info['message']
+                            break
+                        checkpoint_layers_info = window_layers_info
+                        for layer_id in window_layer_ids:
+                            self.metrics.set('version_lag', latest_layers_info[layer_id]['version']-window_layers_info[layer_id]['version'], layer_id=layer_id)
+
+                else:
+                    if __debug__:
+                        self.__send_message(datetime.now().strftime("%H:%M:%S")+' From last upd nothing was changed')
+                    return {'status':'ok', 'changed': False, 'versions': 0, 'layer_versions': 0, 'complete': True}
+            else: message = f'Error when getting last saved version of layers. {'; '.join(errors)}'
+        else: message = f'Error when getting version of layers. {'; '.join(errors)}'
+        return self.__handle_error(message)
+
+    def __cut_versions_by_time(self, layer_ids: list, from_versions: dict, end_versions: dict, max_versions: dict, epochs: dict) -> dict:
+        """
+        This function cuts the ranges of versions of the layers at the same time, so changes of all layers after the ranges are later than changes in them.
+        The time limit is the earliest time of the end versions of layers which have versions after the end version,
+        the range of every layer is cut at its last version at or before the limit. Versions of a layer are ordered by time,
+        so the last version is found by a binary search, metadata of versions is taken from the version cache.
+
+
+        Parameters
+        ---------
+        layer_ids : list
+            ids of the layers
+
+        from_versions : dict
+            versions of the layers by layer id, the ranges start after them
+
+        end_versions : dict
+            the largest allowed end versions of the ranges by layer id
+
+        max_versions : dict
+            the versions of the layers by layer id which may be processed, versions after them are not taken into account
+
+        epochs : dict
+            epochs of the layers by layer id
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then versions key contains the end versions of the ranges by layer id
+        """
+        limiting_layer_ids = [layer_id for layer_id in layer_ids if end_versions[layer_id] < max_versions[layer_id]]
+        if (not limiting_layer_ids):
+            return {'status':'ok', 'versions': dict(end_versions)}
+
+        versions_time = {}
+
+        def get_version_time(layer_id: int, version: int):
+            if ((layer_id, version) not in versions_time):
+                with self.metrics.time('stage_duration_seconds', stage='version_metadata'):
+                    status = self.__get_versions_information(layer_id, epochs[layer_id], [version])
+                version_info = self.version_cache.get(layer_id, epochs[layer_id], version) if status['status'] == 'ok' else None
+                if (version_info is None or 'tstamp' not in version_info):
+                    raise ValueError(f'no time of the version {version} of the layer with id {layer_id}')
+                versions_time[(layer_id, version)] = self.__get_time({'time': version_info['tstamp']})
+            return versions_time[(layer_id, version)]
+
+        try:
+            time_limit = min(get_version_time(layer_id, end_versions[layer_id]) for layer_id in limiting_layer_ids)
+            versions = {}
+            for layer_id in layer_ids:
+                low, high = from_versions[layer_id], end_versions[layer_id]
+                if (get_version_time(layer_id, high) <= time_limit):
+                    low = high
+                while (low < high):
+                    middle = (low+high+1)//2
+                    if (get_version_time(layer_id, middle) <= time_limit):
+                        low = middle
+                    else:
+                        high = middle-1
+                versions[layer_id] = low
+        except ValueError as e:
+            return self.__handle_error(f'Error when cutting versions of layers by time: {e}')
+        return {'status':'ok', 'versions': versions}
+
+    def __process_window(self, layer_ids: list, from_layers_info: dict, to_layers_info: dict, epochs: dict) -> dict:
+        """
+        This function processes changes of the layers between two checkpoints and saves the end of the window as the checkpoint.
+
+
+        Parameters
+        ---------
+        layer_ids : list
+            ids of the layers changed in the window
+
+        from_layers_info : dict
+            version info of all layers by layer id at the start of the window
+
+        to_layers_info : dict
+            version info of all layers by layer id at the end of the window, it is saved when the window is processed
+
+        epochs : dict
+            epochs of the changed layers by layer id
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
+        """
+        # the difference of every changed layer is requested once and fanned out to all pairs using the layer
+        layers_dif_info = {
+            layer_id: self.__get_difference_between_versions(
+                layer_id,
+                from_layers_info[layer_id]['version'],
+                to_layers_info[layer_id]['version'],
+                epochs[layer_id]
+            )
+            for layer_id in layer_ids
+        }
+
+        errors = [f'For layer {layer_id}: {dif_info['message']}' for layer_id, dif_info in layers_dif_info.items() if dif_info['status'] != 'ok']
+        if (errors):
+            return self.__handle_error(f'Error when getting difference list of features. {'; '.join(errors)}')
+
+        # changes of every layer are already sorted by time, so they are merged lazily
+        layers_differences = heapq.merge(*(dif_info['dif_list'] for dif_info in layers_dif_info.values()), key=self.__get_time)
+        return self.__check_geometry(layers_differences, from_layers_info, to_layers_info)
+
+    def __check_geometry(self, both_layers_differences, from_layers_info: dict = None, to_layers_info: dict = None):
+        """
+        This function checks the geometry of shapes for a geofencing event
+        Changes are processed in chunks of changes_chunk_size, so only one chunk is kept in memory.
+        If to_layers_info is set, the versions are recorded in the local GPKG files and in the state store
+        in the transactions of the changes, after events are emitted.
+
+        Parameters
+        ----------
+        both_layers_differences: iterable
+            the list or the iterator of layers updated information sorted by time
+
+        from_layers_info : dict
+            version info of all layers by layer id before the changes
+
+        to_layers_info : dict
+            version info of all layers by layer id after the changes
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
+        """
+        status = self.__open_layer_datasets()
+        if (status['status'] != 'ok'):
+            return status
+
+        # all changes of the list are applied to local layers in one transaction per GPKG file
+        started_layer_ids = []
+        try:
+            for layer_id in self.layer_ids:
+                self.layer_datasets[layer_id].StartTransaction()
+                started_layer_ids.append(layer_id)
+            if (self.membership_store is not None):
+                self.membership_store.begin()
+
+            for chunk in self.__iter_chunks(both_layers_differences, self.changes_chunk_size):
+                if (not self.offline):
+                    with self.metrics.time('stage_duration_seconds', stage='attributes_fetch'):
+                        status = self.__fetch_missing_attributes(chunk)
+                    if (status['status'] != 'ok'):
+                        break
+                start, apply_seconds = time.perf_counter(), self.apply_seconds
+                if (self.spatial_index == 'memory'):
+                    status = self.__check_geometry_batch(chunk)
+                else:
+                    status = self.__check_geometry_ogr(chunk)
+                apply_seconds = self.apply_seconds-apply_seconds
+                self.metrics.observe('stage_duration_seconds', apply_seconds, stage='gpkg_apply')
+                self.metrics.observe('stage_duration_seconds', time.perf_counter()-start-apply_seconds, stage='geometry_evaluation')
+                if (status['status'] != 'ok'):
+                    break
+
+            if (status['status'] == 'ok' and to_layers_info is not None):
+                # versions are saved only after changes are applied to local layers and events are emitted
+                self.notifier.flush_cycle()
+                for layer_id in self.layer_ids:
+                    self.__set_mirror_version(layer_id, to_layers_info[layer_id])
+                self.state_store.begin()
+                status = self.__write_cur_versions(to_layers_info, from_layers_info)
+
+            if (status['status'] == 'ok'):
+                with self.metrics.time('stage_duration_seconds', stage='commit'):
+                    while (started_layer_ids):
+                        self.layer_datasets[started_layer_ids[0]].CommitTransaction()
+                        started_layer_ids.pop(0)
+                    if (self.membership_store is not None):
+                        self.membership_store.commit()
+                    self.state_store.commit()
+        except Exception as e:
+            status = self.__handle_error(f"Error when checking geometry: {e}")
+
+        if (status['status'] == 'ok'):
+            if (to_layers_info is not None):
+                self.__set_layer_fields(to_layers_info)
+                self.__prune_version_cache(to_layers_info)
+        else:
+            self.__rollback(started_layer_ids)
+            self.__reset_local_state()
+        return status
+
+    def __rollback(self, started_layer_ids: list) -> None:
+        """
+        This function rolls back transactions of local GPKG files and stores after a failed check, so the next cycle starts new transactions.
+        If the transaction of a GPKG file can not be rolled back, the file is closed, which discards the transaction, and it is opened again by the next check.
+        """
+        for layer_id in started_layer_ids:
+            try:
+                self.layer_datasets[layer_id].RollbackTransaction()
+            except Exception as e:
+                if __debug__:
+                    print(f"Error when rolling back changes of the local GPKG file of the layer with id {layer_id}: {e}\n")
+                self.__close_layer_datasets()
+                break
+        for store in (self.membership_store, self.state_store):
+            if (store is None):
+                continue
+            try:
+                store.rollback()
+            except sqlite3.Error as e:
+                if __debug__:
+                    print(f"Error when rolling back changes of the store {store.db_path}: {e}\n")
+
+    def __prune_version_cache(self, layers_info: dict) -> None:
+        """
+        This function drops metadata of saved versions from the version cache, so its files do not grow with every processed version.
+        """
+        for layer_id, layer_info in layers_info.items():
+            try:
+                self.version_cache.prune(layer_id, layer_info['epoch'], layer_info['version'])
+            except OSError as e:
+                if __debug__:
+                    print(f"Error when saving the version cache for the layer with id {layer_id}: {e}\n")
+
+    @staticmethod
+    def __iter_chunks(items, chunk_size: int):
+        """
+        This function yields lists of up to chunk_size consecutive items.
+        """
+        iterator = iter(items)
+        chunk = list(islice(iterator, chunk_size))
+        while (chunk):
+            yield chunk
+            chunk = list(islice(iterator, chunk_size))
+
+    def __open_layer_datasets(self) -> dict:
+        """
+        This function opens local GPKG files of all layers for update, opened datasets are kept for next checks.
+
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
+        """
+        layers_path = os.path.join(self.tmp_files_path, 'layers')
+        gpkg_driver = ogr.GetDriverByName("GPKG")
+
+        for layer_id in self.layer_ids:
+            if (self.layer_datasets.get(layer_id) is None):
+                file_name_and_path = os.path.join(layers_path, f'layer_{layer_id}.gpkg')
+                try:
+                    self.layer_datasets[layer_id] = gpkg_driver.Open(file_name_and_path, 1)
+                except RuntimeError as e:
+                    return self.__handle_error(f"ERROR: open GPKG file {file_name_and_path} failed: {e}")
+                if (self.layer_datasets[layer_id] is None):
+                    return self.__handle_error(f"ERROR: open GPKG file {file_name_and_path} failed")
+                if (self.reprojector is not None):
+                    self.reprojector.add_layer(layer_id, self.layer_datasets[layer_id].GetLayer().GetSpatialRef())
+        return {'status':'ok'}
+
+    def __close_layer_datasets(self) -> None:
+        """
+        This function closes opened local GPKG files.
+        """
+        for layer_id in list(self.layer_datasets):
+            self.layer_datasets[layer_id] = None
+        self.layer_datasets.clear()
+
+    def __reset_local_state(self) -> None:
+        """
+        This function drops in-memory data derived from local layers after a rolled back transaction, spatial indexes are built again from GPKG files.
+        """
+        self.buffer_cache.clear()
+        self.prepared_cache = PreparedGeometryCache(self.prepared_cache_size)
+        self.feature_versions.clear()
+        if (self.spatial_index == 'memory'):
+            self.__build_spatial_indexes()
+
+    def __check_geometry_ogr(self, both_layers_differences: list) -> dict:
+        """
+        This function checks the geometry of shapes for geofencing events change by change using spatial filters of local GPKG layers.
+        Every change is checked against the opposite layer of every pair using the changed layer.
+
+
+        Parameters
+        ----------
+        both_layers_differences : list
+            the list of layers updated information sorted by time
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
+        """
+        for item in both_layers_differences:
+            layer_id = item['layer_id']
+            if (layer_id not in self.layer_roles):
+                return self.__handle_error(f"Wrong layer id {layer_id} in the list of updates")
+
+            own_layer_geometry = self.layer_datasets[layer_id].GetLayer()
+            feature = None
+            if (item['action'] != 'feature.create'): 
+                feature = own_layer_geometry.GetFeature(item['fid'])
+
+            if ('geom' in item):
+                wkb_data = base64.b64decode(item['geom'])
+                layer_object = ogr.CreateGeometryFromWkb(wkb_data)
+            else:
+                layer_object = feature.GetGeometryRef()
+
+            # the changed object is transformed into the metric CRS once for all pairs
+            check_object = layer_object if self.reprojector is None else self.reprojector.to_metric_ogr(layer_id, layer_object)
+            for pair, role in self.layer_roles[layer_id]:
+                record = None
+                if (self.profiler.trace is not None):
+                    record = {'layer_id': layer_id, 'fid': item['fid'], 'action': item['action'], 'top_layer_id': pair['top']['id'], 'bottom_layer_id': pair['bottom']['id']}
+                    self.profiler.trace.append(record)
+                opposite_features = {opposite_feature.GetFID(): opposite_feature for opposite_feature in self.__find_intersections_ogr(pair, role, check_object, record)}
+                opposite_layer_geometry = self.layer_datasets[pair[self.OPPOSITE_ROLE[role]]['id']].GetLayer()
+                get_opposite_feature = lambda fid: opposite_features[fid] if fid in opposite_features else opposite_layer_geometry.GetFeature(fid)
+                for event in self.__get_geofence_events(pair, role, item, feature, list(opposite_features), get_opposite_feature):
+                    self.__send_event(event)
+
+            self.__do_action_with_layer(layer_id, item, own_layer_geometry, layer_object)
+
+        if __debug__:
+            print(f"Buffer cache: {self.buffer_cache.stats()}\n")
+        return {'status':'ok'}
+
+    def __find_intersections_ogr(self, pair: dict, role: str, layer_object: ogr.Geometry, record: dict = None):
+        """
+        This function yields features of the opposite layer of the pair which intersect the changed object with buffers of the pair.
+        If the cycle is profiled, the number of candidates and the time of buffers and intersection tests are added to the trace record.
+
+
+        Parameters
+        ----------
+        pair : dict
+            the pair of top and bottom layers
+
+        role : str
+            top or bottom, the role of the changed layer in the pair
+
+        layer_object : ogr.Geometry
+            geometry of the changed object, in the metric CRS if it is set
+
+        record : dict
+            the trace record of the change, None if the cycle is not profiled
+
+        Returns
+        -------
+        generator
+            features of the opposite layer
+        """
+        opposite_layer_id = pair[self.OPPOSITE_ROLE[role]]['id']
+        opposite_layer_geometry = self.layer_datasets[opposite_layer_id].GetLayer()
+        min_x, max_x, min_y, max_y = layer_object.GetEnvelope()
+
+        # memberships are built by the distance between the original geometries with buffers of both layers, so in stateful modes
+        # changes are tested by the same distance, buffered polygons only approximate it and features near the edge would flap
+        distance = None
+        if (self.geofence_mode in self.STATEFUL_MODES):
+            distance = max(pair['top']['buffer'], 0)+max(pair['bottom']['buffer'], 0)
+
+        buffer = pair['bottom']['buffer']+pair['top']['buffer'] if distance is None else distance
+        if (opposite_layer_geometry.GetGeomType() not in (ogr.wkbPolygon, ogr.wkbMultiPolygon) and buffer < 0): buffer = 0
+        filter_envelope = (min_x-1-buffer, max_x+1+buffer, min_y-1-buffer, max_y+1+buffer)
+        if (self.reprojector is not None):
+            filter_envelope = self.reprojector.envelope_to_layer(opposite_layer_id, *filter_envelope)
+        opposite_layer_geometry.SetSpatialFilterRect(filter_envelope[0], filter_envelope[2], filter_envelope[1], filter_envelope[3])
+        opposite_layer_geometry.ResetReading()
+
+        candidates, intersections = 0, 0
+        # timers run only in profiled cycles
+        tracing = record is not None
+        buffer_time, intersect_time = 0.0, 0.0
+        if (role == 'top'):
+            start = time.perf_counter()
+            if (distance is None and pair['top']['buffer'] > 0):
+                top_object_check = layer_object.Buffer(pair['top']['buffer'])
+            else:
+                top_object_check = layer_object
+            buffer_time += time.perf_counter()-start
+
+            for bottom_feature in opposite_layer_geometry:
+                candidates += 1
+                bottom_geom = self.__get_metric_geometry(opposite_layer_id, bottom_feature.GetFID(), bottom_feature.GetGeometryRef())
+                
+                if (distance is None and pair['bottom']['buffer'] > 0):
+                    if (tracing): start = time.perf_counter()
+                    bottom_geom = self.__get_buffered_geometry(pair['bottom']['id'], bottom_feature.GetFID(), bottom_geom, pair['bottom']['buffer'])
+                    if (tracing): buffer_time += time.perf_counter()-start
+                
+                if (tracing): start = time.perf_counter()
+                if (distance):
+                    intersects = bottom_geom.Distance(top_object_check) <= distance
+                else:
+                    intersects = bottom_geom.Intersects(top_object_check)
+                if (tracing): intersect_time += time.perf_counter()-start
+                if (intersects):
+                    intersections += 1
+                    yield bottom_feature
+        else:
+            # in stateful modes the changed bottom object is tested by the distance of memberships,
+            # otherwise features which are inside only by buffers would exit on every change of the bottom object
+            for top_layer_object in opposite_layer_geometry:
+                candidates += 1
+                point_geom = self.__get_metric_geometry(opposite_layer_id, top_layer_object.GetFID(), top_layer_object.GetGeometryRef())
+                if (tracing): start = time.perf_counter()
+                if (point_geom is None):
+                    intersects = False
+                elif (distance):
+                    intersects = layer_object.Distance(point_geom) <= distance
+                else:
+                    intersects = layer_object.Intersects(point_geom)
+                if (tracing): intersect_time += time.perf_counter()-start
+                if (intersects):
+                    intersections += 1
+                    yield top_layer_object
+        self.metrics.inc('candidate_pairs_total', candidates)
+        self.metrics.inc('intersections_total', intersections)
+        if (tracing):
+            record.update(candidates=candidates, intersections=intersections, buffer_time=buffer_time, intersect_time=intersect_time)
+
+    def __check_geometry_batch(self, both_layers_differences: list) -> dict:
+        """
+        This function checks the geometry of shapes for geofencing events using in-memory spatial indexes.
+        The list is split into runs of consecutive changes of one layer. Opposite layers are not changed inside a run,
+        so intersections for the whole run are found by one vectorized query per pair and changes are applied after it in time order.
+        Events are sent when the whole list is processed.
+
+
+        Parameters
+        ----------
+        both_layers_differences : list
+            the list of layers updated information sorted by time
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
+        """
+        events = []
+        start = 0
+        while (start < len(both_layers_differences)):
+            layer_id = both_layers_differences[start]['layer_id']
+            if (layer_id not in self.layer_roles):
+                return self.__handle_error(f"Wrong layer id {layer_id} in the list of updates")
+            own_layer_geometry = self.layer_datasets[layer_id].GetLayer()
+
+            end = start
+            while (end < len(both_layers_differences) and both_layers_differences[end]['layer_id'] == layer_id):
+                end += 1
+            run = both_layers_differences[start:end]
+
+            # geometries of the run are decoded once for all pairs using the layer
+            geometries = self.__get_run_geometries(layer_id, run)
+            pair_matches = []
+            for pair, role in self.layer_roles[layer_id]:
+                record = None
+                if (self.profiler.trace is not None):
+                    record = {'layer_id': layer_id, 'changes': len(run), 'top_layer_id': pair['top']['id'], 'bottom_layer_id': pair['bottom']['id']}
+                    self.profiler.trace.append(record)
+                    pair_start = time.perf_counter()
+                if (self.geofence_mode == 'nearest'):
+                    positions, opposite_fids, distances = self.__find_run_nearest(pair, role, geometries)
+                else:
+                    positions, opposite_fids = self.__find_run_intersections(pair, role, geometries, record)
+                    distances = None
+                opposite_layer_geometry = self.layer_datasets[pair[self.OPPOSITE_ROLE[role]]['id']].GetLayer()
+                bounds = np.searchsorted(positions, np.arange(len(run)+1))
+                if (record is not None):
+                    # the run is checked by vectorized queries, so times are known for the run and counts for every change
+                    record['time'] = time.perf_counter()-pair_start
+                    candidate_counts = record.pop('candidate_counts', None)
+                    record['items'] = [
+                        {
+                            'fid': item['fid'],
+                            'candidates': int(candidate_counts[position]) if candidate_counts is not None else None,
+                            'intersections': int(bounds[position+1]-bounds[position])
+                        }
+                        for position, item in enumerate(run)
+                    ]
+                pair_matches.append((pair, role, opposite_layer_geometry, opposite_fids, distances, bounds))
+
+            for position, item in enumerate(run):
+                feature = None
+                if (item['action'] != 'feature.create'):
+                    feature = own_layer_geometry.GetFeature(item['fid'])
+
+                for pair, role, opposite_layer_geometry, opposite_fids, distances, bounds in pair_matches:
+                    if (distances is not None):
+                        for match in range(bounds[position], bounds[position+1]):
+                            opposite_feature = opposite_layer_geometry.GetFeature(int(opposite_fids[match]))
+                            events.append(self.__make_event(pair, role, item, feature, opposite_feature, distance=float(distances[match])))
+                        continue
+                    events.extend(self.__get_geofence_events(
+                        pair, role, item, feature,
+                        opposite_fids[bounds[position]:bounds[position+1]].tolist(),
+                        opposite_layer_geometry.GetFeature
+                    ))
+
+                if ('geom' in item):
+                    layer_object = ogr.CreateGeometryFromWkb(base64.b64decode(item['geom']))
+                else:
+                    layer_object = feature.GetGeometryRef()
+                self.__do_action_with_layer(layer_id, item, own_layer_geometry, layer_object)
+
+            start = end
+
+        for event in events:
+            self.__send_event(event)
+
+        if __debug__:
+            print(f"Prepared geometries cache: {self.prepared_cache.stats()}\n")
+        return {'status':'ok'}
+    
+    def __fetch_missing_attributes(self, both_layers_differences: list) -> dict:
+        """
+        This function adds fields to feature.create changes which came without them.
+        Attributes are requested from the feature collection of the layer in pages filtered by feature ids, not one request per feature.
+
+
+        Parameters
+        ---------
+        both_layers_differences : list
+            the list of layers updated information
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
+        """
+        items_by_layer = {}
+        for item in both_layers_differences:
+            if (item['action'] == 'feature.create' and 'fields' not in item and item['layer_id'] in self.layer_fields):
+                items_by_layer.setdefault(item['layer_id'], {})[item['fid']] = item
+
+        for layer_id, items in items_by_layer.items():
+            field_ids = {keyname: field_id for field_id, keyname in self.layer_fields[layer_id].items()}
+            fids = sorted(items)
+            for page_start in range(0, len(fids), self.ATTRIBUTES_PAGE_SIZE):
+                page_fids = fids[page_start:page_start+self.ATTRIBUTES_PAGE_SIZE]
+                req = (f'{self.ngw_host}/api/resource/{layer_id}/feature/?geom=no&label=false&dt_format=obj'
+                       f'&limit={len(page_fids)}&{self.FEATURE_ID_FILTER}={",".join(map(str, page_fids))}')
+                req_info = self.http.get(req, auth = (self.ngw_login, self.ngw_password))
+                if (req_info.status_code != 200):
+                    return self.__handle_error(f'Request error when getting attributes of created features for the layer with id {layer_id}: {req_info.status_code}')
+
+                for feature in req_info.json():
+                    if (feature['id'] in items):
+                        items[feature['id']]['fields'] = [[field_ids[keyname], value] for keyname, value in feature['fields'].items() if keyname in field_ids]
+
+            for item in items.values():
+                # the feature was deleted on the server after the change
+                item.setdefault('fields', [])
+        return {'status':'ok'}
+
+    def __get_buffered_geometry(self, layer_id: int, fid: int, geometry: ogr.Geometry, buffer: float) -> ogr.Geometry:
+        """
+        This function returns the buffered geometry of the feature from the buffer cache, the buffer is built only on a cache miss.
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        fid : int
+            id of the feature in the layer
+
+        geometry : ogr.Geometry
+            current geometry of the feature
+
+        buffer : float
+            size of the buffer
+
+        Returns
+        -------
+        ogr.Geometry
+            buffered geometry of the feature
+        """
+        key = (layer_id, fid, self.feature_versions.get((layer_id, fid), 0), buffer)
+        return self.buffer_cache.get(key, lambda: geometry.Buffer(buffer))
+
+    def __get_metric_geometry(self, layer_id: int, fid: int, geometry: ogr.Geometry) -> ogr.Geometry:
+        """
+        This function returns the geometry of the feature in the metric CRS, it is transformed only once per version of the feature and kept in the buffer cache.
+        The geometry is returned as is if the metric CRS is not set.
+        """
+        if (self.reprojector is None or geometry is None):
+            return geometry
+        key = (layer_id, fid, self.feature_versions.get((layer_id, fid), 0), 'metric')
+        return self.buffer_cache.get(key, lambda: self.reprojector.to_metric_ogr(layer_id, geometry))
+
+    def __to_metric(self, layer_id: int, geometries):
+        """
+        This function returns shapely geometries of the layer in the metric CRS, they are returned as is if the metric CRS is not set.
+        """
+        if (self.reprojector is None):
+            return geometries
+        return self.reprojector.to_metric(layer_id, geometries)
+
+    def __get_run_geometries(self, layer_id: int, run: list) -> np.ndarray:
+        """
+        This function returns shapely geometries of the changed features of one layer.
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource, which features were changed
+
+        run : list
+            consecutive changes of the layer sorted by time
+
+        Returns
+        -------
+        np.ndarray
+            geometries in the order of the run in the metric CRS if it is set, None for features without geometry
+        """
+        own_index = self.spatial_indexes[layer_id]
+        has_geom = np.array(['geom' in item for item in run], dtype=bool)
+        geometries = np.empty(len(run), dtype=object)
+        if (has_geom.any()):
+            wkb_list = [base64.b64decode(item['geom']) for item in run if 'geom' in item]
+            geometries[has_geom] = self.__to_metric(layer_id, shapely.from_wkb(np.array(wkb_list, dtype=object)))
+
+        # features without geometry in the change take it from the previous change in the run or from the index
+        run_geometries = {}
+        for position, item in enumerate(run):
+            if (has_geom[position]):
+                run_geometries[item['fid']] = geometries[position]
+            elif (item['fid'] in run_geometries):
+                geometries[position] = run_geometries[item['fid']]
+            else:
+                geometries[position] = own_index.get(item['fid'])
+        return geometries
+
+    def __find_run_intersections(self, pair: dict, role: str, geometries: np.ndarray, record: dict = None) -> tuple:
+        """
+        This function finds all intersections of the changed features of one layer with the opposite layer of the pair by one bulk query to the in-memory spatial index.
+        If the cycle is profiled, candidates of every change and the time of the index query and intersection tests are added to the trace record.
+
+
+        Parameters
+        ---------
+        pair : dict
+            the pair of top and bottom layers
+
+        role : str
+            top or bottom, the role of the changed layer in the pair
+
+        geometries : np.ndarray
+            geometries of the changed features as returned by __get_run_geometries
+
+        record : dict
+            the trace record of the run, None if the cycle is not profiled
+
+        Returns
+        -------
+        tuple
+            two numpy arrays of the same length: positions of changes in the run and fids of intersected features of the opposite layer, sorted by position and fid
+        """
+        opposite_layer_id = pair[self.OPPOSITE_ROLE[role]]['id']
+        opposite_index = self.spatial_indexes[opposite_layer_id]
+
+        valid_positions = np.flatnonzero(~shapely.is_missing(geometries))
+        start = time.perf_counter()
+        if (role == 'top'):
+            # buffers of both layers are replaced with the distance between the original geometries
+            distance = max(pair['top']['buffer'], 0)+max(pair['bottom']['buffer'], 0)
+            # the bottom layer geometries are tested many times, so the predicate is checked with them prepared
+            input_indexes, fids = opposite_index.query(geometries[valid_positions], distance=distance)
+            candidate_geometries = opposite_index.get_many(fids)
+            self.prepared_cache.prepare(opposite_layer_id, fids, candidate_geometries)
+            query_geometries = geometries[valid_positions][input_indexes]
+            intersect_start = time.perf_counter()
+            if (distance > 0):
+                hits = shapely.dwithin(candidate_geometries, query_geometries, distance)
+            else:
+                hits = shapely.intersects(candidate_geometries, query_geometries)
+            self.metrics.inc('candidate_pairs_total', len(fids))
+            if (record is not None):
+                record.update(
+                    candidates=len(fids),
+                    candidate_counts=np.bincount(valid_positions[input_indexes], minlength=len(geometries)),
+                    query_time=intersect_start-start,
+                    intersect_time=time.perf_counter()-intersect_start
+                )
+            input_indexes, fids = input_indexes[hits], fids[hits]
+        else:
+            # the index tests candidates by the predicate itself, so only intersections are counted
+            distance = max(pair['top']['buffer'], 0)+max(pair['bottom']['buffer'], 0)
+            if (self.geofence_mode in self.STATEFUL_MODES and distance > 0):
+                # memberships are kept with buffers of both layers, so changes of the bottom layer are tested with the same distance
+                input_indexes, fids = opposite_index.query(geometries[valid_positions], predicate='dwithin', distance=distance)
+            else:
+                input_indexes, fids = opposite_index.query(geometries[valid_positions], predicate='intersects')
+            if (record is not None):
+                record.update(query_time=0.0, intersect_time=time.perf_counter()-start)
+        self.metrics.inc('intersections_total', len(fids))
+        if (record is not None):
+            record['intersections'] = len(fids)
+        return valid_positions[input_indexes], fids
+
+    def __get_geofence_events(self, pair: dict, role: str, item: dict, feature: ogr.Feature, opposite_fids: list, get_opposite_feature) -> list:
+        """
+        This function builds geofencing events of the change for the pair.
+        In intersection mode every intersection is an event. In enter_exit and dwell modes the intersections are compared
+        with the memberships of the feature, the memberships are updated and only enter and exit events are built.
+
+
+        Parameters
+        ---------
+        pair : dict
+            the pair of top and bottom layers
+
+        role : str
+            top or bottom, the role of the changed layer in the pair
+
+        item : dict
+            item with info about cloud action with the feature
+
+        feature : ogr.Feature
+            local feature of the changed object before the change is applied, None for feature.create
+
+        opposite_fids : list
+            fids of the features of the opposite layer which intersect the changed object
+
+        get_opposite_feature : callable
+            function returning the feature of the opposite layer by fid
+
+        Returns
+        -------
+        list
+            events in the order of fids
+        """
+        if (self.geofence_mode == 'intersection'):
+            return [self.__make_event(pair, role, item, feature, get_opposite_feature(fid)) for fid in opposite_fids]
+
+        top_layer_id, bottom_layer_id = pair['top']['id'], pair['bottom']['id']
+        memberships = self.membership_store.get(top_layer_id, bottom_layer_id, role, item['fid'])
+        current_fids = set() if item['action'] == 'feature.delete' else set(opposite_fids)
+        entered_fids = sorted(current_fids.difference(memberships))
+        exited_fids = sorted(set(memberships).difference(current_fids))
+
+        def as_pair(opposite_fid):
+            return (item['fid'], opposite_fid) if role == 'top' else (opposite_fid, item['fid'])
+
+        since = self.__get_timestamp(item)
+        self.membership_store.add(top_layer_id, bottom_layer_id, [(*as_pair(fid), since) for fid in entered_fids])
+        self.membership_store.remove(top_layer_id, bottom_layer_id, [as_pair(fid) for fid in exited_fids])
+
+        events = []
+        if (self.geofence_mode == 'enter_exit'):
+            for fid in entered_fids:
+                events.append(self.__make_event(pair, role, item, feature, get_opposite_feature(fid), 'enter'))
+        for fid in exited_fids:
+            # in dwell mode only exits after a dwell event are reported
+            if (self.geofence_mode == 'enter_exit' or memberships[fid][1]):
+                opposite_feature = get_opposite_feature(fid)
+                if (opposite_feature is not None):
+                    events.append(self.__make_event(pair, role, item, feature, opposite_feature, 'exit'))
+        return events
+
+    def __find_run_nearest(self, pair: dict, role: str, geometries: np.ndarray) -> tuple:
+        """
+        This function finds the nearest feature of the bottom layer of the pair within nearest_max_distance for every changed feature of the top layer by one bulk query to the in-memory spatial index.
+        Changes of the bottom layer have no nearest events.
+
+
+        Parameters
+        ---------
+        pair : dict
+            the pair of top and bottom layers
+
+        role : str
+            top or bottom, the role of the changed layer in the pair
+
+        geometries : np.ndarray
+            geometries of the changed features as returned by __get_run_geometries
+
+        Returns
+        -------
+        tuple
+            three numpy arrays of the same length: positions of changes in the run, fids of the nearest features of the bottom layer and distances to them, sorted by position
+        """
+        if (role != 'top'):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        valid_positions = np.flatnonzero(~shapely.is_missing(geometries))
+        input_indexes, fids, distances = self.spatial_indexes[pair['bottom']['id']].query_nearest(geometries[valid_positions], self.nearest_max_distance)
+        return valid_positions[input_indexes], fids, distances
+
+    def __make_event(self, pair: dict, role: str, item: dict, feature: ogr.Feature, opposite_feature: ogr.Feature, event_type: str = None, distance: float = None) -> dict:
+        """
+        This function builds a structured geofencing event for the change and the feature of the opposite layer of the pair.
+
+
+        Parameters
+        ---------
+        pair : dict
+            the pair of top and bottom layers
+
+        role : str
+            top or bottom, the role of the changed layer in the pair
+
+        item : dict
+            item with info about cloud action with the feature
+
+        feature : ogr.Feature
+            local feature of the changed object before the change is applied, None for feature.create
+
+        opposite_feature : ogr.Feature
+            local feature of the opposite layer
+
+        event_type : str
+            enter, exit or dwell, the geofence mode if not set
+
+        distance : float
+            distance between the objects, it is added to the event if set
+
+        Returns
+        -------
+        dict
+            the event with ids and attributes of both objects
+        """
+        opposite_role = self.OPPOSITE_ROLE[role]
+        attr_dict = pair[role]['attr_dict']
+        if (item['action'] == "feature.create"):
+            attributes = [{attr_dict[field[0]]: field[1]} for field in item.get('fields', []) if (field[0] in attr_dict)]
+        else:
+            attributes = [{attr_dict[field]: feature.GetField(str(attr_dict[field]))} for field in attr_dict]
+
+        opposite_attr_dict = pair[opposite_role]['attr_dict']
+        opposite_attributes = [{opposite_attr_dict[field]: opposite_feature.GetField(opposite_attr_dict[field])} for field in opposite_attr_dict]
+
+        event = {
+            'type': event_type or self.geofence_mode,
+            'action': item['action'],
+            'layer_id': item['layer_id'],
+            'time': item.get('time'),
+            f'{role}_layer_id': pair[role]['id'],
+            f'{role}_fid': item['fid'],
+            f'{role}_attributes': attributes,
+            f'{opposite_role}_layer_id': pair[opposite_role]['id'],
+            f'{opposite_role}_fid': opposite_feature.GetFID(),
+            f'{opposite_role}_attributes': opposite_attributes
+        }
+        if (distance is not None):
+            event['distance'] = distance
+        return event
+
+    def __send_event(self, event: dict) -> None:
+        """
+        This function makes the notification text for the geofencing event and sends it.
+        In replay the event is written to the events file as a JSON line instead.
+        """
+        self.metrics.inc('events_total', type=event['type'])
+        if (self.events_file is not None):
+            self.events_file.write(json.dumps(event, ensure_ascii=False, default=str))
+            self.events_file.write('\n')
+            self.events_written += 1
+            return
+
+        relation = {
+            'intersection': 'intersects with',
+            'enter': 'entered',
+            'exit': 'left',
+            'dwell': f'stays longer than {self.dwell_time_sec} s in',
+            'nearest': f'is at distance {event.get('distance', 0):.2f} from the nearest'
+        }[event['type']]
+        message =  (f"Top layer object with id {event['top_fid']} {relation} the bottom layer object with id {event['bottom_fid']} by action {event['action']}.\n"
+                    f"Attributes of top layer object: {event['top_attributes']}\n"
+                    f"Attributes of bottom layer object: {event['bottom_attributes']}\n")
+        if (len(self.pairs) > 1):
+            # with several pairs the message tells which layers were checked
+            message = f"Layers {event['top_layer_id']} (top) and {event['bottom_layer_id']} (bottom).\n"+message
+        self.__send_message(message)
+
+    def __do_action_with_layer(self, layer_id: int, item: dict, layer_geometry: ogr.Layer, object: ogr.Feature):
+        """
+        This function change local geometry and attributes table following cloud data
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        item : dict
+            item with info about cloud action this the feature
+
+        layer_geometry : ogr.Layer
+            the layer of the object
+
+        object : ogr.Feature
+            object that should be changed in the layer
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then it contains nothing else
+        """
+        start = time.perf_counter()
+        action = item['action']
+        fid = item['fid']
+        # changes may be applied again after a restart, so existing and missing features are handled
+        feature = layer_geometry.GetFeature(fid) if action != 'feature.create' else None
+        if (action == 'feature.create'):
+            out_feature = ogr.Feature(layer_geometry.GetLayerDefn())
+            out_feature.SetGeometry(object)
+            out_feature.SetFID(fid)
+
+            for field_id, value in item.get('fields', []):
+                out_feature.SetField(self.layer_fields[layer_id][field_id], value)
+            
+            if (layer_geometry.GetFeature(fid) is None):
+                layer_geometry.CreateFeature(out_feature)
+            else:
+                layer_geometry.SetFeature(out_feature)
+            out_feature = None
+        elif (action == 'feature.delete'):
+            if (feature is not None):
+                layer_geometry.DeleteFeature(fid)
+        elif (action == 'feature.update'):
+            feature_exists = feature is not None
+            if (not feature_exists):
+                feature = ogr.Feature(layer_geometry.GetLayerDefn())
+                feature.SetFID(fid)
+            feature.SetGeometry(object)
+            
+            for field_id, value in item.get('fields', []):
+                feature.SetField(self.layer_fields[layer_id][field_id], value)
+            if (feature_exists):
+                layer_geometry.SetFeature(feature)
+            else:
+                layer_geometry.CreateFeature(feature)
+        else:
+            return self.__handle_error(f"Wrong action: {action} - for the object with fid {fid}")
+
+        self.buffer_cache.invalidate(layer_id, fid)
+        self.prepared_cache.invalidate(layer_id, fid)
+        if (action == 'feature.delete'):
+            self.feature_versions.pop((layer_id, fid), None)
+        else:
+            self.feature_versions[(layer_id, fid)] = item.get('vid', 0)
+
+        if (layer_id in self.spatial_indexes):
+            if (action == 'feature.delete' or object is None):
+                self.spatial_indexes[layer_id].delete(fid)
+            else:
+                self.spatial_indexes[layer_id].set(fid, self.__to_metric(layer_id, shapely.from_wkb(bytes(object.ExportToWkb()))))
+        self.apply_seconds += time.perf_counter()-start
+        return {'status':'ok'}
+
+    
+    
+    def __get_difference_between_versions(self, layer_id: int, previous_version: int, latest_version: int, epoch: int) -> dict:
+        """
+        This function gets and writes in the console info about difference between the last saved and uploaded version to the cloud
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        previous_version : int
+            the last local stored version of the layer
+
+        latest_version : int
+            the last uploaded version of the layer to the cloud
+
+        epoch : int
+            current epoch of the layer
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then dif_list key contains the iterator over updated features sorted by time and count key contains their number
+        """
+        req = f'{self.ngw_host}/api/resource/{layer_id}/feature/changes/check?epoch={epoch}&initial={previous_version}&target={latest_version}&geom_format=geojson'
+        difference_versions_info = self.http.get(req, auth = (self.ngw_login, self.ngw_password))
+        
+        if (difference_versions_info.status_code == 200):
+            fetch = difference_versions_info.json()['fetch']
+            if __debug__:
+                print(f'Request link for layer with id {layer_id} between versions {previous_version} and {latest_version}: {req}')
+                print(f'Link for more information: {fetch}')
+            try:
+                start, metadata_seconds = time.perf_counter(), self.__get_stage_seconds('version_metadata')
+                # the feed is parsed as a stream, sorted in chunks and merged lazily, so its size does not limit memory
+                count, sorted_by_time = merge_sorted(
+                    self.__iter_changes_with_time(layer_id, epoch, fetch),
+                    self.__get_time,
+                    self.changes_chunk_size,
+                    os.path.join(self.tmp_files_path, 'changes')
+                )
+                # requests of version metadata made while the feed is read are measured as a separate stage
+                metadata_seconds = self.__get_stage_seconds('version_metadata')-metadata_seconds
+                self.metrics.observe('stage_duration_seconds', time.perf_counter()-start-metadata_seconds, stage='diff_fetch')
+                if __debug__:
+                    print(f"Changes of the layer with id {layer_id} were received and sorted by timestamps: {count}\n")
+                return {'status':'ok', 'dif_list':sorted_by_time, 'count':count}
+            except (OSError, ValueError) as e:
+                message = f"Error when getting details about changes for the layer {layer_id} between versions {previous_version} and {latest_version} for epoch {epoch}: {e}"
+        else: message = f"Error when getting the list of features for the layer {layer_id} between versions {previous_version} and {latest_version} for epoch {epoch}"
+        return self.__handle_error(message)
+
+    def __iter_changes(self, layer_id: int, fetch_url: str):
+        """
+        This function yields changes of the feed parsed from the stream, continue items are followed to the next pages of the feed.
+        OSError or ValueError is raised if a page can not be received or parsed.
+        """
+        url = fetch_url
+        while (url is not None):
+            response = self.http.get(url, auth = (self.ngw_login, self.ngw_password), stream = True)
+            if (response.status_code != 200):
+                response.close()
+                raise ValueError(f"the server returned {response.status_code} for {url}")
+
+            url = None
+            with response:
+                for item in iter_json_array(response.iter_content(chunk_size=self.download_chunk_size)):
+                    if ("vid" in item):
+                        yield item
+                    elif (item.get('action') == 'continue'):
+                        url = item.get('url')
+
+    def __iter_changes_with_time(self, layer_id: int, epoch: int, fetch_url: str):
+        """
+        This function yields changes of the feed with layer_id and time of their versions.
+        Metadata of versions is requested for every chunk of changes, only versions which contain changes are requested.
+        """
+        for chunk in self.__iter_chunks(self.__iter_changes(layer_id, fetch_url), self.changes_chunk_size):
+            versions = sorted({item['vid'] for item in chunk})
+            with self.metrics.time('stage_duration_seconds', stage='version_metadata'):
+                requests_for_versions = self.__get_versions_information(layer_id, epoch, versions)
+            if (requests_for_versions['status'] != 'ok'):
+                raise ValueError(requests_for_versions['message'])
+
+            time_for_versions = {}
+            for version in versions:
+                version_info = self.version_cache.get(layer_id, epoch, version)
+                if (version_info is not None and 'tstamp' in version_info):
+                    time_for_versions[version] = version_info['tstamp']
+
+            for item in chunk:
+                item['layer_id'] = layer_id
+                if (item['vid'] in time_for_versions):
+                    item['time'] = time_for_versions[item['vid']]
+                yield item
+
+    def __get_versions_information(self, layer_id: int, epoch: int, versions: list) -> dict:
+        """
+        This function returns the list of dicts, which contain information about the specified versions.
+        Versions are taken from the version cache, only the missing ones are requested from the server and added to the cache.
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        epoch : int
+            current epoch of the layer
+
+        versions : list
+            sorted list of needed versions
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then versions_information key contains a list with info about layer, including needed time
+        """
+        missing_versions = self.version_cache.get_missing(layer_id, epoch, versions)
+        self.metrics.inc('cache_hits_total', len(versions)-len(missing_versions), cache='versions')
+        self.metrics.inc('cache_misses_total', len(missing_versions), cache='versions')
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrent_requests, len(missing_versions)) or 1) as executor:
+            # map keeps the order of versions
+            results = executor.map(lambda version: self.__get_version_information(layer_id, version), missing_versions)
+
+            fetched_versions_information = []
+            for version, current_version_info in zip(missing_versions, results):
+                if (current_version_info is not None):
+                    fetched_versions_information.append(current_version_info)
+                elif __debug__:
+                        print(f"Error while getting feature of version {version} for the layer with id {layer_id}\n")
+
+        if (fetched_versions_information):
+            try:
+                self.version_cache.update(layer_id, epoch, fetched_versions_information)
+            except OSError as e:
+                if __debug__:
+                    print(f"Error when saving the version cache for the layer with id {layer_id}: {e}\n")
+
+        versions_information = [
+            version_info
+            for version_info in (self.version_cache.get(layer_id, epoch, version) for version in versions)
+            if version_info is not None
+        ]
+        if (versions and versions_information == []): return self.__handle_error("Error during receiving versions data")
+        else: return {'status':'ok', 'versions_information':versions_information}
+
+    def __get_version_information(self, layer_id: int, version: int) -> dict:
+        """
+        This function returns the dict with information about the version of the layer or None if the request failed.
+        """
+        req = f'{self.ngw_host}/api/resource/{layer_id}/feature/version/{version}'
+        try:
+            current_version_info = self.http.get(req, auth = (self.ngw_login, self.ngw_password))
+        except OSError:
+            # connection errors and timeouts of requests left after all retries
+            return None
+        if (current_version_info.status_code == 200):
+            return current_version_info.json()
+        return None
+
+    def __get_last_saved_version_and_epoch_by_id(self, layer_id: int) -> dict:
+        """
+        This function returns last local saved version and epoch of the layer.
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        Returns
+        -------
+        dict
+            status key contains error or ok, if error then message key contains explanations, if ok then version key contains the last saved version and epoch key contains the last saved epoch of current layer
+        """
+        layer = self.state_store.get(layer_id)
+        if (layer is not None):
+            return {'status':'ok', 'version':layer['version'], 'epoch':layer['epoch']}
+        return self.__handle_error(f'Error when finding local info for the layer with id: {layer_id}')
+
+    def __handle_error(self, message: str) -> dict:
+        """
+        This function returns a dict with status code and message with more information about error.
+
+
+        Parameters
+        ---------
+        message : str
+            info about error
+
+        Returns
+        -------
+        dict
+            status key contains error and message key contains explanations
+        """
+        if __debug__:
+            print(message, '\n')
+        return {'status':'error', 'message':message}
+
+    def __get_timestamp(self, item: dict) -> float:
+        """
+        This function returns the time of the change in seconds since the epoch, the current time if the change has no time.
+        """
+        if 'time' in item:
+            change_time = datetime.fromisoformat(item['time'])
+            # NGW returns timestamps in UTC without time zone
+            if (change_time.tzinfo is None): change_time = change_time.replace(tzinfo=timezone.utc)
+            return change_time.timestamp()
+        return time.time()
+
+    def __get_time(self, item):
+        if 'time' in item:
+            return datetime.fromisoformat(item['time'])
+        else: return datetime.min
+
+def main(config_path):
+    new_lph = NGWGeofencer(config_path)
     new_lph.run_script()
 
+def replay(config_path, feed_path, events_path):
+    new_lph = NGWGeofencer(config_path)
+    return new_lph.replay(feed_path, events_path)
+
 if __name__ == '__main__':
     try:
         import argparse
         parser = argparse.ArgumentParser(description='Checking the configuration file')
         parser.add_argument('--config_file', metavar='path', required=True,
                         help='the path to config file')
+        parser.add_argument('--replay', metavar='path',
+                        help='the path to recorded changes in JSONL format, they are checked without the server')
+        parser.add_argument('--events', metavar='path', default='events.jsonl',
+                        help='the path to the file for events of replay')
         args = parser.parse_args()
-        main(args.config_file)
+        if (args.replay):
+            result = replay(args.config_file, args.replay, args.events)
+            if (result['status'] == 'ok'):
+                print(f"Replay: {result['changes']} changes, {result['events']} events written to {args.events} "
+                      f"in {result['seconds']:.2f} s ({result['events']/max(result['seconds'], 1e-6):.1f} events/s)")
+            else:
+                print(f"Replay failed: {result['message']}")
+        else:
+            main(args.config_file)
     except ErrorConnection as e:
         print(e)
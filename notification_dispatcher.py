@@ -0,0 +1,221 @@
+import queue
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the rate of messages to one chat.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        This function takes one token and returns 0 or returns the time in seconds to wait until a token is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens+(now-self.updated)*self.rate)
+        self.updated = now
+        if (self.tokens >= 1):
+            self.tokens -= 1
+            return 0
+        return (1-self.tokens)/self.rate
+
+
+class NotificationDispatcher:
+    """
+    Background dispatcher of notifications.
+
+    Messages are put to a bounded queue and sent by worker threads, so the caller never waits for delivery.
+    Sending is limited by a token bucket per chat and failed messages are retried with exponential backoff.
+    Optionally all messages of one poll cycle are coalesced into as few messages per chat as possible.
+    """
+
+    def __init__(self, send_function, workers: int = 1, queue_size: int = 10000, rate: float = 1.0, burst: int = 3,
+                 retries: int = 3, backoff: float = 1.0, coalesce: bool = False, max_message_length: int = 4096):
+        """
+        Parameters
+        ---------
+        send_function : callable
+            function with chat id and message text as arguments which returns True if the message was delivered
+
+        workers : int
+            number of sending threads
+
+        queue_size : int
+            maximum number of messages waiting for delivery, new messages are dropped when the queue is full
+
+        rate : float
+            maximum number of messages per second to one chat
+
+        burst : int
+            number of messages which can be sent to one chat at once
+
+        retries : int
+            number of retries of a failed message
+
+        backoff : float
+            delay in seconds before the first retry, it is doubled for every next one
+
+        coalesce : bool
+            if true, messages are collected until flush_cycle and joined per chat
+
+        max_message_length : int
+            maximum length of a coalesced message
+        """
+        self.send_function = send_function
+        self.workers = workers
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.coalesce = coalesce
+        self.max_message_length = max_message_length
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__buckets = {}
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__threads = []
+
+    def start(self) -> None:
+        """
+        This function starts worker threads.
+        """
+        self.__stop_event.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.__work, name=f'notification-dispatcher-{i}', daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def stop(self, timeout: float = 10) -> None:
+        """
+        This function sends collected messages, waits up to timeout seconds until the queue is empty and stops worker threads.
+        """
+        self.flush_cycle()
+        deadline = time.monotonic()+timeout
+        while (self.__queue.unfinished_tasks and time.monotonic() < deadline):
+            time.sleep(0.1)
+        self.__stop_event.set()
+        for thread in self.__threads:
+            thread.join(max(0, deadline-time.monotonic()))
+        self.__threads = []
+
+    def put(self, chat_id: int, message: str) -> bool:
+        """
+        This function adds the message for delivery without waiting.
+
+
+        Parameters
+        ---------
+        chat_id : int
+            unique ID of the chat
+
+        message : str
+            the text of the message
+
+        Returns
+        -------
+        bool
+            False if the message was dropped because the queue is full
+        """
+        if (self.coalesce):
+            with self.__lock:
+                self.__pending.setdefault(chat_id, []).append(message)
+            return True
+        return self.__enqueue(chat_id, message)
+
+    def flush_cycle(self) -> None:
+        """
+        This function joins messages collected during the poll cycle into as few messages per chat as possible and adds them for delivery.
+        """
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+
+        for chat_id, messages in pending.items():
+            text = ''
+            for message in messages:
+                if (text and len(text)+len(message)+1 > self.max_message_length):
+                    self.__enqueue(chat_id, text)
+                    text = ''
+                text = f'{text}\n{message}' if text else message
+            if (text):
+                self.__enqueue(chat_id, text)
+
+    def stats(self) -> dict:
+        """
+        This function returns a dict with queue depth, numbers of sent, failed, dropped and retried messages and average and maximum delivery latency in seconds.
+        """
+        with self.__lock:
+            return {
+                'queue_depth': self.__queue.qsize(),
+                'sent': self.sent,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'retried': self.retried,
+                'avg_latency': self.total_latency/self.sent if self.sent else 0.0,
+                'max_latency': self.max_latency
+            }
+
+    def __enqueue(self, chat_id: int, message: str) -> bool:
+        try:
+            self.__queue.put_nowait((chat_id, message, time.monotonic()))
+            return True
+        except queue.Full:
+            with self.__lock:
+                self.dropped += 1
+            return False
+
+    def __wait_for_token(self, chat_id: int) -> None:
+        while (not self.__stop_event.is_set()):
+            with self.__lock:
+                bucket = self.__buckets.setdefault(chat_id, TokenBucket(self.rate, self.burst))
+                wait_time = bucket.take()
+            if (wait_time == 0):
+                return
+            self.__stop_event.wait(wait_time)
+
+    def __work(self) -> None:
+        while (not self.__stop_event.is_set()):
+            try:
+                chat_id, message, enqueued = self.__queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            try:
+                delivered = False
+                for attempt in range(self.retries+1):
+                    self.__wait_for_token(chat_id)
+                    try:
+                        delivered = self.send_function(chat_id, message)
+                    except Exception:
+                        delivered = False
+                    if (delivered or attempt == self.retries or self.__stop_event.is_set()):
+                        break
+                    with self.__lock:
+                        self.retried += 1
+                    self.__stop_event.wait(self.backoff*2**attempt)
+
+                latency = time.monotonic()-enqueued
+                with self.__lock:
+                    if (delivered):
+                        self.sent += 1
+                        self.total_latency += latency
+                        self.max_latency = max(self.max_latency, latency)
+                    else:
+                        self.failed += 1
+            finally:
+                self.__queue.task_done()
@@ -0,0 +1,176 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import signal
+import threading
+import time
+from datetime import datetime
+
+
+class CycleProfiler:
+    """
+    On-demand profiler of poll cycles.
+
+    Profiling of the next cycles is requested by SIGUSR1, by the flag file or by the configuration.
+    A profiled cycle runs under cProfile and collects a trace of geometry checks, both are written
+    to the output directory when the cycle ends. If slow_cycle_sec is set, every cycle is profiled
+    and kept only if it was slower than the threshold, so this mode costs the cProfile overhead all the time.
+    When nothing is requested the cost of a cycle is one check of the flag file.
+    """
+
+    # the flag file in the working directory requests profiling, it may contain the number of cycles
+    FLAG_FILE_NAME = 'profile'
+
+    # number of the slowest functions written to the text report
+    REPORT_LINES = 50
+
+    def __init__(self, tmp_files_path: str, cycles: int = 0, cycles_per_trigger: int = 1, slow_cycle_sec: float = None):
+        """
+        Parameters
+        ---------
+        tmp_files_path : str
+            working directory, the flag file is looked for in it and profiles are written to its profiles subdirectory
+
+        cycles : int
+            number of the first cycles to profile
+
+        cycles_per_trigger : int
+            number of cycles profiled after the signal or the flag file without the number
+
+        slow_cycle_sec : float
+            if set, every cycle is profiled and kept if it takes longer than this number of seconds
+        """
+        self.flag_file_name_and_path = os.path.join(tmp_files_path, self.FLAG_FILE_NAME)
+        self.output_path = os.path.join(tmp_files_path, 'profiles')
+        self.cycles_per_trigger = cycles_per_trigger
+        self.slow_cycle_sec = slow_cycle_sec
+
+        # trace of geometry checks of the profiled cycle, None while the cycle is not profiled
+        self.trace = None
+
+        self.__requested = cycles
+        self.__profile = None
+        self.__requested_cycle = False
+        self.__start = 0.0
+        self.__cycle = 0
+        self.__lock = threading.Lock()
+
+    def request(self, cycles: int) -> None:
+        """
+        This function requests profiling of the next cycles, it may be called from a signal handler or another thread.
+        """
+        with self.__lock:
+            self.__requested += cycles
+
+    def install_signal_handler(self) -> None:
+        """
+        This function requests profiling on SIGUSR1, it works only in the main thread and on systems with SIGUSR1.
+        """
+        signum = getattr(signal, 'SIGUSR1', None)
+        if (signum is None):
+            return
+
+        def handler(signum, frame):
+            if __debug__:
+                print(f"Signal {signum} received, profiling {self.cycles_per_trigger} next cycles\n")
+            self.request(self.cycles_per_trigger)
+
+        try:
+            signal.signal(signum, handler)
+        except ValueError:
+            pass
+
+    def start_cycle(self) -> None:
+        """
+        This function starts profiling of the cycle if it was requested or slow cycles are profiled.
+        """
+        self.__cycle += 1
+        self.__check_flag_file()
+        with self.__lock:
+            self.__requested_cycle = self.__requested > 0
+            if (self.__requested_cycle):
+                self.__requested -= 1
+
+        self.__start = time.perf_counter()
+        if (self.__requested_cycle or self.slow_cycle_sec is not None):
+            self.trace = []
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+
+    def end_cycle(self, status: dict = None) -> str:
+        """
+        This function stops profiling of the cycle and writes the profile if the cycle was requested or slow.
+
+
+        Parameters
+        ---------
+        status : dict
+            the result of the cycle, it is written to the report
+
+        Returns
+        -------
+        str
+            path to the written profile without extension or None if nothing was written
+        """
+        if (self.__profile is None):
+            return None
+        self.__profile.disable()
+        cycle_time = time.perf_counter()-self.__start
+        profile, trace = self.__profile, self.trace
+        self.__profile, self.trace = None, None
+
+        if (not self.__requested_cycle and cycle_time < self.slow_cycle_sec):
+            return None
+
+        reason = 'requested' if self.__requested_cycle else f'slower than {self.slow_cycle_sec} s'
+        try:
+            return self.__write(profile, trace, cycle_time, reason, status)
+        except OSError as e:
+            if __debug__:
+                print(f"Error when writing the profile of the cycle: {e}\n")
+            return None
+
+    def __check_flag_file(self) -> None:
+        if (not os.path.exists(self.flag_file_name_and_path)):
+            return
+        cycles = self.cycles_per_trigger
+        try:
+            with open(self.flag_file_name_and_path, 'r', encoding='utf-8') as flag_file:
+                content = flag_file.read().strip()
+            if (content):
+                cycles = int(content)
+            os.remove(self.flag_file_name_and_path)
+        except (OSError, ValueError) as e:
+            if __debug__:
+                print(f"Error when reading the profiling flag file {self.flag_file_name_and_path}: {e}\n")
+            try:
+                os.remove(self.flag_file_name_and_path)
+            except OSError:
+                return
+        self.request(cycles)
+
+    def __write(self, profile: cProfile.Profile, trace: list, cycle_time: float, reason: str, status: dict) -> str:
+        if (not os.path.isdir(self.output_path)): os.makedirs(self.output_path)
+        base_name_and_path = os.path.join(self.output_path, f'cycle_{datetime.now().strftime("%Y%m%d_%H%M%S")}_{self.__cycle}')
+
+        profile.dump_stats(f'{base_name_and_path}.pstats')
+
+        report = io.StringIO()
+        report.write(f'Cycle {self.__cycle}: {cycle_time:.3f} s, profiled because it was {reason}\n')
+        if (status is not None):
+            report.write(f'Result: {json.dumps(status, ensure_ascii=False, default=str)}\n')
+        report.write('\n')
+        pstats.Stats(profile, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.REPORT_LINES)
+        with open(f'{base_name_and_path}.txt', 'w', encoding='utf-8') as report_file:
+            report_file.write(report.getvalue())
+
+        with open(f'{base_name_and_path}_trace.jsonl', 'w', encoding='utf-8') as trace_file:
+            for record in trace:
+                trace_file.write(json.dumps(record, ensure_ascii=False))
+                trace_file.write('\n')
+
+        if __debug__:
+            print(f"Profile of the cycle {self.__cycle} ({cycle_time:.3f} s) was written to {base_name_and_path}.*\n")
+        return base_name_and_path
@@ -0,0 +1,101 @@
+import numpy as np
+import shapely
+from osgeo import ogr, osr
+
+
+class MetricReprojector:
+    """
+    Reprojection of layer geometries into one metric CRS, so buffers and distances are measured in metres.
+
+    One pair of coordinate transformations (to the metric CRS and back) is built for every layer when its
+    spatial reference becomes known and is reused for all geometries of the layer. Layers without spatial
+    reference or already in the metric CRS are not transformed.
+    """
+
+    def __init__(self, metric_crs: str):
+        """
+        Parameters
+        ---------
+        metric_crs : str
+            the metric CRS in any form accepted by osr.SpatialReference.SetFromUserInput, for example EPSG:32637, ValueError is raised if it is not recognized
+        """
+        self.metric_srs = osr.SpatialReference()
+        try:
+            error = self.metric_srs.SetFromUserInput(metric_crs)
+        except RuntimeError as e:
+            raise ValueError(f'Wrong metric CRS {metric_crs}: {e}')
+        if (error != 0):
+            raise ValueError(f'Wrong metric CRS {metric_crs}')
+        self.metric_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        self.__transformations = {}
+
+    def __contains__(self, layer_id: int) -> bool:
+        return layer_id in self.__transformations
+
+    def add_layer(self, layer_id: int, spatial_ref: osr.SpatialReference) -> None:
+        """
+        This function builds transformations of the layer if they were not built yet.
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        spatial_ref : osr.SpatialReference
+            spatial reference of the layer, None if the layer has no spatial reference
+        """
+        if (layer_id in self.__transformations):
+            return
+        if (spatial_ref is None or spatial_ref.IsSame(self.metric_srs)):
+            self.__transformations[layer_id] = None
+            return
+
+        layer_srs = spatial_ref.Clone()
+        layer_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        self.__transformations[layer_id] = (
+            osr.CoordinateTransformation(layer_srs, self.metric_srs),
+            osr.CoordinateTransformation(self.metric_srs, layer_srs)
+        )
+
+    def to_metric(self, layer_id: int, geometries):
+        """
+        This function returns shapely geometries of the layer transformed into the metric CRS, all coordinates are transformed by one call.
+        """
+        transformations = self.__transformations.get(layer_id)
+        if (transformations is None):
+            return geometries
+        to_metric = transformations[0]
+
+        def transform(coordinates: np.ndarray) -> np.ndarray:
+            if (len(coordinates) == 0):
+                return coordinates
+            return np.asarray(to_metric.TransformPoints(coordinates.tolist()), dtype=np.float64)[:, :2]
+
+        return shapely.transform(geometries, transform)
+
+    def to_metric_ogr(self, layer_id: int, geometry: ogr.Geometry) -> ogr.Geometry:
+        """
+        This function returns a copy of the OGR geometry of the layer transformed into the metric CRS.
+        """
+        transformations = self.__transformations.get(layer_id)
+        if (transformations is None or geometry is None):
+            return geometry
+        metric_geometry = geometry.Clone()
+        metric_geometry.Transform(transformations[0])
+        return metric_geometry
+
+    def envelope_to_layer(self, layer_id: int, min_x: float, max_x: float, min_y: float, max_y: float) -> tuple:
+        """
+        This function returns the envelope (min_x, max_x, min_y, max_y) in the CRS of the layer which covers the given envelope in the metric CRS.
+        """
+        transformations = self.__transformations.get(layer_id)
+        if (transformations is None):
+            return min_x, max_x, min_y, max_y
+
+        rectangle = ogr.CreateGeometryFromWkt(f'POLYGON (({min_x} {min_y}, {max_x} {min_y}, {max_x} {max_y}, {min_x} {max_y}, {min_x} {min_y}))')
+        # edges are densified, so the curved edges of the transformed rectangle stay inside its envelope
+        rectangle.Segmentize(max(max_x-min_x, max_y-min_y)/16 or 1)
+        rectangle.Transform(transformations[1])
+        return rectangle.GetEnvelope()
@@ -0,0 +1,127 @@
+import random
+import signal
+import threading
+import time
+
+
+class PollScheduler:
+    """
+    Scheduler of poll cycles with an adaptive interval.
+
+    Cycles run one after another in the calling thread, so they never overlap. The interval is counted
+    from the start of the cycle. It drops to the minimum while changes are found, grows up to the maximum
+    while layers are idle and grows faster after errors. Every interval is randomized with jitter.
+    """
+
+    def __init__(self, cycle_function, interval: float, min_interval: float = None, max_interval: float = None,
+                 idle_factor: float = 1.5, error_factor: float = 2.0, jitter: float = 0.1):
+        """
+        Parameters
+        ---------
+        cycle_function : callable
+            function without arguments running one cycle, it returns a dict with status key and optionally changed and complete keys
+
+        interval : float
+            base interval in seconds between starts of cycles
+
+        min_interval : float
+            interval in seconds while changes are found, a half of the base interval if not set
+
+        max_interval : float
+            maximum interval in seconds while layers are idle or errors happen, six base intervals if not set
+
+        idle_factor : float
+            the interval is multiplied by this factor after every cycle without changes
+
+        error_factor : float
+            the interval is multiplied by this factor after every failed cycle
+
+        jitter : float
+            relative random deviation of the interval
+        """
+        self.cycle_function = cycle_function
+        self.base_interval = interval
+        self.min_interval = interval/2 if min_interval is None else min_interval
+        self.max_interval = interval*6 if max_interval is None else max_interval
+        self.idle_factor = idle_factor
+        self.error_factor = error_factor
+        self.jitter = jitter
+
+        self.interval = interval
+        self.cycles = 0
+        self.errors = 0
+        self.last_cycle_time = 0.0
+
+        self.__stop_event = threading.Event()
+
+    def run(self) -> None:
+        """
+        This function runs cycles until stop is called.
+        """
+        self.__stop_event.clear()
+        while (not self.__stop_event.is_set()):
+            start = time.monotonic()
+            try:
+                result = self.cycle_function()
+            except Exception as e:
+                if __debug__:
+                    print(f"Unexpected error in the poll cycle: {e}\n")
+                result = {'status':'error', 'message':str(e)}
+            self.last_cycle_time = time.monotonic()-start
+            self.cycles += 1
+
+            delay = self.next_delay(result)
+            if __debug__:
+                print(f"Poll cycle took {self.last_cycle_time:.2f} s, next one in {delay:.2f} s\n")
+            self.__stop_event.wait(delay)
+
+    def next_delay(self, result: dict) -> float:
+        """
+        This function adapts the interval to the result of the cycle and returns the time in seconds to wait before the next cycle.
+
+
+        Parameters
+        ---------
+        result : dict
+            the result of the cycle function
+
+        Returns
+        -------
+        float
+            seconds to wait, 0 if a catch-up is not complete
+        """
+        if (not isinstance(result, dict) or result.get('status') != 'ok'):
+            self.errors += 1
+            self.interval = min(self.max_interval, max(self.interval, self.base_interval)*self.error_factor)
+        elif (not result.get('complete', True)):
+            # the rest of the catch-up runs right away
+            self.interval = self.min_interval
+            return 0
+        elif (result.get('changed', False)):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, max(self.interval*self.idle_factor, self.min_interval))
+
+        interval = self.interval*random.uniform(1-self.jitter, 1+self.jitter)
+        return max(0, interval-self.last_cycle_time)
+
+    def stop(self) -> None:
+        """
+        This function asks the scheduler to stop, the current cycle is finished first.
+        """
+        self.__stop_event.set()
+
+    def install_signal_handlers(self) -> None:
+        """
+        This function stops the scheduler on SIGINT and SIGTERM, it works only in the main thread.
+        """
+        def handler(signum, frame):
+            if __debug__:
+                print(f"Signal {signum} received, stopping after the current cycle\n")
+            self.stop()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                signal.signal(signum, handler)
+            except ValueError:
+                pass
@@ -0,0 +1,198 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+
+class LayerSpatialIndex:
+    """
+    In-memory spatial index of one layer built on the shapely STRtree.
+
+    STRtree can not be changed after it is built, so features created, updated or deleted
+    after the build are kept in a small overlay (with its own tree) and the main tree is
+    rebuilt only when the overlay grows too big.
+    """
+
+    def __init__(self, rebuild_ratio: float = 0.1, min_rebuild_size: int = 1000):
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild_size = min_rebuild_size
+
+        self.__geometries = {}
+        self.__tree = None
+        self.__tree_fids = np.empty(0, dtype=np.int64)
+        self.__stale_fids = set()
+        self.__overlay_tree = None
+        self.__overlay_fids = np.empty(0, dtype=np.int64)
+        self.__overlay = {}
+
+    def __len__(self) -> int:
+        return len(self.__geometries)
+
+    def __contains__(self, fid: int) -> bool:
+        return fid in self.__geometries
+
+    def load(self, fids, geometries) -> None:
+        """
+        This function replaces the content of the index and builds the tree.
+
+
+        Parameters
+        ---------
+        fids : array-like
+            feature ids of the layer
+
+        geometries : array-like
+            shapely geometries in the same order as fids, None values are skipped
+        """
+        self.__geometries = {
+            int(fid): geometry
+            for fid, geometry in zip(fids, geometries)
+            if geometry is not None
+        }
+        self.__rebuild()
+
+    def get(self, fid: int):
+        """
+        This function returns the current shapely geometry of the feature or None.
+        """
+        return self.__geometries.get(fid)
+
+    def get_many(self, fids) -> np.ndarray:
+        """
+        This function returns a numpy array with current shapely geometries of the features, None for unknown fids.
+        """
+        geometries = np.empty(len(fids), dtype=object)
+        geometries[:] = [self.__geometries.get(fid) for fid in np.asarray(fids).tolist()]
+        return geometries
+
+    def set(self, fid: int, geometry) -> None:
+        """
+        This function adds or replaces the geometry of the feature.
+        """
+        if (geometry is None):
+            self.delete(fid)
+            return
+        self.__geometries[fid] = geometry
+        self.__stale_fids.add(fid)
+        self.__overlay[fid] = geometry
+        self.__overlay_tree = None
+
+    def delete(self, fid: int) -> None:
+        """
+        This function removes the feature from the index.
+        """
+        self.__geometries.pop(fid, None)
+        self.__stale_fids.add(fid)
+        if (self.__overlay.pop(fid, None) is not None):
+            self.__overlay_tree = None
+
+    def query(self, geometries, predicate: str = None, distance: float = 0) -> tuple:
+        """
+        This function finds the features for all given geometries in one bulk query.
+        Without predicate the features whose bounding boxes intersect the bounding boxes of the geometries
+        expanded by the distance are returned, otherwise the features satisfying the predicate.
+
+
+        Parameters
+        ---------
+        geometries : array-like
+            shapely geometries to look for
+
+        predicate : str
+            shapely STRtree predicate, for example intersects or dwithin
+
+        distance : float
+            size of the expansion of bounding boxes or the distance for the dwithin predicate
+
+        Returns
+        -------
+        tuple
+            two numpy arrays of the same length: indexes of the input geometries and fids of the found features, sorted by input index and fid
+        """
+        geometries = np.asarray(geometries, dtype=object)
+        if (len(geometries) == 0 or len(self.__geometries) == 0):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int64)
+
+        if (len(self.__stale_fids) > max(self.min_rebuild_size, self.rebuild_ratio*len(self.__tree_fids))):
+            self.__rebuild()
+
+        if (predicate is None):
+            bounds = shapely.bounds(geometries)
+            geometries = shapely.box(bounds[:, 0]-distance, bounds[:, 1]-distance, bounds[:, 2]+distance, bounds[:, 3]+distance)
+            query_params = {}
+        elif (predicate == 'dwithin'):
+            query_params = {'predicate': predicate, 'distance': distance}
+        else:
+            query_params = {'predicate': predicate}
+
+        input_indexes, fids = [], []
+        if (self.__tree is not None):
+            tree_input, tree_result = self.__tree.query(geometries, **query_params)
+            tree_fids = self.__tree_fids[tree_result]
+            if (self.__stale_fids):
+                fresh = ~np.isin(tree_fids, np.fromiter(self.__stale_fids, dtype=np.int64))
+                tree_input, tree_fids = tree_input[fresh], tree_fids[fresh]
+            input_indexes.append(tree_input)
+            fids.append(tree_fids)
+
+        if (self.__overlay):
+            if (self.__overlay_tree is None):
+                self.__overlay_fids = np.fromiter(self.__overlay.keys(), dtype=np.int64, count=len(self.__overlay))
+                self.__overlay_tree = STRtree(list(self.__overlay.values()))
+            overlay_input, overlay_result = self.__overlay_tree.query(geometries, **query_params)
+            input_indexes.append(overlay_input)
+            fids.append(self.__overlay_fids[overlay_result])
+
+        if (not input_indexes):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int64)
+
+        input_indexes = np.concatenate(input_indexes)
+        fids = np.concatenate(fids)
+        order = np.lexsort((fids, input_indexes))
+        return input_indexes[order], fids[order]
+
+    def query_nearest(self, geometries, max_distance: float) -> tuple:
+        """
+        This function finds the nearest feature within the distance for all given geometries in one bulk query.
+        If the tree was not changed after the build, the STRtree nearest neighbour query is used, otherwise
+        the features within the distance are found by the dwithin predicate and the nearest of them is taken.
+
+
+        Parameters
+        ---------
+        geometries : array-like
+            shapely geometries to look for
+
+        max_distance : float
+            maximum distance to the nearest feature
+
+        Returns
+        -------
+        tuple
+            three numpy arrays of the same length: indexes of the input geometries, fids of the nearest features and distances to them, sorted by input index
+        """
+        geometries = np.asarray(geometries, dtype=object)
+        if (len(geometries) == 0 or len(self.__geometries) == 0):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        if (not self.__stale_fids):
+            (input_indexes, tree_result), distances = self.__tree.query_nearest(
+                geometries, max_distance=max_distance, return_distance=True, all_matches=False
+            )
+            fids = self.__tree_fids[tree_result]
+        else:
+            input_indexes, fids = self.query(geometries, predicate='dwithin', distance=max_distance)
+            distances = shapely.distance(geometries[input_indexes], self.get_many(fids))
+
+        # one nearest feature for every input geometry, the smallest fid wins for equal distances
+        order = np.lexsort((fids, distances, input_indexes))
+        input_indexes, fids, distances = input_indexes[order], fids[order], distances[order]
+        first = np.unique(input_indexes, return_index=True)[1]
+        return input_indexes[first], fids[first], distances[first]
+
+    def __rebuild(self) -> None:
+        self.__tree_fids = np.fromiter(self.__geometries.keys(), dtype=np.int64, count=len(self.__geometries))
+        self.__tree = STRtree(list(self.__geometries.values())) if self.__geometries else None
+        self.__stale_fids = set()
+        self.__overlay = {}
+        self.__overlay_tree = None
+        self.__overlay_fids = np.empty(0, dtype=np.int64)
@@ -0,0 +1,162 @@
+import json
+import os
+import sqlite3
+import time
+
+
+class StateStore:
+    """
+    Persistent state of the geofencer in a SQLite file in WAL mode.
+
+    The layer table keeps the last processed version, epoch and fields of every layer, it is cached in memory,
+    so reads do not touch the file. The history table keeps every processed range of versions for auditing and replay.
+    Updates are written in one transaction and the cache is changed only when the transaction is committed.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Parameters
+        ---------
+        db_path : str
+            path to the SQLite file, its directory is created if it does not exist
+        """
+        directory = os.path.dirname(db_path)
+        if (directory and not os.path.isdir(directory)): os.makedirs(directory)
+
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS layer ('
+            'layer_id INTEGER PRIMARY KEY, version INTEGER NOT NULL, epoch INTEGER, '
+            'fields_to_display TEXT, fields TEXT, updated REAL NOT NULL)'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS history ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, layer_id INTEGER NOT NULL, epoch INTEGER, '
+            'from_version INTEGER, to_version INTEGER NOT NULL, processed REAL NOT NULL)'
+        )
+
+        self.__layers = {}
+        self.__pending = {}
+        for layer_id, version, epoch, fields_to_display, fields in self.connection.execute(
+            'SELECT layer_id, version, epoch, fields_to_display, fields FROM layer'
+        ):
+            self.__layers[layer_id] = self.__make_layer(layer_id, version, epoch, fields_to_display, fields)
+
+    def __len__(self) -> int:
+        return len(self.__layers)
+
+    def get(self, layer_id: int) -> dict:
+        """
+        This function returns a dict with id, version, epoch, fields_to_display and fields of the layer from the memory cache or None.
+        """
+        return self.__layers.get(layer_id)
+
+    def begin(self) -> None:
+        if (not self.connection.in_transaction):
+            self.connection.execute('BEGIN IMMEDIATE')
+
+    def commit(self) -> None:
+        if (self.connection.in_transaction):
+            self.connection.execute('COMMIT')
+        self.__layers.update(self.__pending)
+        self.__pending = {}
+
+    def rollback(self) -> None:
+        if (self.connection.in_transaction):
+            self.connection.execute('ROLLBACK')
+        self.__pending = {}
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def set_layer(self, layer_id: int, version: int, epoch: int, fields_to_display: dict = None, fields: dict = None, from_version: int = None) -> None:
+        """
+        This function writes the state of the layer in the current transaction and adds the processed range of versions to the history.
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        version : int
+            the last processed version
+
+        epoch : int
+            epoch of the layer
+
+        fields_to_display : dict
+            keynames of fields to display by their ids
+
+        fields : dict
+            keynames of all fields by their ids
+
+        from_version : int
+            the version the processing started from, None if the layer was exported
+        """
+        fields_to_display_json = json.dumps(fields_to_display or {}, ensure_ascii=False)
+        fields_json = json.dumps(fields or {}, ensure_ascii=False)
+        now = time.time()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO layer (layer_id, version, epoch, fields_to_display, fields, updated) VALUES (?, ?, ?, ?, ?, ?)',
+            (layer_id, version, epoch, fields_to_display_json, fields_json, now)
+        )
+        previous = self.__pending.get(layer_id) or self.__layers.get(layer_id)
+        if (previous is None or previous['version'] != version or previous['epoch'] != epoch):
+            self.connection.execute(
+                'INSERT INTO history (layer_id, epoch, from_version, to_version, processed) VALUES (?, ?, ?, ?, ?)',
+                (layer_id, epoch, from_version, version, now)
+            )
+        self.__pending[layer_id] = self.__make_layer(layer_id, version, epoch, fields_to_display_json, fields_json)
+
+    def get_history(self, layer_id: int, limit: int = 100) -> list:
+        """
+        This function returns the last processed ranges of versions of the layer as tuples (epoch, from_version, to_version, processed), the newest first.
+        """
+        return self.connection.execute(
+            'SELECT epoch, from_version, to_version, processed FROM history WHERE layer_id=? ORDER BY id DESC LIMIT ?',
+            (layer_id, limit)
+        ).fetchall()
+
+    def import_data_file(self, file_name_and_path: str) -> bool:
+        """
+        This function fills the empty store from data.json of previous versions of the program.
+
+
+        Parameters
+        ---------
+        file_name_and_path : str
+            path to data.json
+
+        Returns
+        -------
+        bool
+            True if layers were imported
+        """
+        if (self.__layers or not os.path.isfile(file_name_and_path)):
+            return False
+        try:
+            with open(file_name_and_path, 'r', encoding='utf-8') as data_file:
+                data = json.load(data_file)
+            self.begin()
+            for layer in data.values():
+                self.set_layer(layer['id'], layer['version'], layer['epoch'], layer.get('fields_to_display'))
+            self.commit()
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self.rollback()
+            return False
+        return True
+
+    @staticmethod
+    def __make_layer(layer_id: int, version: int, epoch: int, fields_to_display: str, fields: str) -> dict:
+        # keys of JSON objects are strings
+        return {
+            'id': layer_id,
+            'version': version,
+            'epoch': epoch,
+            'fields_to_display': {int(field_id): keyname for field_id, keyname in json.loads(fields_to_display or '{}').items()},
+            'fields': {int(field_id): keyname for field_id, keyname in json.loads(fields or '{}').items()}
+        }
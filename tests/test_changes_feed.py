@@ -0,0 +1,65 @@
+import json
+import tempfile
+import unittest
+from changes_feed import iter_json_array, merge_sorted
+
+
+def split(document: str, size: int):
+    data = document.encode('utf-8')
+    return [data[start:start+size] for start in range(0, len(data), size)]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    ELEMENTS = [
+        1, 1.5, -20, 3e-7, 12.5e10, 0, True, False, None, 'строка', '', 'a,]b',
+        {'action': 'feature.update', 'fid': 7, 'fields': [[1, 'x']]}, [], [1, [2.25, None]]
+    ]
+
+    def test_chunk_boundaries(self):
+        for separator in (',', ', ', ' ,\n'):
+            document = '[ '+separator.join(json.dumps(element, ensure_ascii=False) for element in self.ELEMENTS)+' ]'
+            for size in range(1, 8):
+                with self.subTest(separator=separator, size=size):
+                    self.assertEqual(list(iter_json_array(split(document, size))), self.ELEMENTS)
+
+    def test_scalars_split_across_chunks(self):
+        for document, expected in (('[1.5]', [1.5]), ('[10,2e5]', [10, 2e5]), ('[true,null]', [True, None]), ('[-0.25 ]', [-0.25])):
+            with self.subTest(document=document):
+                self.assertEqual(list(iter_json_array(split(document, 1))), expected)
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array([b' [', b' ] '])), [])
+
+    def test_truncated_feed(self):
+        for document in ('[1, 2', '[1.5', '[{"fid": 1}', '['):
+            with self.subTest(document=document):
+                with self.assertRaises(ValueError):
+                    list(iter_json_array(split(document, 1)))
+
+    def test_not_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"message": "error"}']))
+
+
+class MergeSortedTest(unittest.TestCase):
+
+    def test_single_run(self):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            count, items = merge_sorted([3, 1, 2], key=lambda item: item, chunk_size=10, tmp_path=tmp_path)
+            self.assertEqual(count, 3)
+            self.assertEqual(list(items), [1, 2, 3])
+
+    def test_multiple_runs(self):
+        items = [{'fid': (index*7) % 11, 'order': index} for index in range(50)]
+        with tempfile.TemporaryDirectory() as tmp_path:
+            for chunk_size in (1, 3, 7, 50):
+                with self.subTest(chunk_size=chunk_size):
+                    count, merged = merge_sorted(iter(items), key=lambda item: item['fid'], chunk_size=chunk_size, tmp_path=tmp_path)
+                    self.assertEqual(count, len(items))
+                    # the sort is stable, items with the same key keep their order
+                    self.assertEqual(list(merged), sorted(items, key=lambda item: item['fid']))
+
+
+if __name__ == '__main__':
+    unittest.main()
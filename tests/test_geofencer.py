@@ -0,0 +1,300 @@
+import base64
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import unittest
+import shapely
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+try:
+    from osgeo import ogr, osr
+    from ngw_geofencer import ErrorConnection, NGWGeofencer
+    from ngw_stub import StubLayer, StubNGWServer
+    from synthetic_layers import EPSG, feature_name
+except ImportError:
+    ogr = None
+
+TOP_LAYER_ID = 101
+BOTTOM_LAYER_ID = 102
+OTHER_TOP_LAYER_ID = 103
+INSIDE_TOP_LAYER_ID = 104
+ZONE = shapely.box(-10, -10, 10, 10)
+# the point is within 10 from the corner of the zone, but outside of the polygon approximating its buffer of 10
+NEAR_EDGE = shapely.Point(10+9.999*math.cos(math.radians(46.5)), 10+9.999*math.sin(math.radians(46.5)))
+
+
+def write_layer(file_name_and_path: str, ogr_type: int, geometries: list) -> None:
+    spatial_ref = osr.SpatialReference()
+    spatial_ref.ImportFromEPSG(EPSG)
+    dataset = ogr.GetDriverByName('GPKG').CreateDataSource(file_name_and_path)
+    layer = dataset.CreateLayer('layer', spatial_ref, ogr_type, ['FID=fid'])
+    layer.CreateField(ogr.FieldDefn('name', ogr.OFTString))
+    for fid, geometry in enumerate(geometries, start=1):
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetFID(fid)
+        feature.SetField('name', feature_name(fid))
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(shapely.to_wkb(geometry)))
+        layer.CreateFeature(feature)
+    dataset = None
+
+
+def encode(geometry) -> str:
+    return base64.b64encode(shapely.to_wkb(geometry)).decode('ascii')
+
+
+@unittest.skipIf(ogr is None, 'GDAL is not installed')
+class GeofencerTest(unittest.TestCase):
+    """
+    The geofencer runs against the local stand-in of NextGIS Web from the benchmarks.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.layers = {}
+        self.add_layer(TOP_LAYER_ID, 'point', [shapely.Point(100, 100), shapely.Point(200, 200)])
+        self.add_layer(BOTTOM_LAYER_ID, 'polygon', [ZONE])
+        self.add_layer(OTHER_TOP_LAYER_ID, 'point', [shapely.Point(300, 300)])
+        self.add_layer(INSIDE_TOP_LAYER_ID, 'point', [shapely.Point(0, 0), NEAR_EDGE, shapely.Point(100, 100)])
+        self.server = StubNGWServer(list(self.layers.values()))
+        self.server.start()
+        self.geofencers = []
+
+    def tearDown(self):
+        for geofencer in self.geofencers:
+            geofencer.close()
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+    def add_layer(self, layer_id: int, geometry_type: str, geometries: list) -> None:
+        gpkg_path = os.path.join(self.tmp_dir.name, 'server', f'{layer_id}.gpkg')
+        os.makedirs(os.path.dirname(gpkg_path), exist_ok=True)
+        write_layer(gpkg_path, ogr.wkbPoint if geometry_type == 'point' else ogr.wkbPolygon, geometries)
+        self.layers[layer_id] = StubLayer(layer_id, gpkg_path, geometry_type, len(geometries))
+
+    def publish(self, layer_id: int, items: list) -> None:
+        """
+        The function adds one version with the changes to the layer of the server.
+        """
+        layer = self.layers[layer_id]
+        with self.server.lock:
+            version = layer.version+1
+            for item in items:
+                item['vid'] = version
+                if ('geom' in item):
+                    layer.geometries[item['fid']] = item['geom']
+                if (item['action'] == 'feature.create'):
+                    layer.fids.append(item['fid'])
+                    layer.next_fid = max(layer.next_fid, item['fid']+1)
+            layer.changes[version] = items
+            layer.version = version
+
+    def move(self, layer_id: int, fid: int, geometry) -> None:
+        self.publish(layer_id, [{'action': 'feature.update', 'fid': fid, 'geom': encode(geometry), 'fields': [[1, feature_name(fid)]]}])
+
+    def open_geofencer(self, pairs: list = None, top_buffer: float = 0, **script_parameters) -> 'NGWGeofencer':
+        config = {
+            'ngw': {'host': self.server.url, 'login': 'login', 'password': 'password'},
+            'script_parameters': dict({
+                'geofence_mode': 'intersection',
+                'tmp_files_path': os.path.join(self.tmp_dir.name, 'tmp'),
+                'update_period_sec': 1,
+                'message_type': 'console_message'
+            }, **script_parameters),
+            'optional_parameters': {'tg_user_id': 0}
+        }
+        pairs = pairs or [(TOP_LAYER_ID, BOTTOM_LAYER_ID)]
+        config['pairs'] = [
+            {
+                'top_layer': {'id': top_layer_id, 'attribute_params_for_message': ['name'], 'buffer': top_buffer},
+                'bottom_layer': {'id': bottom_layer_id, 'attribute_params_for_message': ['name'], 'buffer': 0}
+            }
+            for top_layer_id, bottom_layer_id in pairs
+        ]
+        config_path = os.path.join(self.tmp_dir.name, f'config_{len(self.geofencers)}.json')
+        with open(config_path, 'w', encoding='utf-8') as config_file:
+            json.dump(config, config_file)
+
+        geofencer = NGWGeofencer(config_path)
+        # events are collected instead of being printed
+        geofencer.events_file = io.StringIO()
+        self.geofencers.append(geofencer)
+        return geofencer
+
+    def close_geofencer(self, geofencer: 'NGWGeofencer') -> None:
+        geofencer.close()
+        self.geofencers.remove(geofencer)
+
+    def run_cycle(self, geofencer: 'NGWGeofencer') -> tuple:
+        """
+        The function runs one poll cycle and returns its status and events.
+        """
+        start = len(geofencer.events_file.getvalue())
+        status = geofencer.scheduler.cycle_function()
+        self.assertEqual(status['status'], 'ok', status.get('message'))
+        events = [json.loads(line) for line in geofencer.events_file.getvalue()[start:].splitlines()]
+        return status, events
+
+    def prepare(self, geofencer: 'NGWGeofencer') -> None:
+        status = geofencer.prepare()
+        self.assertEqual(status['status'], 'ok', status.get('message'))
+
+    def test_catch_up_requests_metadata_of_every_version_once(self):
+        geofencer = self.open_geofencer()
+        self.prepare(geofencer)
+        self.move(TOP_LAYER_ID, 1, shapely.Point(1, 1))
+        self.move(TOP_LAYER_ID, 1, shapely.Point(50, 50))
+        self.move(TOP_LAYER_ID, 1, shapely.Point(2, 2))
+        self.server.stats()
+
+        status, events = self.run_cycle(geofencer)
+        self.assertEqual((status['changed'], status['versions']), (True, 3))
+        self.assertEqual(self.server.stats()['requests'].get('version'), 3)
+        # events of the versions inside the zone come in the order of versions with their times
+        self.assertEqual([(event['top_fid'], event['bottom_fid']) for event in events], [(1, 1), (1, 1)])
+        self.assertEqual([event['time'] for event in events], [self.layers[TOP_LAYER_ID].tstamp(2), self.layers[TOP_LAYER_ID].tstamp(4)])
+
+        status, events = self.run_cycle(geofencer)
+        self.assertEqual((status['changed'], events), (False, []))
+        self.assertNotIn('version', self.server.stats()['requests'])
+
+    def test_warm_start_uses_local_layers(self):
+        geofencer = self.open_geofencer()
+        self.prepare(geofencer)
+        self.close_geofencer(geofencer)
+        self.assertEqual(self.server.stats()['requests'].get('export'), 2)
+
+        # changes made while the geofencer was stopped are processed by the first cycle after the restart
+        self.move(TOP_LAYER_ID, 2, shapely.Point(3, 3))
+        geofencer = self.open_geofencer()
+        self.prepare(geofencer)
+        self.assertNotIn('export', self.server.stats()['requests'])
+        status, events = self.run_cycle(geofencer)
+        self.assertEqual(status['versions'], 1)
+        self.assertEqual([(event['top_fid'], event['bottom_fid']) for event in events], [(2, 1)])
+
+
+    def test_created_features_are_applied_from_the_feed(self):
+        geofencer = self.open_geofencer()
+        self.prepare(geofencer)
+        # features created by clients come without attributes, they are requested in one page for all created features
+        self.publish(TOP_LAYER_ID, [
+            {'action': 'feature.create', 'fid': 3, 'geom': encode(shapely.Point(1, 1))},
+            {'action': 'feature.create', 'fid': 4, 'geom': encode(shapely.Point(60, 60))}
+        ])
+        self.server.stats()
+
+        status, events = self.run_cycle(geofencer)
+        self.assertEqual([(event['action'], event['top_fid'], event['top_attributes']) for event in events], [('feature.create', 3, [{'name': feature_name(3)}])])
+        requests = self.server.stats()['requests']
+        self.assertEqual(requests.get('features'), 1)
+        self.assertNotIn('feature', requests)
+
+        dataset = ogr.Open(os.path.join(self.tmp_dir.name, 'tmp', 'layers', f'layer_{TOP_LAYER_ID}.gpkg'), 0)
+        layer = dataset.GetLayerByName('layer')
+        self.assertEqual(layer.GetFeatureCount(), 4)
+        feature = layer.GetFeature(4)
+        self.assertEqual(feature.GetField('name'), feature_name(4))
+        self.assertTrue(shapely.from_wkb(bytes(feature.GetGeometryRef().ExportToWkb())).equals(shapely.Point(60, 60)))
+        dataset = None
+
+    def test_wrong_metric_crs_is_a_configuration_error(self):
+        with self.assertRaises(ErrorConnection):
+            self.open_geofencer(metric_crs='not a CRS')
+
+    def test_local_layers_keep_the_applied_version(self):
+        geofencer = self.open_geofencer()
+        self.prepare(geofencer)
+        self.move(TOP_LAYER_ID, 1, shapely.Point(1, 1))
+        status, events = self.run_cycle(geofencer)
+        self.close_geofencer(geofencer)
+
+        # the version is kept in metadata, so the mirrored layer stays the only layer of the file
+        dataset = ogr.Open(os.path.join(self.tmp_dir.name, 'tmp', 'layers', f'layer_{TOP_LAYER_ID}.gpkg'), 0)
+        self.assertEqual(dataset.GetLayerCount(), 1)
+        self.assertEqual(dataset.GetMetadataItem('GEOFENCER_MIRROR_VERSION'), str(self.layers[TOP_LAYER_ID].version))
+        dataset = None
+
+    def test_idle_polls_are_conditional(self):
+        geofencer = self.open_geofencer()
+        self.prepare(geofencer)
+        self.server.stats()
+
+        for _ in range(2):
+            status, events = self.run_cycle(geofencer)
+            self.assertEqual((status['changed'], events), (False, []))
+        # every layer is requested once per cycle and the server answers 304 without the body
+        stats = self.server.stats()
+        self.assertEqual(stats['requests'], {'resource': 4})
+        self.assertEqual(stats['bytes_sent'], 0)
+
+        self.move(BOTTOM_LAYER_ID, 1, shapely.box(90, 90, 110, 110))
+        status, events = self.run_cycle(geofencer)
+        self.assertEqual(status['versions'], 1)
+        self.assertEqual([(event['layer_id'], event['top_fid'], event['bottom_fid']) for event in events], [(BOTTOM_LAYER_ID, 1, 1)])
+        self.assertGreater(self.server.stats()['bytes_sent'], 0)
+
+    def test_pairs_share_layers(self):
+        geofencer = self.open_geofencer(pairs=[(TOP_LAYER_ID, BOTTOM_LAYER_ID), (OTHER_TOP_LAYER_ID, BOTTOM_LAYER_ID)])
+        self.prepare(geofencer)
+        # the bottom layer of both pairs is exported and polled once
+        self.assertEqual(self.server.stats()['requests'].get('export'), 3)
+
+        self.move(TOP_LAYER_ID, 1, shapely.Point(1, 1))
+        self.move(OTHER_TOP_LAYER_ID, 1, shapely.Point(2, 2))
+        status, events = self.run_cycle(geofencer)
+        self.assertEqual(status['versions'], 2)
+        self.assertEqual(
+            sorted((event['top_layer_id'], event['top_fid'], event['bottom_layer_id'], event['bottom_fid']) for event in events),
+            [(TOP_LAYER_ID, 1, BOTTOM_LAYER_ID, 1), (OTHER_TOP_LAYER_ID, 1, BOTTOM_LAYER_ID, 1)]
+        )
+        self.assertEqual(self.server.stats()['requests'].get('resource'), 3)
+
+        # a change of the shared layer is checked against the top layers of both pairs
+        self.move(BOTTOM_LAYER_ID, 1, shapely.box(0, 0, 5, 5))
+        status, events = self.run_cycle(geofencer)
+        self.assertEqual(
+            sorted((event['layer_id'], event['top_layer_id'], event['top_fid']) for event in events),
+            [(BOTTOM_LAYER_ID, TOP_LAYER_ID, 1), (BOTTOM_LAYER_ID, OTHER_TOP_LAYER_ID, 1)]
+        )
+
+    def test_features_inside_zones_at_start_do_not_dwell(self):
+        for spatial_index in ('ogr', 'memory'):
+            with self.subTest(spatial_index=spatial_index):
+                geofencer = self.open_geofencer(
+                    pairs=[(INSIDE_TOP_LAYER_ID, BOTTOM_LAYER_ID)], geofence_mode='dwell', dwell_time_sec=0,
+                    spatial_index=spatial_index, tmp_files_path=os.path.join(self.tmp_dir.name, f'tmp_{spatial_index}')
+                )
+                self.prepare(geofencer)
+                status, events = self.run_cycle(geofencer)
+                self.assertEqual(events, [])
+
+                # a feature which entered while the geofencer runs dwells, features inside from the start are treated as reported
+                self.move(INSIDE_TOP_LAYER_ID, 3, shapely.Point(5, 5))
+                self.move(INSIDE_TOP_LAYER_ID, 1, shapely.Point(50, 50))
+                status, events = self.run_cycle(geofencer)
+                self.assertEqual(sorted((event['type'], event['top_fid']) for event in events), [('dwell', 3), ('exit', 1)])
+                self.close_geofencer(geofencer)
+
+    def test_features_near_zone_edges_do_not_flap(self):
+        for spatial_index in ('ogr', 'memory'):
+            with self.subTest(spatial_index=spatial_index):
+                geofencer = self.open_geofencer(
+                    pairs=[(INSIDE_TOP_LAYER_ID, BOTTOM_LAYER_ID)], top_buffer=10, geofence_mode='enter_exit',
+                    spatial_index=spatial_index, tmp_files_path=os.path.join(self.tmp_dir.name, f'tmp_{spatial_index}')
+                )
+                self.prepare(geofencer)
+                # the feature is updated without moving, memberships are tested by the same distance as they were built
+                self.move(INSIDE_TOP_LAYER_ID, 2, NEAR_EDGE)
+                status, events = self.run_cycle(geofencer)
+                self.assertEqual(events, [])
+
+                self.move(INSIDE_TOP_LAYER_ID, 2, shapely.Point(50, 50))
+                status, events = self.run_cycle(geofencer)
+                self.assertEqual([(event['type'], event['top_fid']) for event in events], [('exit', 2)])
+                self.close_geofencer(geofencer)
+
+if __name__ == '__main__':
+    unittest.main()
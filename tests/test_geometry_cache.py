@@ -0,0 +1,112 @@
+import unittest
+import shapely
+from geometry_cache import GeometryCache, PreparedGeometryCache
+
+
+class GeometryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        # every geometry takes 10 bytes, so the cache keeps three of them
+        self.cache = GeometryCache(30, lambda geometry: 10)
+        self.computed = []
+
+    def compute(self, x: float):
+        def compute():
+            self.computed.append(x)
+            return shapely.Point(x, 0)
+        return compute
+
+    def test_hit(self):
+        geometry = self.cache.get((1, 1, 0), self.compute(1))
+        self.assertIs(self.cache.get((1, 1, 0), self.compute(1)), geometry)
+        self.assertEqual(self.computed, [1])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1, 'size_bytes': 10})
+
+    def test_evict_least_recently_used_by_bytes(self):
+        for fid in (1, 2, 3):
+            self.cache.get((1, fid, 0), self.compute(fid))
+        # the first entry becomes the most recently used one, so the second is evicted
+        self.cache.get((1, 1, 0), self.compute(1))
+        self.cache.get((1, 4, 0), self.compute(4))
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.size_bytes, 30)
+        self.assertEqual(self.cache.evictions, 1)
+
+        self.cache.get((1, 2, 0), self.compute(2))
+        self.cache.get((1, 1, 0), self.compute(1))
+        self.assertEqual(self.computed, [1, 2, 3, 4, 2])
+
+    def test_geometry_larger_than_cache(self):
+        cache = GeometryCache(5, lambda geometry: 10)
+        cache.get((1, 1, 0), self.compute(1))
+        cache.get((1, 1, 0), self.compute(1))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(self.computed, [1, 1])
+
+    def test_invalidate_feature(self):
+        self.cache.get((1, 1, 0, 10), self.compute(1))
+        self.cache.get((1, 1, 0, 20), self.compute(2))
+        self.cache.get((1, 2, 0, 10), self.compute(3))
+        self.cache.invalidate(1, 1)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size_bytes, 10)
+        self.cache.get((1, 1, 0, 10), self.compute(4))
+        self.assertEqual(self.computed, [1, 2, 3, 4])
+
+    def test_disabled(self):
+        cache = GeometryCache(0, lambda geometry: 10)
+        cache.get((1, 1, 0), self.compute(1))
+        cache.get((1, 1, 0), self.compute(1))
+        self.assertEqual((len(cache), self.computed), (0, [1, 1]))
+
+
+class PreparedGeometryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PreparedGeometryCache(2, min_hits=2)
+        self.geometries = {fid: shapely.box(fid, 0, fid+1, 1) for fid in (1, 2, 3)}
+
+    def prepare(self, *fids):
+        self.cache.prepare(1, list(fids), [self.geometries[fid] for fid in fids])
+
+    def test_prepare_after_min_hits(self):
+        self.prepare(1)
+        self.assertFalse(shapely.is_prepared(self.geometries[1]))
+        self.prepare(1)
+        self.assertTrue(shapely.is_prepared(self.geometries[1]))
+        self.prepare(1)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'evictions': 0, 'entries': 1})
+
+    def test_duplicates_count_once(self):
+        self.prepare(1, 1, 1)
+        self.assertFalse(shapely.is_prepared(self.geometries[1]))
+
+    def test_destroy_on_evict(self):
+        for _ in range(2):
+            self.prepare(1, 2)
+        # the first geometry becomes the most recently used one, so the second is evicted
+        self.prepare(1)
+        for _ in range(2):
+            self.prepare(3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertTrue(shapely.is_prepared(self.geometries[1]))
+        self.assertFalse(shapely.is_prepared(self.geometries[2]))
+        self.assertTrue(shapely.is_prepared(self.geometries[3]))
+
+    def test_invalidate(self):
+        for _ in range(2):
+            self.prepare(1)
+        self.cache.invalidate(1, 1)
+        self.assertEqual(len(self.cache), 0)
+        self.assertFalse(shapely.is_prepared(self.geometries[1]))
+
+    def test_disabled(self):
+        cache = PreparedGeometryCache(0)
+        for _ in range(3):
+            cache.prepare(1, [1], [self.geometries[1]])
+        self.assertFalse(shapely.is_prepared(self.geometries[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from http_client import HttpClient
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.__answer()
+
+    def __answer(self):
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path))
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = b'{"status": "ok"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HttpClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.statuses = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.client = HttpClient(retries=2, backoff=0)
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_get(self):
+        response = self.client.get(f'{self.url}/api/resource/12/feature/5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok'})
+        stats = self.client.stats()
+        # ids are removed from the path, so requests to one API are counted together
+        self.assertEqual(list(stats), ['GET /api/resource/{id}/feature/{id}'])
+        self.assertEqual(stats['GET /api/resource/{id}/feature/{id}']['calls'], 1)
+        self.assertEqual(stats['GET /api/resource/{id}/feature/{id}']['bytes'], len(b'{"status": "ok"}'))
+
+    def test_retry_server_errors(self):
+        self.server.statuses = [503, 500]
+        response = self.client.get(f'{self.url}/api/resource/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        stats = self.client.stats()['GET /api/resource/{id}']
+        self.assertEqual((stats['calls'], stats['retries'], stats['errors']), (3, 2, 2))
+
+    def test_last_server_error_is_returned(self):
+        self.server.statuses = [503, 503, 503, 503]
+        response = self.client.get(f'{self.url}/api/resource/1')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.statuses = [404]
+        self.assertEqual(self.client.get(f'{self.url}/api/resource/1').status_code, 404)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_is_not_retried(self):
+        # a retry could repeat an action the server already did, for example send a message twice
+        self.server.statuses = [502]
+        response = self.client.post(f'{self.url}/bot123:secret/sendMessage', data={'text': 'message'})
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(self.server.requests, [('POST', '/bot123:secret/sendMessage')])
+
+    def test_connection_error(self):
+        with socket.socket() as free_socket:
+            free_socket.bind(('127.0.0.1', 0))
+            port = free_socket.getsockname()[1]
+        with self.assertRaises(requests.ConnectionError):
+            self.client.get(f'http://127.0.0.1:{port}/api/resource/1')
+        self.assertEqual(self.client.stats()['GET /api/resource/{id}']['calls'], 3)
+
+    def test_bot_token_is_hidden(self):
+        self.client.get(f'{self.url}/bot123:secret/getMe')
+        self.assertEqual(list(self.client.stats()), ['GET /bot{token}/getMe'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from membership_store import MembershipStore
+
+
+class MembershipStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'state', 'membership.sqlite')
+        self.store = MembershipStore(self.db_path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_enter_and_exit(self):
+        self.store.add(1, 2, [(10, 20, 100.0), (10, 21, 101.0), (11, 20, 102.0)])
+        self.assertEqual(self.store.get(1, 2, 'top', 10), {20: (100.0, False), 21: (101.0, False)})
+        self.assertEqual(self.store.get(1, 2, 'bottom', 20), {10: (100.0, False), 11: (102.0, False)})
+
+        # a repeated enter keeps the time of the first one
+        self.store.add(1, 2, [(10, 20, 200.0)])
+        self.assertEqual(self.store.get(1, 2, 'top', 10)[20], (100.0, False))
+
+        self.store.remove(1, 2, [(10, 20)])
+        self.assertEqual(self.store.get(1, 2, 'top', 10), {21: (101.0, False)})
+        self.assertEqual(self.store.count(1, 2), 2)
+
+    def test_pairs_are_separate(self):
+        self.store.add(1, 2, [(10, 20, 100.0)])
+        self.store.add(1, 3, [(10, 20, 100.0)])
+        self.store.clear(1, 2)
+        self.assertEqual((self.store.count(1, 2), self.store.count(1, 3)), (0, 1))
+
+    def test_dwell(self):
+        self.store.add(1, 2, [(10, 20, 100.0), (11, 20, 150.0), (12, 20, 300.0)])
+        self.assertEqual(sorted(self.store.get_dwelling(1, 2, 200.0)), [(10, 20, 100.0), (11, 20, 150.0)])
+
+        self.store.set_dwell_reported(1, 2, [(10, 20)])
+        self.assertEqual(self.store.get_dwelling(1, 2, 200.0), [(11, 20, 150.0)])
+        self.assertEqual(self.store.get(1, 2, 'top', 10), {20: (100.0, True)})
+
+    def test_add_reported(self):
+        # memberships found when the store is built have no known start, so they do not produce dwell events
+        self.store.add(1, 2, [(10, 20, 100.0)], dwell_reported=True)
+        self.assertEqual(self.store.get_dwelling(1, 2, 200.0), [])
+        self.assertEqual(self.store.get(1, 2, 'top', 10), {20: (100.0, True)})
+
+    def test_dwelling_index(self):
+        plan = self.store.connection.execute(
+            'EXPLAIN QUERY PLAN SELECT top_fid, bottom_fid, since FROM membership WHERE top_layer_id=? AND bottom_layer_id=? AND dwell_reported=0 AND since<=?',
+            (1, 2, 200.0)
+        ).fetchall()
+        self.assertIn('membership_dwelling', ' '.join(row[-1] for row in plan))
+
+    def test_transactions(self):
+        self.store.begin()
+        self.store.add(1, 2, [(10, 20, 100.0)])
+        self.store.rollback()
+        self.assertEqual(self.store.count(1, 2), 0)
+
+        self.store.begin()
+        # a leaked transaction does not break the next one
+        self.store.begin()
+        self.store.add(1, 2, [(10, 20, 100.0)])
+        self.store.commit()
+        self.store.commit()
+        self.store.close()
+
+        self.store = MembershipStore(self.db_path)
+        self.assertEqual(self.store.get(1, 2, 'top', 10), {20: (100.0, False)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from metrics import MetricsRegistry, MetricsServer
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry(prefix='test')
+        self.registry.counter('events_total', 'Events by type')
+        self.registry.gauge('queue_depth', 'Queue depth')
+        self.registry.histogram('duration_seconds', 'Duration', buckets=(1, 0.1))
+
+    def test_counter_and_gauge(self):
+        self.registry.inc('events_total', type='enter')
+        self.registry.inc('events_total', 2, type='enter')
+        self.registry.set('queue_depth', 5)
+        self.registry.set('queue_depth', 3)
+        self.assertEqual(self.registry.get('events_total', type='enter'), 3)
+        self.assertIsNone(self.registry.get('events_total', type='exit'))
+        self.assertEqual(self.registry.get('queue_depth'), 3)
+
+    def test_histogram(self):
+        for value in (0.05, 0.5, 0.7, 5):
+            self.registry.observe('duration_seconds', value, stage='commit')
+        self.assertEqual(self.registry.get('duration_seconds', stage='commit'), {'buckets': [1, 2], 'sum': 6.25, 'count': 4})
+        with self.registry.time('duration_seconds', stage='fetch'):
+            pass
+        self.assertEqual(self.registry.get('duration_seconds', stage='fetch')['count'], 1)
+
+    def test_render(self):
+        self.registry.inc('events_total', type='say "hi"\n')
+        self.registry.observe('duration_seconds', 0.5)
+        self.registry.add_collector(lambda: self.registry.set('queue_depth', 7))
+        lines = self.registry.render().splitlines()
+        self.assertIn('# TYPE test_events_total counter', lines)
+        self.assertIn('test_events_total{type="say \\"hi\\"\\n"} 1', lines)
+        self.assertIn('test_queue_depth 7', lines)
+        self.assertIn('test_duration_seconds_bucket{le="0.1"} 0', lines)
+        self.assertIn('test_duration_seconds_bucket{le="1"} 1', lines)
+        self.assertIn('test_duration_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('test_duration_seconds_sum 0.5', lines)
+        self.assertIn('test_duration_seconds_count 1', lines)
+
+    def test_failed_collector(self):
+        def collector():
+            raise RuntimeError('collector error')
+
+        self.registry.add_collector(collector)
+        self.assertIn('# TYPE test_queue_depth gauge', self.registry.render())
+
+
+class MetricsServerTest(unittest.TestCase):
+
+    def test_serve(self):
+        registry = MetricsRegistry(prefix='test')
+        registry.counter('cycles_total', 'Cycles')
+        registry.inc('cycles_total', status='ok')
+        server = MetricsServer(registry, 0)
+        server.start()
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}'
+            with urlopen(f'{url}/metrics') as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+                self.assertIn('test_cycles_total{status="ok"} 1', response.read().decode('utf-8'))
+            with self.assertRaises(HTTPError) as error:
+                urlopen(f'{url}/other')
+            self.assertEqual(error.exception.code, 404)
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
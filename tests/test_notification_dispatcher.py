@@ -0,0 +1,98 @@
+import threading
+import unittest
+from notification_dispatcher import NotificationDispatcher, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        self.assertEqual([bucket.take() for _ in range(3)], [0, 0, 0])
+        wait_time = bucket.take()
+        self.assertGreater(wait_time, 0.4)
+        self.assertLessEqual(wait_time, 0.5)
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=1, capacity=2)
+        bucket.take()
+        bucket.take()
+        bucket.updated -= 1.5
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+
+
+class NotificationDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = []
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def send(self, chat_id: int, message: str) -> bool:
+        with self.lock:
+            if (self.failures > 0):
+                self.failures -= 1
+                return False
+            self.messages.append((chat_id, message))
+            return True
+
+    def test_send(self):
+        dispatcher = NotificationDispatcher(self.send, rate=1000, burst=10)
+        dispatcher.start()
+        for number in range(5):
+            self.assertTrue(dispatcher.put(1, f'message {number}'))
+        dispatcher.stop()
+        self.assertEqual(self.messages, [(1, f'message {number}') for number in range(5)])
+        stats = dispatcher.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['dropped'], stats['queue_depth']), (5, 0, 0, 0))
+
+    def test_retries(self):
+        self.failures = 2
+        dispatcher = NotificationDispatcher(self.send, rate=1000, burst=10, retries=2, backoff=0)
+        dispatcher.start()
+        dispatcher.put(1, 'message')
+        dispatcher.stop()
+        self.assertEqual(self.messages, [(1, 'message')])
+        self.assertEqual((dispatcher.sent, dispatcher.retried, dispatcher.failed), (1, 2, 0))
+
+    def test_failed_after_retries(self):
+        self.failures = 3
+        dispatcher = NotificationDispatcher(self.send, rate=1000, burst=10, retries=2, backoff=0)
+        dispatcher.start()
+        dispatcher.put(1, 'message')
+        dispatcher.stop()
+        self.assertEqual(self.messages, [])
+        self.assertEqual((dispatcher.sent, dispatcher.retried, dispatcher.failed), (0, 2, 1))
+
+    def test_exception_is_a_failure(self):
+        def send(chat_id: int, message: str) -> bool:
+            raise ConnectionError('no connection')
+
+        dispatcher = NotificationDispatcher(send, rate=1000, burst=10, retries=1, backoff=0)
+        dispatcher.start()
+        dispatcher.put(1, 'message')
+        dispatcher.stop()
+        self.assertEqual(dispatcher.failed, 1)
+
+    def test_coalesce(self):
+        dispatcher = NotificationDispatcher(self.send, rate=1000, burst=10, coalesce=True, max_message_length=20)
+        dispatcher.start()
+        for message in ('first', 'second', 'third', 'fourth'):
+            dispatcher.put(1, message)
+        dispatcher.put(2, 'other chat')
+        # nothing is sent until the end of the cycle
+        self.assertEqual(dispatcher.stats()['queue_depth'], 0)
+        dispatcher.flush_cycle()
+        dispatcher.stop()
+        self.assertEqual(sorted(self.messages), [(1, 'first\nsecond\nthird'), (1, 'fourth'), (2, 'other chat')])
+
+    def test_full_queue_drops_messages(self):
+        # workers are not started, so messages stay in the queue
+        dispatcher = NotificationDispatcher(self.send, queue_size=2)
+        self.assertEqual([dispatcher.put(1, 'message') for _ in range(3)], [True, True, False])
+        self.assertEqual(dispatcher.stats()['dropped'], 1)
+        self.assertEqual(dispatcher.stats()['queue_depth'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+import shapely
+
+try:
+    from osgeo import ogr, osr
+    from ngw_geofencer import NGWGeofencer
+    from state_store import StateStore
+except ImportError:
+    ogr = None
+
+TOP_LAYER_ID = 1
+BOTTOM_LAYER_ID = 2
+FIELDS = {1: 'name'}
+
+
+def write_layer(file_name_and_path: str, ogr_type: int, geometries: dict) -> None:
+    spatial_ref = osr.SpatialReference()
+    spatial_ref.ImportFromEPSG(3857)
+    dataset = ogr.GetDriverByName('GPKG').CreateDataSource(file_name_and_path)
+    layer = dataset.CreateLayer('layer', spatial_ref, ogr_type, ['FID=fid'])
+    layer.CreateField(ogr.FieldDefn('name', ogr.OFTString))
+    for fid, geometry in geometries.items():
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetFID(fid)
+        feature.SetField('name', f'feature {fid}')
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(shapely.to_wkb(geometry)))
+        layer.CreateFeature(feature)
+    dataset = None
+
+
+@unittest.skipIf(ogr is None, 'GDAL is not installed')
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_files_path = os.path.join(self.tmp_dir.name, 'tmp')
+        os.makedirs(os.path.join(self.tmp_files_path, 'layers'))
+        write_layer(os.path.join(self.tmp_files_path, 'layers', f'layer_{TOP_LAYER_ID}.gpkg'), ogr.wkbPoint, {1: shapely.Point(100, 100)})
+        write_layer(os.path.join(self.tmp_files_path, 'layers', f'layer_{BOTTOM_LAYER_ID}.gpkg'), ogr.wkbPolygon, {1: shapely.box(-10, -10, 10, 10)})
+
+        # layers exported by a previous run
+        state_store = StateStore(os.path.join(self.tmp_files_path, NGWGeofencer.STATE_FILE_NAME))
+        state_store.begin()
+        for layer_id in (TOP_LAYER_ID, BOTTOM_LAYER_ID):
+            state_store.set_layer(layer_id, 1, 1, FIELDS, FIELDS)
+        state_store.commit()
+        state_store.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def replay(self, geofence_mode: str, changes: list) -> tuple:
+        config_path = os.path.join(self.tmp_dir.name, 'config.json')
+        with open(config_path, 'w', encoding='utf-8') as config_file:
+            json.dump({
+                'ngw': {'host': 'http://127.0.0.1:1', 'login': 'login', 'password': 'password'},
+                'top_layer': {'id': TOP_LAYER_ID, 'attribute_params_for_message': ['name'], 'buffer': 0},
+                'bottom_layer': {'id': BOTTOM_LAYER_ID, 'attribute_params_for_message': ['name'], 'buffer': 0},
+                'script_parameters': {
+                    'geofence_mode': geofence_mode,
+                    'tmp_files_path': self.tmp_files_path,
+                    'update_period_sec': 1,
+                    'message_type': 'console_message'
+                },
+                'optional_parameters': {'tg_user_id': 0}
+            }, config_file)
+
+        feed_path = os.path.join(self.tmp_dir.name, 'feed.jsonl')
+        with open(feed_path, 'w', encoding='utf-8') as feed_file:
+            feed_file.write(json.dumps({'layer_id': TOP_LAYER_ID, 'version': {'id': 2, 'tstamp': '2024-01-01T00:00:02'}})+'\n')
+            feed_file.write(json.dumps({'layer_id': TOP_LAYER_ID, 'changes': changes})+'\n')
+
+        events_path = os.path.join(self.tmp_dir.name, 'events.jsonl')
+        geofencer = NGWGeofencer(config_path)
+        try:
+            status = geofencer.replay(feed_path, events_path)
+        finally:
+            geofencer.close()
+        with open(events_path, 'r', encoding='utf-8') as events_file:
+            events = [json.loads(line) for line in events_file if line.strip()]
+        return status, events
+
+    def test_create_without_fields(self):
+        # features created by clients may come without attributes, they are set by later versions
+        geometry = base64.b64encode(shapely.to_wkb(shapely.Point(0, 0))).decode('ascii')
+        for geofence_mode in ('intersection', 'enter_exit'):
+            with self.subTest(geofence_mode=geofence_mode):
+                status, events = self.replay(geofence_mode, [{'action': 'feature.create', 'fid': 2, 'vid': 2, 'geom': geometry}])
+                self.assertEqual(status['status'], 'ok', status.get('message'))
+                self.assertEqual(status['changes'], 1)
+                self.assertEqual(len(events), 1)
+                self.assertEqual(events[0]['action'], 'feature.create')
+                self.assertEqual((events[0]['top_fid'], events[0]['bottom_fid']), (2, 1))
+                self.assertEqual(events[0]['top_attributes'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import threading
+import unittest
+from scheduler import PollScheduler
+
+OK = {'status': 'ok', 'changed': False}
+CHANGED = {'status': 'ok', 'changed': True}
+INCOMPLETE = {'status': 'ok', 'changed': True, 'complete': False}
+ERROR = {'status': 'error', 'message': 'error'}
+
+
+class PollSchedulerTest(unittest.TestCase):
+
+    def make_scheduler(self, **params) -> PollScheduler:
+        return PollScheduler(lambda: OK, 10, jitter=0, **params)
+
+    def test_defaults(self):
+        scheduler = self.make_scheduler()
+        self.assertEqual((scheduler.min_interval, scheduler.max_interval), (5, 60))
+
+    def test_idle_back_off(self):
+        scheduler = self.make_scheduler()
+        delays = [scheduler.next_delay(OK) for _ in range(7)]
+        self.assertEqual(delays, [15, 22.5, 33.75, 50.625, 60, 60, 60])
+
+    def test_changes_reset_interval(self):
+        scheduler = self.make_scheduler()
+        for _ in range(5):
+            scheduler.next_delay(OK)
+        self.assertEqual(scheduler.next_delay(CHANGED), 5)
+        self.assertEqual(scheduler.next_delay(OK), 7.5)
+
+    def test_error_back_off(self):
+        scheduler = self.make_scheduler()
+        scheduler.next_delay(CHANGED)
+        # errors grow the interval from at least the base interval
+        self.assertEqual([scheduler.next_delay(ERROR) for _ in range(4)], [20, 40, 60, 60])
+        self.assertEqual(scheduler.errors, 4)
+        self.assertEqual(scheduler.next_delay(None), 60)
+
+    def test_incomplete_catch_up_runs_at_once(self):
+        scheduler = self.make_scheduler()
+        self.assertEqual(scheduler.next_delay(INCOMPLETE), 0)
+        self.assertEqual(scheduler.interval, 5)
+
+    def test_cycle_time_is_subtracted(self):
+        scheduler = self.make_scheduler()
+        scheduler.last_cycle_time = 4
+        self.assertEqual(scheduler.next_delay(CHANGED), 1)
+        scheduler.last_cycle_time = 100
+        self.assertEqual(scheduler.next_delay(CHANGED), 0)
+
+    def test_jitter(self):
+        scheduler = PollScheduler(lambda: OK, 10, jitter=0.1)
+        for _ in range(100):
+            scheduler.interval = 10
+            self.assertTrue(5*0.9 <= scheduler.next_delay(CHANGED) <= 5*1.1)
+
+    def test_run_until_stop(self):
+        results = [INCOMPLETE, INCOMPLETE, RuntimeError('unexpected')]
+
+        def cycle():
+            result = results.pop(0)
+            if (not results):
+                scheduler.stop()
+            if (isinstance(result, Exception)):
+                raise result
+            return result
+
+        scheduler = PollScheduler(cycle, 10, jitter=0)
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        # exceptions of cycles are counted as errors and do not stop the scheduler
+        self.assertEqual((scheduler.cycles, scheduler.errors), (3, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
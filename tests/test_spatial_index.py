@@ -0,0 +1,80 @@
+import unittest
+import shapely
+from spatial_index import LayerSpatialIndex
+
+
+class LayerSpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = LayerSpatialIndex(min_rebuild_size=1000)
+        self.index.load([1, 2, 3], [shapely.Point(0, 0), shapely.Point(10, 0), None])
+
+    def query(self, geometry, **params):
+        input_indexes, fids = self.index.query([geometry], **params)
+        return fids.tolist()
+
+    def test_load(self):
+        self.assertEqual(len(self.index), 2)
+        self.assertNotIn(3, self.index)
+        self.assertEqual(self.query(shapely.box(-1, -1, 11, 1), predicate='intersects'), [1, 2])
+
+    def test_query_bounding_boxes(self):
+        # without predicate bounding boxes of input geometries are expanded by the distance
+        self.assertEqual(self.query(shapely.Point(5, 3)), [])
+        self.assertEqual(self.query(shapely.Point(5, 3), distance=5), [1, 2])
+        self.assertEqual(self.query(shapely.box(9, -1, 11, 1)), [2])
+
+    def test_query_many(self):
+        input_indexes, fids = self.index.query([shapely.Point(10, 0), shapely.Point(50, 50), shapely.box(-1, -1, 11, 1)], predicate='intersects')
+        self.assertEqual(input_indexes.tolist(), [0, 2, 2])
+        self.assertEqual(fids.tolist(), [2, 1, 2])
+
+    def test_query_empty(self):
+        index = LayerSpatialIndex()
+        index.load([], [])
+        input_indexes, fids = index.query([shapely.Point(0, 0)])
+        self.assertEqual((len(input_indexes), len(fids)), (0, 0))
+        self.assertEqual(len(self.index.query([])[0]), 0)
+
+    def test_query_nearest(self):
+        input_indexes, fids, distances = self.index.query_nearest([shapely.Point(3, 0), shapely.Point(8, 0), shapely.Point(50, 0)], max_distance=5)
+        self.assertEqual(input_indexes.tolist(), [0, 1])
+        self.assertEqual(fids.tolist(), [1, 2])
+        self.assertEqual(distances.tolist(), [3.0, 2.0])
+
+    def test_set_then_query(self):
+        # the moved feature is found only at the new place
+        self.index.set(1, shapely.Point(20, 0))
+        self.index.set(4, shapely.Point(0, 0.5))
+        self.assertEqual(self.query(shapely.Point(0, 0), predicate='dwithin', distance=1), [4])
+        self.assertEqual(self.query(shapely.Point(20, 0), predicate='intersects'), [1])
+        self.assertEqual(self.index.get_many([1, 4, 5])[2], None)
+
+    def test_delete_then_query(self):
+        self.index.set(4, shapely.Point(0, 0))
+        self.index.delete(1)
+        self.index.delete(4)
+        self.assertEqual(self.query(shapely.Point(0, 0), distance=1), [])
+        self.assertEqual(self.query(shapely.box(-1, -1, 11, 1)), [2])
+        self.assertEqual(len(self.index), 1)
+
+    def test_rebuild_after_changes(self):
+        index = LayerSpatialIndex(rebuild_ratio=0, min_rebuild_size=1)
+        index.load([1, 2], [shapely.Point(0, 0), shapely.Point(10, 0)])
+        index.set(1, shapely.Point(5, 0))
+        index.delete(2)
+        index.set(3, shapely.Point(5, 1))
+        input_indexes, fids = index.query([shapely.Point(5, 0)], predicate='dwithin', distance=2)
+        self.assertEqual(fids.tolist(), [1, 3])
+        self.assertEqual(index.query([shapely.Point(10, 0)], predicate='intersects')[1].tolist(), [])
+
+    def test_query_nearest_after_changes(self):
+        self.index.set(2, shapely.Point(1, 0))
+        input_indexes, fids, distances = self.index.query_nearest([shapely.Point(0.9, 0), shapely.Point(50, 0)], max_distance=5)
+        self.assertEqual(input_indexes.tolist(), [0])
+        self.assertEqual(fids.tolist(), [2])
+        self.assertAlmostEqual(distances[0], 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import unittest
+from state_store import StateStore
+
+FIELDS = {1: 'name', 2: 'type'}
+
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'state', 'state.sqlite')
+        self.store = StateStore(self.db_path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def reopen(self) -> None:
+        self.store.close()
+        self.store = StateStore(self.db_path)
+
+    def test_commit(self):
+        self.store.begin()
+        self.store.set_layer(1, 5, 1, {1: 'name'}, FIELDS)
+        # the cache is changed only when the transaction is committed
+        self.assertIsNone(self.store.get(1))
+        self.store.commit()
+        layer = {'id': 1, 'version': 5, 'epoch': 1, 'fields_to_display': {1: 'name'}, 'fields': FIELDS}
+        self.assertEqual(self.store.get(1), layer)
+
+        self.reopen()
+        self.assertEqual(self.store.get(1), layer)
+        self.assertEqual(len(self.store), 1)
+
+    def test_rollback(self):
+        self.store.begin()
+        self.store.set_layer(1, 5, 1)
+        self.store.commit()
+        self.store.begin()
+        self.store.set_layer(1, 8, 1, from_version=5)
+        self.store.rollback()
+        self.assertEqual(self.store.get(1)['version'], 5)
+        self.reopen()
+        self.assertEqual(self.store.get(1)['version'], 5)
+        self.assertEqual(len(self.store.get_history(1)), 1)
+
+    def test_history(self):
+        for from_version, version, epoch in ((None, 5, 1), (5, 8, 1), (8, 8, 1), (None, 3, 2)):
+            self.store.begin()
+            self.store.set_layer(1, version, epoch, from_version=from_version)
+            self.store.commit()
+        self.store.begin()
+        self.store.set_layer(2, 4, 1)
+        self.store.commit()
+
+        # a layer saved again with the same version and epoch does not add a range, the newest ranges are first
+        history = [entry[:3] for entry in self.store.get_history(1)]
+        self.assertEqual(history, [(2, None, 3), (1, 5, 8), (1, None, 5)])
+        self.assertEqual([entry[:3] for entry in self.store.get_history(1, limit=1)], [(2, None, 3)])
+        self.assertEqual([entry[:3] for entry in self.store.get_history(2)], [(1, None, 4)])
+
+    def test_import_data_file(self):
+        data_path = os.path.join(self.tmp_dir.name, 'data.json')
+        with open(data_path, 'w', encoding='utf-8') as data_file:
+            json.dump({'1': {'id': 1, 'version': 7, 'epoch': 2, 'fields_to_display': {'1': 'name'}}}, data_file)
+
+        self.assertTrue(self.store.import_data_file(data_path))
+        self.assertEqual(self.store.get(1)['version'], 7)
+        self.assertEqual(self.store.get(1)['fields_to_display'], {1: 'name'})
+        # the data file is imported only to the empty store
+        self.assertFalse(self.store.import_data_file(data_path))
+
+    def test_import_broken_data_file(self):
+        data_path = os.path.join(self.tmp_dir.name, 'data.json')
+        with open(data_path, 'w', encoding='utf-8') as data_file:
+            data_file.write('{"1": {"id": 1}}')
+        self.assertFalse(self.store.import_data_file(data_path))
+        self.assertFalse(self.store.import_data_file(os.path.join(self.tmp_dir.name, 'missing.json')))
+        self.assertEqual(len(self.store), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+from version_cache import VersionCache
+
+
+def version_info(version: int) -> dict:
+    return {'id': version, 'tstamp': f'2024-01-01T00:00:{version:02d}'}
+
+
+class VersionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, 'versions')
+        self.cache = VersionCache(self.cache_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_missing(self):
+        self.cache.update(1, 1, [version_info(2), version_info(3)])
+        self.assertEqual(self.cache.get(1, 1, 2), version_info(2))
+        self.assertIsNone(self.cache.get(1, 1, 4))
+        self.assertEqual(self.cache.get_missing(1, 1, [2, 3, 4, 5]), [4, 5])
+        self.assertEqual(self.cache.get_timestamps(1, 1), {2: version_info(2)['tstamp'], 3: version_info(3)['tstamp']})
+
+    def test_persistence(self):
+        self.cache.update(1, 1, [version_info(2)])
+        self.cache.update(2, 5, [version_info(7)])
+        cache = VersionCache(self.cache_path)
+        self.assertEqual(cache.get(1, 1, 2), version_info(2))
+        self.assertEqual(cache.get(2, 5, 7), version_info(7))
+
+    def test_epoch_change(self):
+        self.cache.update(1, 1, [version_info(2)])
+        self.assertIsNone(self.cache.get(1, 2, 2))
+        self.assertEqual(VersionCache(self.cache_path).get_missing(1, 2, [2]), [2])
+
+    def test_max_versions(self):
+        cache = VersionCache(self.cache_path, max_versions=2)
+        cache.update(1, 1, [version_info(version) for version in (3, 1, 2)])
+        self.assertEqual(cache.get_missing(1, 1, [1, 2, 3]), [1])
+
+    def test_prune(self):
+        self.cache.update(1, 1, [version_info(version) for version in (2, 3, 4)])
+        self.cache.prune(1, 1, 3)
+        self.assertEqual(self.cache.get_missing(1, 1, [2, 3, 4]), [2, 3])
+        with open(os.path.join(self.cache_path, 'versions_1.json'), 'r', encoding='utf-8') as cache_file:
+            self.assertEqual(list(json.load(cache_file)['versions']), ['4'])
+
+    def test_prune_without_changes_does_not_write(self):
+        self.cache.prune(1, 1, 3)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_broken_file(self):
+        os.makedirs(self.cache_path)
+        with open(os.path.join(self.cache_path, 'versions_1.json'), 'w', encoding='utf-8') as cache_file:
+            cache_file.write('{"epoch": 1, "versions"')
+        self.assertEqual(VersionCache(self.cache_path).get_missing(1, 1, [2]), [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
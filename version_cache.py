@@ -0,0 +1,119 @@
+import json
+import os
+
+
+class VersionCache:
+    """
+    Persistent cache of version metadata of layers keyed by (layer_id, epoch, version).
+
+    Metadata of every layer is kept in memory as a dict by version and saved to a JSON file
+    in the cache directory. Cached versions of the layer are dropped when its epoch changes
+    and when they are saved as processed, so the file keeps only versions of the current catch-up.
+    """
+
+    def __init__(self, cache_path: str, max_versions: int = 100000):
+        """
+        Parameters
+        ---------
+        cache_path : str
+            directory for the cache files
+
+        max_versions : int
+            maximum number of cached versions per layer, the oldest ones are dropped first
+        """
+        self.cache_path = cache_path
+        self.max_versions = max_versions
+        self.__layers = {}
+
+    def get(self, layer_id: int, epoch: int, version: int) -> dict:
+        """
+        This function returns cached metadata of the version or None.
+        """
+        return self.__get_layer(layer_id, epoch)['versions'].get(version)
+
+    def get_missing(self, layer_id: int, epoch: int, versions) -> list:
+        """
+        This function returns the list of versions from the given ones which are not in the cache.
+        """
+        cached_versions = self.__get_layer(layer_id, epoch)['versions']
+        return [version for version in versions if version not in cached_versions]
+
+    def get_timestamps(self, layer_id: int, epoch: int) -> dict:
+        """
+        This function returns a dict with version as key and its timestamp as value for all cached versions of the layer.
+        """
+        return {
+            version: version_info['tstamp']
+            for version, version_info in self.__get_layer(layer_id, epoch)['versions'].items()
+            if 'tstamp' in version_info
+        }
+
+    def update(self, layer_id: int, epoch: int, versions_information: list) -> None:
+        """
+        This function adds metadata of versions to the cache and saves the cache of the layer to the file.
+
+
+        Parameters
+        ---------
+        layer_id : int
+            unique ID of layer resource
+
+        epoch : int
+            current epoch of the layer
+
+        versions_information : list
+            dicts with metadata of versions as returned by the server, id key contains the version
+        """
+        layer = self.__get_layer(layer_id, epoch)
+        for version_info in versions_information:
+            if ('id' in version_info):
+                layer['versions'][version_info['id']] = version_info
+
+        if (len(layer['versions']) > self.max_versions):
+            for version in sorted(layer['versions'])[:len(layer['versions'])-self.max_versions]:
+                del layer['versions'][version]
+
+        self.__save_layer(layer_id)
+
+    def prune(self, layer_id: int, epoch: int, version: int) -> None:
+        """
+        This function drops cached versions of the layer up to the given one, they are not requested again after the version is saved.
+        The file of the layer is saved only if versions were dropped.
+        """
+        layer = self.__get_layer(layer_id, epoch)
+        old_versions = [cached_version for cached_version in layer['versions'] if cached_version <= version]
+        if (not old_versions):
+            return
+        for cached_version in old_versions:
+            del layer['versions'][cached_version]
+        self.__save_layer(layer_id)
+
+    def __get_layer(self, layer_id: int, epoch: int) -> dict:
+        layer = self.__layers.get(layer_id)
+        if (layer is None):
+            layer = self.__load_layer(layer_id)
+        if (layer['epoch'] != epoch):
+            layer = {'epoch': epoch, 'versions': {}}
+        self.__layers[layer_id] = layer
+        return layer
+
+    def __get_file_name_and_path(self, layer_id: int) -> str:
+        return os.path.join(self.cache_path, f'versions_{layer_id}.json')
+
+    def __load_layer(self, layer_id: int) -> dict:
+        try:
+            with open(self.__get_file_name_and_path(layer_id), 'r', encoding='utf-8') as cache_file:
+                data = json.load(cache_file)
+            # keys of JSON objects are strings
+            return {'epoch': data['epoch'], 'versions': {int(version): info for version, info in data['versions'].items()}}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {'epoch': None, 'versions': {}}
+
+    def __save_layer(self, layer_id: int) -> None:
+        if (not os.path.isdir(self.cache_path)): os.makedirs(self.cache_path)
+
+        file_name_and_path = self.__get_file_name_and_path(layer_id)
+        tmp_file_name_and_path = file_name_and_path+'.tmp'
+        with open(tmp_file_name_and_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(self.__layers[layer_id], cache_file, ensure_ascii=False)
+        os.replace(tmp_file_name_and_path, file_name_and_path)